@@ -0,0 +1,368 @@
+# aria2_rpc.py
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Aria2RPCError(Exception):
+    """Error object returned by aria2 for a JSON-RPC call"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"aria2 error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class Aria2RPC:
+    """Asyncio JSON-RPC client for aria2 using a pooled keep-alive HTTP session"""
+
+    RETRY_DELAY = 0.5
+
+    def __init__(self, host: str, port: int, secret: str = "", timeout: float = 10,
+                 max_retries: int = 3, pool_size: int = 8):
+        self.url = f"{host}:{port}/jsonrpc"
+        self.secret = secret
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.session = None
+        self._ids = itertools.count(1)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Create the pooled session on first use or after a reconnect"""
+        if not self.session or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self.session
+
+    async def _reset_session(self):
+        """Drop pooled connections so the next call reconnects"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _params(self, params) -> List[Any]:
+        """Prepend the RPC secret token to call parameters"""
+        if self.secret:
+            return [f"token:{self.secret}", *params]
+        return list(params)
+
+    async def call(self, method: str, *params, retry: bool = True) -> Any:
+        """Call an aria2 method, reconnecting on connection errors and timeouts.
+
+        Non-idempotent calls (``aria2.addUri``) should pass ``retry=False`` so a
+        call that timed out after reaching aria2 is not applied twice; those are
+        still retried when the connection could not be opened at all.
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": method,
+            "params": self._params(params)
+        }
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.monotonic()
+                async with self._get_session().post(self.url, json=payload) as response:
+                    data = await response.json(content_type=None)
+                metrics.ARIA2_RPC_SECONDS.labels(method).observe(time.monotonic() - started)
+                break
+            except aiohttp.ClientConnectorError as e:
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not retry:
+                    raise
+                error = e
+
+            await self._reset_session()
+            if attempt >= self.max_retries:
+                raise error
+            delay = self.RETRY_DELAY * (2 ** attempt)
+            logger.warning(f"aria2 RPC {method} failed ({error!r}), reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        if "error" in data:
+            raise Aria2RPCError(data["error"].get("code"), data["error"].get("message"))
+        return data.get("result")
+
+    async def multicall(self, calls: List[Tuple[str, list]]) -> List[Any]:
+        """Run several methods in one ``system.multicall`` round-trip.
+
+        Each item of the returned list is either the method result or an
+        ``Aria2RPCError`` instance for calls that failed individually.
+        """
+        if not calls:
+            return []
+        result = await self.call("system.multicall", [
+            {"methodName": method, "params": self._params(params)}
+            for method, params in calls
+        ])
+        return [
+            Aria2RPCError(item.get("code"), item.get("faultString", item.get("message")))
+            if isinstance(item, dict) else item[0]
+            for item in result
+        ]
+
+    async def close(self):
+        """Close pooled connections"""
+        await self._reset_session()
+
+
+class Aria2Download:
+    """Snapshot of a download's ``tellStatus`` fields with aria2p-style accessors"""
+
+    def __init__(self, rpc: Aria2RPC, status: Dict[str, Any]):
+        self.rpc = rpc
+        self.gid = status.get("gid")
+        self._status = {}
+        self.apply(status)
+
+    def apply(self, status: Dict[str, Any]):
+        """Merge freshly fetched status fields into the snapshot"""
+        self._status.update(status)
+
+    async def update(self, keys: Optional[List[str]] = None):
+        """Refresh the snapshot from aria2"""
+        params = [self.gid, keys] if keys else [self.gid]
+        self.apply(await self.rpc.call("aria2.tellStatus", *params))
+
+    @property
+    def status(self) -> str:
+        return self._status.get("status", "")
+
+    @property
+    def files(self) -> List[str]:
+        return [f.get("path") for f in self._status.get("files", []) if f.get("path")]
+
+    @property
+    def file_path(self) -> Optional[str]:
+        files = self.files
+        return files[0] if files else None
+
+    @property
+    def name(self) -> str:
+        path = self.file_path
+        if path:
+            return os.path.basename(path)
+        uris = [u.get("uri") for f in self._status.get("files", []) for u in f.get("uris", [])]
+        return uris[0].split("/")[-1].split("?")[0] if uris else self.gid
+
+    @property
+    def total_length(self) -> int:
+        return int(self._status.get("totalLength", 0))
+
+    @property
+    def completed_length(self) -> int:
+        return int(self._status.get("completedLength", 0))
+
+    @property
+    def download_speed(self) -> int:
+        return int(self._status.get("downloadSpeed", 0))
+
+    @property
+    def progress(self) -> float:
+        if not self.total_length:
+            return 0.0
+        return self.completed_length / self.total_length * 100
+
+    @property
+    def eta(self) -> float:
+        if not self.download_speed:
+            return float("inf")
+        return (self.total_length - self.completed_length) / self.download_speed
+
+    @property
+    def bitfield(self) -> str:
+        return self._status.get("bitfield", "")
+
+    @property
+    def piece_length(self) -> int:
+        return int(self._status.get("pieceLength", 0))
+
+    @property
+    def error_message(self) -> str:
+        return self._status.get("errorMessage", "")
+
+    @property
+    def is_complete(self) -> bool:
+        return self.status == "complete"
+
+    @property
+    def has_failed(self) -> bool:
+        return self.status == "error"
+
+    @property
+    def is_removed(self) -> bool:
+        return self.status == "removed"
+
+
+class Aria2NotificationWatcher:
+    """Single WebSocket subscriber that resolves per-GID completion futures.
+
+    aria2 pushes ``onDownloadComplete``/``onDownloadError``/``onDownloadStop``
+    notifications over its WebSocket RPC endpoint, so one connection replaces a
+    polling loop per job. After every (re)connect the GIDs still being waited on
+    are reconciled with ``tellStatus`` to catch notifications missed while the
+    socket was down.
+    """
+
+    EVENTS = {
+        "aria2.onDownloadComplete": "complete",
+        "aria2.onDownloadError": "error",
+        "aria2.onDownloadStop": "removed"
+    }
+    FINISHED_HISTORY = 1000
+
+    def __init__(self, rpc: Aria2RPC, ws_url: str, reconnect_delay: float = 2):
+        self.rpc = rpc
+        self.ws_url = ws_url
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._finished: Dict[str, str] = {}
+        self._task = None
+
+    def start(self):
+        """Start listening in the background"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop listening and release the socket"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wait_for(self, gid: str) -> asyncio.Future:
+        """Future resolved with the final status ("complete", "error" or "removed")"""
+        future = self._waiters.get(gid)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            if gid in self._finished:
+                future.set_result(self._finished.pop(gid))
+            else:
+                self._waiters[gid] = future
+        return future
+
+    def _resolve(self, gid: str, status: str):
+        future = self._waiters.pop(gid, None)
+        if future is None:
+            # Finished before anyone waited on it (e.g. a tiny file)
+            self._finished[gid] = status
+            if len(self._finished) > self.FINISHED_HISTORY:
+                self._finished.pop(next(iter(self._finished)))
+        elif not future.done():
+            future.set_result(status)
+
+    async def _reconcile(self):
+        """Resolve waiters whose notification was missed while disconnected"""
+        gids = list(self._waiters)
+        results = await self.rpc.multicall([
+            ("aria2.tellStatus", [gid, ["gid", "status"]]) for gid in gids
+        ])
+        for gid, result in zip(gids, results):
+            if isinstance(result, Aria2RPCError):
+                # aria2 no longer knows the GID (restarted or result purged)
+                self._resolve(gid, "removed")
+            elif result.get("status") in ("complete", "error", "removed"):
+                self._resolve(gid, result["status"])
+
+    async def _run(self):
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.ws_url, heartbeat=30) as ws:
+                        self.connected = True
+                        logger.info("Subscribed to aria2 notifications")
+                        await self._reconcile()
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                continue
+                            data = msg.json()
+                            status = self.EVENTS.get(data.get("method"))
+                            if status:
+                                for event in data.get("params", []):
+                                    self._resolve(event["gid"], status)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"aria2 notification socket error: {e}")
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class Aria2StatusSampler:
+    """Central sampler refreshing every watched download with one RPC per tick.
+
+    A single ``tellActive`` call restricted to the progress fields replaces a
+    full ``tellStatus`` per job, so RPC load stays constant however many jobs
+    are running. Snapshots are applied to the shared ``Aria2Download`` objects
+    that the status messages render from.
+    """
+
+    KEYS = ["gid", "status", "completedLength", "totalLength", "downloadSpeed"]
+
+    def __init__(self, rpc: Aria2RPC, interval: float = 2):
+        self.rpc = rpc
+        self.interval = interval
+        self.last_sample = 0.0
+        self._downloads: Dict[str, Aria2Download] = {}
+        self._task = None
+
+    def watch(self, download: Aria2Download):
+        """Keep a download's progress fields fresh until it is unwatched"""
+        self._downloads[download.gid] = download
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unwatch(self, gid: str):
+        self._downloads.pop(gid, None)
+
+    @property
+    def total_speed(self) -> int:
+        """Combined download speed of watched downloads at the last sample"""
+        return sum(download.download_speed for download in self._downloads.values())
+
+    async def sample(self):
+        """Fetch progress for all active downloads and fan it out"""
+        for status in await self.rpc.call("aria2.tellActive", self.KEYS):
+            download = self._downloads.get(status["gid"])
+            if download:
+                download.apply(status)
+        self.last_sample = asyncio.get_running_loop().time()
+
+    async def _run(self):
+        # Exits when nothing is watched; watch() restarts it on demand
+        while self._downloads:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.warning(f"aria2 status sampling failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,190 @@
+# aria2_tuner.py
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+from aria2_rpc import Aria2Download, Aria2RPC
+
+logger = logging.getLogger(__name__)
+
+
+class HostStats:
+    """Smoothed download speed from one CDN host by connection count"""
+
+    ALPHA = 0.3
+    GOOD_ENOUGH = 0.9  # Fewer connections win when they get this close to the best speed
+
+    def __init__(self):
+        self.speeds: Dict[int, float] = {}
+        self.downloads = 0
+
+    def record(self, speed: float, connections: int):
+        previous = self.speeds.get(connections)
+        self.speeds[connections] = speed if previous is None else previous + self.ALPHA * (speed - previous)
+        self.downloads += 1
+
+    def best_connections(self, max_connections: int) -> Optional[int]:
+        """Connection count to use next, doubling while more connections keep paying off"""
+        if not self.speeds:
+            return None
+        top = max(self.speeds.values())
+        best = min(count for count, speed in self.speeds.items() if speed >= top * self.GOOD_ENOUGH)
+        if best == max(self.speeds) and best < max_connections:
+            return min(max_connections, best * 2)
+        return best
+
+    def expected_speed(self, connections: int) -> float:
+        """Speed seen with the nearest connection count tried"""
+        if not self.speeds:
+            return 0.0
+        nearest = min(self.speeds, key=lambda count: abs(count - connections))
+        return self.speeds[nearest]
+
+
+class TunedDownload:
+    def __init__(self, download: Aria2Download, host: str, connections: int):
+        self.download = download
+        self.host = host
+        self.connections = connections
+        self.started = time.monotonic()
+        self.active_since: Optional[float] = None  # Time spent queued in aria2 doesn't count
+        self.retuned = 0.0
+        self.stalls = 0
+        self.limited = False  # Held back by a bandwidth limit at some point, so its speed says little
+
+
+class Aria2Tuner:
+    """Picks aria2 connection options per download and retunes stalled ones.
+
+    The connection count is capped by the file size, so every connection
+    gets at least ``SEGMENT_SIZE`` bytes. Within that, hosts start at
+    ``DEFAULT_CONNECTIONS`` and then use the fewest connections that came
+    close to their best speed on earlier big downloads, trying twice as
+    many while that keeps getting faster. Watched downloads whose speed
+    stays under ``STALL_RATIO`` of what the host delivered before (or
+    ``STALL_SPEED``) for ``STALL_CHECKS`` checks in a row get twice the
+    connections through ``aria2.changeOption``. aria2 restarts the
+    download to apply that (keeping what it already has), so each one is
+    retuned at most once per ``RETUNE_INTERVAL``. Downloads under a
+    bandwidth limit (from ``limit_of``) are only measured against that
+    limit and aren't learned from.
+    """
+
+    MIN_SPLIT_SIZE = 1024 * 1024  # aria2's lower bound
+    SEGMENT_SIZE = 4 * 1024 * 1024
+    MAX_CONNECTIONS = 16  # aria2's cap for max-connection-per-server
+    DEFAULT_CONNECTIONS = 8
+    CHECK_INTERVAL = 10
+    STALL_CHECKS = 2
+    STALL_RATIO = 0.25
+    STALL_SPEED = 256 * 1024  # Floor for hosts without history
+    RETUNE_INTERVAL = 60
+    LEARN_MIN_SIZE = 64 * 1024 * 1024  # Smaller files are dominated by connection setup
+
+    def __init__(self, rpc: Aria2RPC, limit_of: Callable[[str], int] = None):
+        self.rpc = rpc
+        self.limit_of = limit_of
+        self.hosts: Dict[str, HostStats] = {}
+        self.retunes = 0
+        self._watched: Dict[str, TunedDownload] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def connections_for(self, host: str, size: int) -> int:
+        stats = self.hosts.get(host)
+        preferred = (stats.best_connections(self.MAX_CONNECTIONS) if stats else None) or self.DEFAULT_CONNECTIONS
+        if not size:
+            return preferred
+        return max(1, min(preferred, size // self.SEGMENT_SIZE))
+
+    def options_for(self, url: str, size: int) -> Dict[str, str]:
+        """Per-download ``split``, ``max-connection-per-server`` and ``min-split-size``"""
+        connections = self.connections_for(self.host_of(url), size)
+        return {
+            "split": str(connections),
+            "max-connection-per-server": str(connections),
+            # aria2 never splits a range under twice this, so segments stay SEGMENT_SIZE or more
+            "min-split-size": f"{self.SEGMENT_SIZE // 2 // self.MIN_SPLIT_SIZE}M"
+        }
+
+    def watch(self, download: Aria2Download, url: str, connections: int):
+        """Follow a download's speed for stall detection; it must be kept fresh by the sampler"""
+        self._watched[download.gid] = TunedDownload(download, self.host_of(url), connections)
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def finish(self, download: Aria2Download):
+        """Stop watching and learn from the download's average speed"""
+        tuned = self._watched.pop(download.gid, None)
+        if not tuned or not download.is_complete or tuned.limited:
+            return
+        elapsed = time.monotonic() - (tuned.active_since or tuned.started)
+        if elapsed < 1 or download.total_length < self.LEARN_MIN_SIZE:
+            return
+        self.hosts.setdefault(tuned.host, HostStats()).record(download.total_length / elapsed, tuned.connections)
+
+    def _stalled(self, tuned: TunedDownload) -> bool:
+        stats = self.hosts.get(tuned.host)
+        expected = stats.expected_speed(tuned.connections) if stats else 0
+        floor = max(self.STALL_SPEED, expected * self.STALL_RATIO)
+        limit = self.limit_of(tuned.download.gid) if self.limit_of else 0
+        if limit:
+            tuned.limited = True
+            floor = min(floor, limit * self.STALL_RATIO)  # Slower on purpose isn't a stall
+        return tuned.download.download_speed < floor
+
+    async def _run(self):
+        # Exits when nothing is watched; watch() restarts it on demand
+        while self._watched:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            now = time.monotonic()
+            for tuned in list(self._watched.values()):
+                download = tuned.download
+                if download.status != "active":
+                    continue
+                if tuned.active_since is None:
+                    tuned.active_since = now
+                    continue  # Give new connections a check interval to ramp up
+                tuned.stalls = tuned.stalls + 1 if self._stalled(tuned) else 0
+                if (tuned.stalls >= self.STALL_CHECKS and tuned.connections < self.MAX_CONNECTIONS
+                        and now - tuned.retuned >= self.RETUNE_INTERVAL):
+                    await self._retune(tuned)
+
+    async def _retune(self, tuned: TunedDownload):
+        download = tuned.download
+        remaining = download.total_length - download.completed_length
+        connections = min(self.MAX_CONNECTIONS, tuned.connections * 2,
+                          max(1, remaining // self.MIN_SPLIT_SIZE))
+        if connections <= tuned.connections:
+            return
+        try:
+            await self.rpc.call("aria2.changeOption", download.gid, {
+                "split": str(connections),
+                "max-connection-per-server": str(connections)
+            })
+        except Exception as e:
+            logger.warning(f"Could not retune {download.gid}: {e}")
+            return
+        logger.info(f"Download {download.gid} stalled at {download.download_speed} B/s, "
+                    f"raising connections {tuned.connections} -> {connections}")
+        tuned.connections = connections
+        tuned.retuned = time.monotonic()
+        tuned.stalls = 0
+        self.retunes += 1
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        return {"hosts": len(self.hosts), "watched": len(self._watched), "retunes": self.retunes}
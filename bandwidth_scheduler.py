@@ -0,0 +1,216 @@
+# bandwidth_scheduler.py
+import asyncio
+import itertools
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aria2_rpc import Aria2Download, Aria2RPC
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledDownload:
+    def __init__(self, download: Aria2Download, user_id: int, size: int, admin: bool, seq: int):
+        self.download = download
+        self.user_id = user_id
+        self.size = size
+        self.admin = admin
+        self.seq = seq
+        self.limit = 0  # max-download-limit last applied, 0 = unlimited
+
+    @property
+    def remaining(self) -> int:
+        total = self.download.total_length or self.size
+        return max(0, total - self.download.completed_length)
+
+
+class BandwidthScheduler:
+    """Fair share of download bandwidth across users.
+
+    aria2 splits bandwidth by connection count, so one user's big file
+    can starve everyone else. Every ``REBALANCE_INTERVAL`` (and at once
+    when a download is added or removed) active downloads get a
+    ``max-download-limit`` from a weighted max-min split of the capacity:
+    each user weighs 1 (``ADMIN_WEIGHT`` for admins), shared between
+    their downloads with files that have less than ``SMALL_FILE_SIZE``
+    left counting ``SMALL_WEIGHT`` times. Downloads running well below
+    their limit are held back by the host, and what they don't use goes
+    to the rest. aria2's waiting queue is reordered the same way: admins,
+    then small files, then round robin over users.
+
+    The capacity is ``total_bandwidth``, or when that is 0 the recent
+    peak of the combined speed plus ``HEADROOM``, so limits leave room
+    to find out the link got faster. Without a configured total and with
+    a single active user nothing is limited.
+    """
+
+    REBALANCE_INTERVAL = 5
+    ADMIN_WEIGHT = 3
+    SMALL_WEIGHT = 2
+    SMALL_FILE_SIZE = 200 * 1024 * 1024
+    MIN_LIMIT = 64 * 1024  # Nobody is throttled to a standstill
+    SATURATED = 0.8  # Speed above this share of the limit means the limit is what holds it back
+    HEADROOM = 1.25
+    PEAK_DECAY = 0.98  # Per rebalance, so the estimate follows a link that got slower
+    CHANGE_THRESHOLD = 0.1  # Smaller limit changes aren't worth an RPC
+
+    def __init__(self, rpc: Aria2RPC, total_bandwidth: int = 0):
+        self.rpc = rpc
+        self.total_bandwidth = total_bandwidth
+        self.peak_speed = 0.0
+        self.rebalances = 0
+        self.reorders = 0
+        self._downloads: Dict[str, ScheduledDownload] = {}
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, download: Aria2Download, user_id: int, size: int = 0, admin: bool = False):
+        """Schedule a download; its progress fields must be kept fresh by the sampler"""
+        self._downloads[download.gid] = ScheduledDownload(download, user_id, size, admin, next(self._seq))
+        self._wake.set()
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, gid: str):
+        """Stop scheduling a download and hand its bandwidth to the others right away"""
+        if self._downloads.pop(gid, None):
+            self._wake.set()
+
+    def limit_of(self, gid: str) -> int:
+        """Limit currently applied to a download, 0 if it is unlimited"""
+        scheduled = self._downloads.get(gid)
+        return scheduled.limit if scheduled else 0
+
+    async def _run(self):
+        # Exits when nothing is scheduled; add() restarts it on demand
+        while self._downloads:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.REBALANCE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._downloads:
+                break
+            try:
+                await self.rebalance()
+            except Exception as e:
+                logger.warning(f"Bandwidth rebalance failed: {e}")
+
+    async def rebalance(self):
+        waiting = [status["gid"] for status in await self.rpc.call("aria2.tellWaiting", 0, 1000, ["gid"])]
+        queued = set(waiting)
+        # Anything aria2 isn't queueing is running, even before the sampler has seen it start
+        active = [scheduled for gid, scheduled in self._downloads.items()
+                  if gid not in queued and scheduled.download.status not in ("complete", "error", "removed")]
+        calls = self._queue_moves(waiting, active) + self._limit_changes(active)
+        if not calls:
+            return
+        for (method, params), result in zip(calls, await self.rpc.multicall(calls)):
+            if isinstance(result, Exception):
+                logger.debug(f"{method} {params[0]} failed: {result}")
+        self.rebalances += 1
+
+    def _priority(self, scheduled: ScheduledDownload) -> Tuple[bool, bool]:
+        return not scheduled.admin, scheduled.remaining >= self.SMALL_FILE_SIZE
+
+    def _queue_moves(self, waiting: List[str], active: List[ScheduledDownload]) -> List[Tuple[str, list]]:
+        """``changePosition`` calls putting our waiting downloads in priority order at the front"""
+        mine = [self._downloads[gid] for gid in waiting if gid in self._downloads]
+        # Round robin inside each priority class: a user's n-th queued job goes after everyone's (n-1)-th
+        ahead = {}
+        for scheduled in active:
+            ahead[scheduled.user_id] = ahead.get(scheduled.user_id, 0) + 1
+        turns = {}
+        for scheduled in sorted(mine, key=lambda s: (self._priority(s), s.seq)):
+            turns[scheduled.download.gid] = ahead.get(scheduled.user_id, 0)
+            ahead[scheduled.user_id] = turns[scheduled.download.gid] + 1
+        ordered = sorted(mine, key=lambda s: (self._priority(s), turns[s.download.gid], s.seq))
+        if [s.download.gid for s in ordered] == waiting[:len(ordered)]:
+            return []
+        self.reorders += 1
+        return [("aria2.changePosition", [s.download.gid, position, "POS_SET"])
+                for position, s in enumerate(ordered)]
+
+    def _capacity(self, active: List[ScheduledDownload]) -> float:
+        if self.total_bandwidth:
+            return self.total_bandwidth
+        total = sum(s.download.download_speed for s in active)
+        self.peak_speed = max(total, self.peak_speed * self.PEAK_DECAY)
+        return self.peak_speed * self.HEADROOM
+
+    def _limit_changes(self, active: List[ScheduledDownload]) -> List[Tuple[str, list]]:
+        """``changeOption`` calls applying a fresh fair share; aria2 applies these without a restart"""
+        capacity = self._capacity(active)
+        if not active:
+            return []
+        if not self.total_bandwidth and (len({s.user_id for s in active}) < 2 or not capacity):
+            limits = {s.download.gid: 0 for s in active}
+        else:
+            limits = self.fair_shares(capacity, active)
+        calls = []
+        for scheduled in active:
+            limit = limits[scheduled.download.gid]
+            if (bool(limit) == bool(scheduled.limit) and
+                    abs(limit - scheduled.limit) <= scheduled.limit * self.CHANGE_THRESHOLD):
+                continue
+            scheduled.limit = limit
+            calls.append(("aria2.changeOption", [scheduled.download.gid, {"max-download-limit": str(limit)}]))
+        return calls
+
+    def fair_shares(self, capacity: float, active: List[ScheduledDownload]) -> Dict[str, int]:
+        """Weighted max-min split of ``capacity`` bytes/s by GID"""
+        user_weights: Dict[int, float] = {}
+        for scheduled in active:
+            user_weights[scheduled.user_id] = user_weights.get(scheduled.user_id, 0) + self._weight(scheduled)
+        pending = []
+        for scheduled in active:
+            user_weight = self.ADMIN_WEIGHT if scheduled.admin else 1
+            weight = user_weight * self._weight(scheduled) / user_weights[scheduled.user_id]
+            pending.append((scheduled.download.gid, weight, self._demand(scheduled)))
+
+        # Fill everyone evenly by weight; whoever needs less than their share gets what they need
+        shares = {}
+        remaining = capacity
+        while pending:
+            total_weight = sum(weight for _, weight, _ in pending)
+            satisfied = [(gid, demand) for gid, weight, demand in pending
+                         if demand <= remaining * weight / total_weight]
+            if not satisfied:
+                for gid, weight, _ in pending:
+                    shares[gid] = remaining * weight / total_weight
+                break
+            for gid, demand in satisfied:
+                shares[gid] = demand
+                remaining -= demand
+            pending = [entry for entry in pending if entry[0] not in shares]
+        return {gid: max(self.MIN_LIMIT, int(share)) for gid, share in shares.items()}
+
+    def _weight(self, scheduled: ScheduledDownload) -> float:
+        return self.SMALL_WEIGHT if scheduled.remaining < self.SMALL_FILE_SIZE else 1
+
+    def _demand(self, scheduled: ScheduledDownload) -> float:
+        """Bandwidth a download can use; unbounded unless it runs well under its limit"""
+        speed = scheduled.download.download_speed
+        if scheduled.limit and speed < scheduled.limit * self.SATURATED:
+            return max(self.MIN_LIMIT, speed / self.SATURATED)
+        return float("inf")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        limited = [s for s in self._downloads.values() if s.limit]
+        return {
+            "downloads": len(self._downloads),
+            "users": len({s.user_id for s in self._downloads.values()}),
+            "limited": len(limited),
+            "capacity": self.total_bandwidth or int(self.peak_speed * self.HEADROOM),
+            "reorders": self.reorders
+        }
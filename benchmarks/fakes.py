@@ -0,0 +1,195 @@
+# fakes.py
+import asyncio
+import itertools
+import os
+import random
+import shutil
+import struct
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+from pyrogram.errors import FloodWait
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.first_name = f"bench{user_id}"
+
+
+class FakeMedia:
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    """Just enough of ``pyrogram.types.Message`` for the leech pipeline"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client: "FakeClient", chat_id: int, user_id: int = None, text: str = "",
+                 file_id: str = None):
+        self.id = next(self._ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(user_id or chat_id)
+        self.text = text
+        self.video = FakeMedia(file_id) if file_id else None
+        self.document = None
+        self._client = client
+
+    async def edit_text(self, text: str, reply_markup=None):
+        await self._client.call("edit_message")
+        self.text = text
+        return self
+
+
+class FakeClient:
+    """Stand-in for the bot's pyrogram client.
+
+    Every call is counted by method, takes ``latency`` seconds and raises
+    a FloodWait with probability ``floodwait_rate``. Sending a local file
+    takes ``size / upload_rate`` seconds more, as if it were uploaded.
+    """
+
+    def __init__(self, latency: float = 0.05, floodwait_rate: float = 0.0, floodwait_seconds: int = 3,
+                 upload_rate: float = 20 * 1024 * 1024, seed: int = None):
+        self.name = "bench-bot"
+        self.latency = latency
+        self.floodwait_rate = floodwait_rate
+        self.floodwait_seconds = floodwait_seconds
+        self.upload_rate = upload_rate
+        self.calls: Counter = Counter()
+        self.floodwaits: Counter = Counter()
+        self.uploaded_bytes = 0
+        self._random = random.Random(seed)
+        self._file_ids = itertools.count(1)
+
+    async def call(self, method: str):
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.floodwait_rate:
+            self.floodwaits[method] += 1
+            raise FloodWait(value=self.floodwait_seconds)
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **kwargs):
+        await self.call("send_message")
+        return FakeMessage(self, chat_id, text=text)
+
+    async def _send_file(self, method: str, chat_id: int, file: str, caption: str = None) -> FakeMessage:
+        await self.call(method)
+        if os.path.isfile(file):
+            size = os.path.getsize(file)
+            await asyncio.sleep(size / self.upload_rate)
+            self.uploaded_bytes += size
+            file = f"bench-file-{next(self._file_ids)}"
+        return FakeMessage(self, chat_id, text=caption or "", file_id=file)
+
+    async def send_video(self, chat_id: int, video: str, caption: str = None, reply_markup=None,
+                         progress=None, **kwargs):
+        return await self._send_file("send_video", chat_id, video, caption)
+
+    async def send_document(self, chat_id: int, document: str, caption: str = None, reply_markup=None,
+                            **kwargs):
+        message = await self._send_file("send_document", chat_id, document, caption)
+        message.document, message.video = message.video, None
+        return message
+
+    async def send_media_group(self, chat_id: int, media: list, **kwargs):
+        await self.call("send_media_group")
+        return [FakeMessage(self, chat_id) for _ in media]
+
+    async def get_messages(self, chat_id: int, message_id: int):
+        await self.call("get_messages")
+        return FakeMessage(self, chat_id)
+
+
+def unique_copy(source: str, target: str, tag: str) -> int:
+    """Copy an MP4 with a trailing ``free`` box so every share has distinct content.
+
+    The bot deduplicates by name, size and content hash, so identical
+    copies would skip the download and upload being measured.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copyfile(source, target)
+    payload = tag.encode().ljust(64, b"\0")
+    with open(target, "ab") as f:
+        f.write(struct.pack(">I4s", 8 + len(payload), b"free") + payload)
+    return os.path.getsize(target)
+
+
+class FakeTeraBox:
+    """Extraction API and file host on one local aiohttp server.
+
+    ``/api?url=<share url>`` answers in the format of the real workers
+    after ``latency`` (plus up to ``jitter``) seconds, failing with
+    probability ``failure_rate``. ``/files/<share>/<name>`` serves the
+    share's file with range support, so aria2 can split the download.
+    """
+
+    def __init__(self, files_dir: str, source_files: list, latency: float = 0.5, jitter: float = 0.2,
+                 failure_rate: float = 0.0, seed: int = None):
+        self.files_dir = files_dir
+        self.source_files = source_files
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.api_calls: Counter = Counter()  # share_id -> calls
+        self.failures = 0
+        self.base_url = ""
+        self._shares: Dict[str, Tuple[str, int]] = {}
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/api", self.api)
+        self.app.router.add_get("/files/{share}/{name}", self.file)
+
+    def api_template(self) -> str:
+        return f"{self.base_url}/api?url={{}}"
+
+    def add_share(self, share_id: str) -> str:
+        source = self.source_files[len(self._shares) % len(self.source_files)]
+        name = f"{share_id}-{os.path.basename(source)}"
+        path = os.path.join(self.files_dir, share_id, name)
+        self._shares[share_id] = (name, unique_copy(source, path, share_id))
+        return f"https://www.terabox.com/s/1{share_id}"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def api(self, request: web.Request) -> web.Response:
+        share_id = request.query.get("url", "").rstrip("/").rpartition("/")[2][1:]
+        self.api_calls[share_id] += 1
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        if share_id not in self._shares or self._random.random() < self.failure_rate:
+            self.failures += 1
+            return web.json_response({"success": False, "error": "upstream failure"}, status=502)
+        name, size = self._shares[share_id]
+        return web.json_response({
+            "success": True,
+            "direct_link": f"{self.base_url}/files/{share_id}/{name}",
+            "name": name,
+            "size": f"{size / 1024 / 1024:.2f} MB",
+            "size_bytes": size
+        })
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        path = os.path.join(self.files_dir, request.match_info["share"], request.match_info["name"])
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
@@ -0,0 +1,208 @@
+# pipeline_bench.py
+"""Offline end-to-end benchmark of the leech pipeline.
+
+Runs ``BotManager.handle_download_process`` for simulated users against
+local stand-ins: a fake extraction API and file host (serving copies of
+the repo's sample videos), a real aria2c started on a private port, and
+a fake Telegram client that records calls and can inject FloodWaits.
+Nothing leaves the machine and no credentials are needed.
+
+    python benchmarks/pipeline_bench.py --users 4 --jobs 3 --floodwait-rate 0.05
+
+Reports jobs per minute, p50/p95 per stage (from the job traces) and
+extraction API and Telegram calls per job.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from fakes import FakeClient, FakeMessage, FakeTeraBox
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILES = [os.path.join(REPO_DIR, "tera.mp4"), os.path.join(REPO_DIR, "Jet-Mirror.mp4")]
+STAGES = ("extract", "aria2_add", "download", "content_hash", "video_meta", "upload", "deliver")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def prepare_environment(workdir: str, args) -> dict:
+    """Settings for ``terabox.Config``; the bot is imported from inside ``workdir``
+    so its databases, logs and downloads stay there and no ``config.env`` is read"""
+    download_dir = os.path.join(workdir, "downloads")
+    os.makedirs(download_dir)
+    env = {
+        "TELEGRAM_API": "1",
+        "TELEGRAM_HASH": "bench",
+        "BOT_TOKEN": "1:bench",
+        "DUMP_CHAT_ID": "-1001",
+        "FSUB_ID": "-1002",
+        "DOWNLOAD_DIR": download_dir,
+        "LINK_CACHE_DB": "",
+        "FILE_INDEX_DB": os.path.join(workdir, "file_index.db"),
+        "JOB_JOURNAL_DB": os.path.join(workdir, "job_journal.db"),
+        "TRACE_FILE": os.path.join(workdir, "traces.jsonl"),
+        "TRACE_MAX_BYTES": str(1024 * 1024 * 1024),
+        "STREAM_CACHE_DIR": os.path.join(workdir, "stream_cache"),
+        "STREAMING_UPLOAD": "false",
+        "PORT": str(free_port()),
+        "WEB_HOST": "127.0.0.1",
+    }
+    os.environ.update(env)
+    return env
+
+
+async def start_aria2(aria2c: str, port: int, download_dir: str) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [aria2c, "--enable-rpc", f"--rpc-listen-port={port}", "--rpc-listen-all=false",
+         f"--dir={download_dir}", "--quiet=true", "--daemon=false"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(50):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"aria2c did not open its RPC port {port}")
+
+
+def read_traces(path: str) -> list:
+    traces = []
+    for name in sorted(os.listdir(os.path.dirname(path))):
+        if name.startswith(os.path.basename(path)):
+            with open(os.path.join(os.path.dirname(path), name), encoding="utf-8") as f:
+                traces.extend(json.loads(line) for line in f if line.strip())
+    return traces
+
+
+def report(args, traces: list, elapsed: float, api: FakeTeraBox, client: FakeClient) -> str:
+    jobs = len(traces)
+    succeeded = sum(1 for trace in traces if any(span["name"] == "deliver" and span["status"] == "ok"
+                                                  for span in trace["spans"]))
+    stage_times = defaultdict(list)
+    for trace in traces:
+        stage_times["total"].append(trace["duration"])
+        per_job = defaultdict(float)
+        for span in trace["spans"]:
+            if span["name"] in STAGES or span["name"] == "floodwait_sleep":
+                per_job[span["name"]] += span["duration"]
+        for name, seconds in per_job.items():
+            stage_times[name].append(seconds)
+
+    lines = [
+        f"Users: {args.users}, jobs per user: {args.jobs}, API latency: {args.api_latency}s, "
+        f"API failure rate: {args.api_failure_rate:.0%}, FloodWait rate: {args.floodwait_rate:.0%}",
+        f"Jobs: {jobs} ({succeeded} delivered) in {elapsed:.1f}s = {jobs / elapsed * 60:.1f} jobs/min",
+        "",
+        f"{'stage':<16}{'p50 (s)':>10}{'p95 (s)':>10}{'jobs':>7}",
+    ]
+    for name in STAGES + ("floodwait_sleep", "total"):
+        values = stage_times.get(name)
+        if values:
+            lines.append(f"{name:<16}{percentile(values, 0.5):>10.3f}{percentile(values, 0.95):>10.3f}"
+                         f"{len(values):>7}")
+
+    per_job = max(jobs, 1)
+    lines += ["", f"Extraction API calls per job: {sum(api.api_calls.values()) / per_job:.2f} "
+                  f"({api.failures} failed)",
+              "Telegram calls per job:"]
+    for method, count in sorted(client.calls.items()):
+        injected = client.floodwaits.get(method, 0)
+        lines.append(f"  {method:<18}{count / per_job:>7.2f}" + (f"  ({injected} FloodWaits)" if injected else ""))
+    return "\n".join(lines)
+
+
+async def run(args) -> str:
+    workdir = tempfile.mkdtemp(prefix="terabox-bench-")
+    env = prepare_environment(workdir, args)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import terabox  # Reads the environment prepared above
+
+    api = FakeTeraBox(os.path.join(workdir, "files"), SAMPLE_FILES, args.api_latency, args.api_jitter,
+                      args.api_failure_rate, args.seed)
+    client = FakeClient(args.telegram_latency, args.floodwait_rate, args.floodwait_seconds,
+                        args.upload_rate * 1024 * 1024, args.seed)
+    aria2_port = free_port()
+    aria2 = await start_aria2(args.aria2c, aria2_port, env["DOWNLOAD_DIR"])
+    await api.start()
+
+    # Point the bot at the stand-ins
+    config = terabox.config
+    config.API_ENDPOINTS = [api.api_template()]
+    config.ARIA2_PORT = aria2_port
+    config.ARIA2_WS_URL = f"ws://localhost:{aria2_port}/jsonrpc"
+    manager = terabox.bot_manager
+    manager.extractor = terabox.TeraBoxExtractor()
+    manager.aria2 = terabox.Aria2Manager()
+    manager.app = client
+    manager.uploaders = terabox.UploadClientPool(flood_until=terabox.SafeMessaging.limiter.flood_until)
+    manager.uploaders.add(client, "bot", config.BOT_UPLOAD_LIMIT, is_bot=True)
+
+    try:
+        await manager.start()
+
+        async def user(user_id: int):
+            for job in range(args.jobs):
+                url = api.add_share(f"bench{user_id}x{job}")
+                message = FakeMessage(client, user_id, user_id, text=url)
+                await manager.handle_download_process(client, message, url)
+
+        started = time.monotonic()
+        await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.monotonic() - started
+    finally:
+        await terabox.cleanup()
+        await api.stop()
+        aria2.terminate()
+        aria2.wait()
+
+    result = report(args, read_traces(env["TRACE_FILE"]), elapsed, api, client)
+    os.chdir(REPO_DIR)
+    if args.keep:
+        result += f"\n\nWork directory kept at {workdir}"
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--jobs", type=int, default=3, help="links each user sends, one after another")
+    parser.add_argument("--api-latency", type=float, default=0.5, help="extraction API base latency (s)")
+    parser.add_argument("--api-jitter", type=float, default=0.2, help="extra random API latency (s)")
+    parser.add_argument("--api-failure-rate", type=float, default=0.0, help="fraction of API calls that fail")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="latency of each Telegram call (s)")
+    parser.add_argument("--floodwait-rate", type=float, default=0.0, help="fraction of Telegram calls answered with FloodWait")
+    parser.add_argument("--floodwait-seconds", type=int, default=3, help="length of injected FloodWaits")
+    parser.add_argument("--upload-rate", type=float, default=20, help="simulated upload speed (MB/s)")
+    parser.add_argument("--aria2c", default=shutil.which("aria2c") or "aria2c", help="aria2c binary")
+    parser.add_argument("--seed", type=int, default=None, help="seed for injected latency and failures")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory with traces and logs")
+    args = parser.parse_args()
+    print(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# disk_manager.py
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class Reservation:
+    """Space promised to one job and the aria2 download filling it"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.download = None
+
+    @property
+    def path(self) -> Optional[str]:
+        path = self.download.file_path if self.download else None
+        return os.path.abspath(path) if path else None
+
+    def written(self) -> int:
+        """Bytes already on disk: allocated blocks (all of them once preallocated) or downloaded"""
+        if not self.download:
+            return 0
+        try:
+            allocated = os.stat(self.path).st_blocks * 512 if self.path else 0
+        except OSError:
+            allocated = 0
+        return max(allocated, self.download.completed_length)
+
+
+class DiskManager:
+    """Free-space accounting and cleanup for the download directory.
+
+    Jobs reserve their expected size before the download starts. Space a
+    reservation still owes (its size minus what its download has written)
+    counts as used, so parallel jobs aren't all admitted against the same
+    free bytes. Admission stops below ``low_watermark``; whenever free
+    space falls under ``high_watermark`` files no job or aria2 download
+    uses are evicted, least recently modified first. Files touched
+    within ``orphan_min_age`` seconds are never evicted, which covers
+    downloads whose path isn't known yet.
+    """
+
+    CHECK_INTERVAL = 60
+
+    def __init__(self, directory: str, low_watermark: int, high_watermark: int,
+                 falloc_min_size: int = 64 * 1024 * 1024, orphan_min_age: int = 1800,
+                 in_use: Callable[[], Awaitable[Iterable[str]]] = None):
+        self.directory = os.path.abspath(directory)
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self.falloc_min_size = falloc_min_size
+        self.orphan_min_age = orphan_min_age
+        self.in_use = in_use
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._reservations: Dict[str, Reservation] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def free(self) -> int:
+        return psutil.disk_usage(self.directory).free
+
+    def outstanding(self) -> int:
+        """Bytes reserved jobs will still write"""
+        return sum(max(0, r.size - r.written()) for r in self._reservations.values())
+
+    def available(self) -> int:
+        return self.free() - self.outstanding()
+
+    def capacity(self) -> int:
+        """Largest job that could ever be admitted, with the disk emptied of everything else"""
+        return psutil.disk_usage(self.directory).total - self.low_watermark
+
+    def can_admit(self, size: int = 0) -> bool:
+        if self.available() - size >= self.low_watermark:
+            return True
+        self._wake.set()  # Make room for the job that is waiting
+        return False
+
+    def reserve(self, key: str, size: int) -> bool:
+        """Hold ``size`` bytes for ``key``; False if that would cross the low watermark"""
+        if key in self._reservations:
+            self.release(key)
+        if not self.can_admit(size):
+            return False
+        self._reservations[key] = Reservation(size)
+        return True
+
+    def attach(self, key: str, download):
+        """Link a reservation to its ``Aria2Download`` so written bytes are credited"""
+        reservation = self._reservations.get(key)
+        if reservation:
+            reservation.download = download
+
+    def release(self, key: str):
+        self._reservations.pop(key, None)
+        self._wake.set()
+
+    def file_allocation(self, size: int) -> str:
+        """aria2 ``file-allocation`` for a download of ``size`` bytes.
+
+        Big files are allocated up front with fallocate so they come out
+        contiguous and a full disk fails the job at once instead of midway;
+        small ones aren't worth the extra call.
+        """
+        return "falloc" if size >= self.falloc_min_size else "none"
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                shortfall = self.high_watermark - self.available()
+                if shortfall > 0:
+                    await self.evict(shortfall)
+            except Exception as e:
+                logger.error(f"Disk cleanup failed: {e}")
+
+    async def _paths_in_use(self) -> List[str]:
+        paths = [r.path for r in self._reservations.values() if r.path]
+        if self.in_use:
+            paths.extend(os.path.abspath(path) for path in await self.in_use() if path)
+        return paths
+
+    async def evict(self, needed: int = None) -> Tuple[int, int]:
+        """Delete orphaned files oldest first until ``needed`` bytes are freed (all if None).
+
+        Returns (files, bytes) removed.
+        """
+        in_use = await self._paths_in_use()
+        files, freed = await asyncio.to_thread(self._evict, in_use, needed)
+        if files:
+            self.evicted_files += files
+            self.evicted_bytes += freed
+            logger.info(f"Evicted {files} orphaned files ({freed} bytes) from {self.directory}")
+        return files, freed
+
+    def _orphans(self, in_use: List[str]) -> List[Tuple[float, str, int]]:
+        cutoff = time.time() - self.orphan_min_age
+        orphans = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                # Control files, thumbnails and split parts share their file's path as a prefix
+                if any(path.startswith(used) for used in in_use):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    orphans.append((stat.st_mtime, path, stat.st_blocks * 512))
+        return sorted(orphans)
+
+    def _evict(self, in_use: List[str], needed: Optional[int]) -> Tuple[int, int]:
+        files = freed = 0
+        for _, path, size in self._orphans(in_use):
+            if needed is not None and freed >= needed:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+                continue
+            files += 1
+            freed += size
+        return files, freed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "free": self.free(),
+            "outstanding": self.outstanding(),
+            "reservations": len(self._reservations),
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes
+        }
@@ -0,0 +1,81 @@
+# endpoint_health.py
+import time
+
+
+class EndpointHealth:
+    """Latency/success EWMA and circuit breaker for one extraction API endpoint.
+
+    After ``FAILURE_THRESHOLD`` consecutive failures the circuit opens and the
+    endpoint is skipped for a cooldown that doubles on every failed probe.
+    Once the cooldown passes a single request is let through as a probe
+    (half-open); success closes the circuit again.
+    """
+
+    ALPHA = 0.3
+    DEFAULT_LATENCY = 5.0
+    FAILURE_THRESHOLD = 3
+    BASE_COOLDOWN = 30
+    MAX_COOLDOWN = 600
+    MIN_HEDGE_DELAY = 0.3
+    MAX_HEDGE_DELAY = 5.0
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency = None
+        self.latency_dev = 0.0
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.cooldown = self.BASE_COOLDOWN
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < self.FAILURE_THRESHOLD:
+            return "closed"
+        return "half-open" if time.monotonic() >= self.open_until else "open"
+
+    def available(self) -> bool:
+        """Whether a request may be sent now"""
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.probing)
+
+    def begin(self):
+        """Mark a request as launched; in half-open state it is the single probe"""
+        if self.state != "closed":
+            self.probing = True
+
+    def score(self) -> float:
+        """Expected seconds to a valid answer; lower ranks first"""
+        latency = self.latency if self.latency is not None else self.DEFAULT_LATENCY
+        return latency / max(self.success_rate, 0.05)
+
+    def hedge_delay(self) -> float:
+        """How long to wait for this endpoint before racing the next one"""
+        if self.latency is None:
+            return 2.0
+        delay = self.latency + 2 * self.latency_dev
+        return min(max(delay, self.MIN_HEDGE_DELAY), self.MAX_HEDGE_DELAY)
+
+    def _observe(self, latency: float, success: bool):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency_dev += self.ALPHA * (abs(latency - self.latency) - self.latency_dev)
+            self.latency += self.ALPHA * (latency - self.latency)
+        self.success_rate += self.ALPHA * ((1.0 if success else 0.0) - self.success_rate)
+        self.probing = False
+
+    def record_success(self, latency: float):
+        self._observe(latency, True)
+        self.consecutive_failures = 0
+        self.cooldown = self.BASE_COOLDOWN
+
+    def record_failure(self, latency: float):
+        was_probe = self.state == "half-open"
+        self._observe(latency, False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.FAILURE_THRESHOLD:
+            if was_probe:
+                self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN)
+            self.open_until = time.monotonic() + self.cooldown
@@ -0,0 +1,90 @@
+# file_index.py
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FileIndex:
+    """Persistent index of uploaded Telegram file_ids.
+
+    A file can be found by the share ID it was leeched from, by its
+    filename and size as reported by the extraction API, or by a content hash
+    computed after download, so different links to the same file hit too.
+    """
+
+    HASH_CHUNK = 4 * 1024 * 1024
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_id TEXT NOT NULL, share_id TEXT, filename TEXT, size INTEGER, "
+            "content_hash TEXT, created_at REAL NOT NULL)"
+        )
+        for column in ("share_id", "filename, size", "content_hash"):
+            name = column.replace(", ", "_")
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_files_{name} ON files ({column})")
+        self._db.commit()
+
+    def _execute(self, query: str, params: tuple = ()):
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+            self._db.commit()
+            return rows
+
+    async def _first(self, where: str, params: tuple) -> Optional[str]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT file_id FROM files WHERE {where} ORDER BY created_at DESC LIMIT 1",
+            params
+        )
+        return rows[0][0] if rows else None
+
+    async def find_by_share(self, share_id: str) -> Optional[str]:
+        return await self._first("share_id = ?", (share_id,))
+
+    async def find_by_name(self, filename: str, size: int) -> Optional[str]:
+        if not filename or not size:
+            return None
+        return await self._first("filename = ? AND size = ?", (filename, int(size)))
+
+    async def find_by_hash(self, content_hash: str) -> Optional[str]:
+        return await self._first("content_hash = ?", (content_hash,))
+
+    async def record(self, file_id: str, share_id: str = None, filename: str = None,
+                     size: int = None, content_hash: str = None):
+        """Remember an uploaded file under every key that is known for it"""
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO files (file_id, share_id, filename, size, content_hash, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (file_id, share_id, filename, int(size) if size else None, content_hash, time.time())
+        )
+
+    async def forget(self, file_id: str):
+        """Drop a file_id Telegram no longer accepts"""
+        await asyncio.to_thread(self._execute, "DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    @classmethod
+    def content_hash(cls, path: str) -> str:
+        """Sample hash over size, head, middle and tail; cheap for multi-GB files"""
+        size = os.path.getsize(path)
+        digest = hashlib.sha256(str(size).encode())
+        with open(path, "rb") as f:
+            for offset in (0, max(0, size // 2 - cls.HASH_CHUNK // 2), max(0, size - cls.HASH_CHUNK)):
+                f.seek(offset)
+                digest.update(f.read(cls.HASH_CHUNK))
+        return digest.hexdigest()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,111 @@
+# flood_limiter.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from asyncio_throttle import Throttler
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class FloodLimiter:
+    """Paces Telegram calls per client with global, per-chat and per-method buckets.
+
+    Every call waits for any FloodWait deadline on its scopes, then takes a
+    slot from the chat, method and client-wide throttlers in that order
+    (slowest first, so a call waiting on a busy chat doesn't hold a global
+    slot). A FloodWait blocks the chat it happened in for every task; waits
+    longer than ``GLOBAL_FLOOD_THRESHOLD`` are usually account-wide and
+    block the whole client.
+    """
+
+    GLOBAL_RATE = (30, 1.0)  # Bot API guidance: about 30 calls a second overall
+    PRIVATE_CHAT_RATE = (1, 1.0)
+    GROUP_CHAT_RATE = (20, 60.0)
+    METHOD_RATES = {
+        "send_message": (20, 1.0),
+        "edit_message": (20, 1.0),
+        "send_video": (5, 1.0),
+        "send_document": (5, 1.0),
+        "send_media_group": (10, 60.0),
+    }
+    GLOBAL_FLOOD_THRESHOLD = 30
+    MAX_CHAT_THROTTLERS = 10000
+
+    def __init__(self):
+        self._global: Dict[object, Throttler] = {}
+        self._methods: Dict[Tuple[object, str], Throttler] = {}
+        self._chats: "OrderedDict[Tuple[object, int], Throttler]" = OrderedDict()
+        self._deadlines: Dict[tuple, float] = {}
+        self.flood_waits = 0
+
+    def _chat_throttler(self, client, chat_id: int) -> Throttler:
+        key = (client, chat_id)
+        throttler = self._chats.get(key)
+        if throttler is None:
+            rate, period = self.GROUP_CHAT_RATE if chat_id < 0 else self.PRIVATE_CHAT_RATE
+            throttler = self._chats[key] = Throttler(rate_limit=rate, period=period)
+            if len(self._chats) > self.MAX_CHAT_THROTTLERS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(key)
+        return throttler
+
+    def _throttlers(self, client, chat_id, method: str):
+        if chat_id is not None:
+            yield self._chat_throttler(client, chat_id)
+        if method in self.METHOD_RATES:
+            if (client, method) not in self._methods:
+                rate, period = self.METHOD_RATES[method]
+                self._methods[(client, method)] = Throttler(rate_limit=rate, period=period)
+            yield self._methods[(client, method)]
+        if client not in self._global:
+            self._global[client] = Throttler(rate_limit=self.GLOBAL_RATE[0], period=self.GLOBAL_RATE[1])
+        yield self._global[client]
+
+    def _scopes(self, client, chat_id):
+        scopes = [("client", client)]
+        if chat_id is not None:
+            scopes.append(("chat", client, chat_id))
+        return scopes
+
+    def flood_until(self, client) -> float:
+        """Monotonic time the client's account-wide FloodWait ends"""
+        return self._deadlines.get(("client", client), 0.0)
+
+    def record_flood(self, client, chat_id, seconds: float, method: str = ""):
+        """Share a FloodWait with every task sending to the same scope"""
+        self.flood_waits += 1
+        metrics.FLOODWAITS.labels(method or "other").inc()
+        metrics.FLOODWAIT_SECONDS.labels(method or "other").inc(seconds)
+        tracing.event("floodwait", method=method, chat_id=chat_id, seconds=seconds)
+        deadline = time.monotonic() + seconds
+        scope = ("client", client) if chat_id is None or seconds >= self.GLOBAL_FLOOD_THRESHOLD \
+            else ("chat", client, chat_id)
+        # Chats that never send again would otherwise keep their expired deadline forever
+        now = time.monotonic()
+        for expired in [key for key, until in self._deadlines.items() if until <= now]:
+            del self._deadlines[expired]
+        self._deadlines[scope] = max(self._deadlines.get(scope, 0.0), deadline)
+
+    async def wait(self, client, chat_id=None, method: str = ""):
+        """Block until a call to ``method`` in ``chat_id`` may be sent"""
+        scopes = self._scopes(client, chat_id)
+        while True:
+            now = time.monotonic()
+            deadline = max(self._deadlines.get(scope, 0.0) for scope in scopes)
+            if deadline <= now:
+                break
+            with tracing.span("floodwait_sleep", method=method, seconds=round(deadline - now, 3)):
+                await asyncio.sleep(deadline - now)
+        for scope in scopes:
+            if scope in self._deadlines and self._deadlines[scope] <= time.monotonic():
+                del self._deadlines[scope]
+
+        for throttler in self._throttlers(client, chat_id, method):
+            await throttler.acquire()
@@ -0,0 +1,94 @@
+# job_journal.py
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobJournal:
+    """Write-ahead journal of leech jobs that survives restarts.
+
+    A row is written when a request is accepted and updated as the job moves
+    through its stages (queued, extracting, downloading, uploading) with the
+    aria2 GID and the downloaded file path once known. Rows are deleted when
+    a job finishes either way, so whatever is left at startup is exactly the
+    work that was interrupted.
+    """
+
+    STAGES = ("queued", "extracting", "downloading", "uploading")
+    FIELDS = ("stage", "gid", "file_path", "link_info")
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, share_id TEXT, "
+            "user_id INTEGER, chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+            "status_message_id INTEGER, stage TEXT NOT NULL, gid TEXT, file_path TEXT, "
+            "link_info TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _execute(self, query: str, params: tuple = ()):
+        with self._lock:
+            cursor = self._db.execute(query, params)
+            rows = cursor.fetchall()
+            self._db.commit()
+            return rows, cursor.lastrowid
+
+    async def create(self, url: str, share_id: str, user_id: int, chat_id: int,
+                     message_id: int, status_message_id: int, stage: str = "queued") -> int:
+        """Record an accepted request; returns its journal id"""
+        now = time.time()
+        _, job_id = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (url, share_id, user_id, chat_id, message_id, status_message_id, "
+            "stage, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, share_id, user_id, chat_id, message_id, status_message_id, stage, now, now)
+        )
+        return job_id
+
+    async def update(self, job_id: Optional[int], **fields):
+        """Advance a job; ``link_info`` dicts are stored as JSON"""
+        if job_id is None:
+            return
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown journal fields: {', '.join(sorted(unknown))}")
+        if "link_info" in fields:
+            fields["link_info"] = json.dumps(fields["link_info"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        await asyncio.to_thread(
+            self._execute,
+            f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+            (*fields.values(), time.time(), job_id)
+        )
+
+    async def finish(self, job_id: Optional[int]):
+        """Drop a job that completed or failed for good"""
+        if job_id is None:
+            return
+        await asyncio.to_thread(self._execute, "DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    async def pending(self) -> List[Dict[str, Any]]:
+        """Jobs interrupted by the last shutdown, oldest first"""
+        rows, _ = await asyncio.to_thread(self._execute, "SELECT * FROM jobs ORDER BY job_id")
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["link_info"] = json.loads(job["link_info"]) if job["link_info"] else None
+            jobs.append(job)
+        return jobs
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,136 @@
+# job_scheduler.py
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    """A queued unit of work with its owner, priority and expected disk usage"""
+
+    def __init__(self, user_id: int, run: Callable[[], Awaitable], priority: int = 1,
+                 expected_size: int = 0, on_position: Callable[[int], Awaitable] = None):
+        self.user_id = user_id
+        self.run = run
+        self.priority = priority  # Lower runs first
+        self.expected_size = expected_size
+        self.on_position = on_position
+        self.position = None
+        self.seq = 0
+
+
+class JobScheduler:
+    """Priority job queue drained by a fixed worker pool.
+
+    Workers take the highest-priority job whose owner is under the per-user
+    concurrency cap and which passes the admission check (e.g. free
+    disk). Jobs that cannot be admitted stay queued and are rechecked
+    every ``ADMISSION_RETRY`` seconds or whenever a job finishes.
+    """
+
+    ADMISSION_RETRY = 5
+
+    def __init__(self, workers: int = 5, per_user_limit: int = 2, per_user_queue_limit: int = 5,
+                 admission: Callable[[ScheduledJob], bool] = None, uncapped_priority: int = 0):
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.per_user_queue_limit = per_user_queue_limit
+        self.admission = admission
+        self.uncapped_priority = uncapped_priority
+        self.running = Counter()
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+        self._workers = []
+        self._notify_tasks = set()
+        self._stopping = False
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def active(self) -> int:
+        return sum(self.running.values())
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        # wait_for can swallow a cancel that races a notify, so idle workers also check the flag
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._stopping = False
+
+    async def submit(self, job: ScheduledJob) -> Optional[int]:
+        """Queue a job; returns its 1-based position or None if the user's queue is full"""
+        async with self._cond:
+            if sum(1 for j in self._queue if j.user_id == job.user_id) >= self.per_user_queue_limit:
+                return None
+            job.seq = next(self._seq)
+            self._queue.append(job)
+            self._queue.sort(key=lambda j: (j.priority, j.seq))
+            job.position = self._queue.index(job) + 1
+            self._cond.notify_all()
+            self._publish_positions(skip=job)
+            return job.position
+
+    def _capped(self, job: ScheduledJob) -> bool:
+        return (job.priority > self.uncapped_priority and
+                self.running[job.user_id] >= self.per_user_limit)
+
+    def _pick(self) -> Optional[ScheduledJob]:
+        for job in self._queue:
+            if self._capped(job):
+                continue
+            if self.admission and not self.admission(job):
+                continue
+            self._queue.remove(job)
+            job.position = None
+            self.running[job.user_id] += 1
+            return job
+        return None
+
+    def _publish_positions(self, skip: ScheduledJob = None):
+        """Tell queued jobs whose place in line changed"""
+        for index, job in enumerate(self._queue, 1):
+            if job.position != index and job is not skip and job.on_position:
+                task = asyncio.create_task(job.on_position(index))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_tasks.discard)
+            job.position = index
+
+    async def _next_job(self) -> ScheduledJob:
+        async with self._cond:
+            while True:
+                if self._stopping:
+                    raise asyncio.CancelledError()
+                job = self._pick()
+                if job:
+                    self._publish_positions()
+                    return job
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=self.ADMISSION_RETRY)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._next_job()
+            try:
+                await job.run()
+            except Exception as e:
+                logger.error(f"Job for user {job.user_id} crashed in worker {index}: {e}")
+            finally:
+                async with self._cond:
+                    self.running[job.user_id] -= 1
+                    if self.running[job.user_id] <= 0:
+                        del self.running[job.user_id]
+                    self._cond.notify_all()
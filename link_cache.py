@@ -0,0 +1,154 @@
+# link_cache.py
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+class LinkCache:
+    """Bounded TTL/LRU cache for extracted direct links with optional sqlite backing"""
+
+    # Stop serving a direct link this long before its signature expires
+    EXPIRY_MARGIN = 300
+
+    def __init__(self, max_entries: int = 1000, default_ttl: int = 1800, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS link_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM link_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Link cache database unavailable, using memory only: {e}")
+            self._db = None
+
+    def _db_execute(self, query: str, params: tuple = ()):
+        with self._db_lock:
+            rows = self._db.execute(query, params).fetchall()
+            self._db.commit()
+            return rows
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached value, checking memory first and then disk"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None and self._db:
+            rows = await asyncio.to_thread(
+                self._db_execute, "SELECT value, expires_at FROM link_cache WHERE key = ?", (key,)
+            )
+            if rows:
+                entry = (json.loads(rows[0][0]), rows[0][1])
+                self._store(key, entry)
+
+        if entry is None or entry[1] <= now:
+            if entry is not None:
+                await self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry[0])
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        """Cache a value for ``ttl`` seconds (the default TTL when omitted)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        entry = (dict(value), time.time() + ttl)
+        self._store(key, entry)
+        if self._db:
+            await asyncio.to_thread(
+                self._db_execute,
+                "INSERT OR REPLACE INTO link_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry[0]), entry[1])
+            )
+
+    def find(self, field: str, value: Any) -> Optional[Dict[str, Any]]:
+        """First live in-memory value whose ``field`` equals ``value`` (no stats, no disk)"""
+        now = time.time()
+        for cached, expires_at in reversed(self._entries.values()):
+            if expires_at > now and cached.get(field) == value:
+                return dict(cached)
+        return None
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, key: str):
+        """Drop a key, e.g. when its direct link stopped working"""
+        self._entries.pop(key, None)
+        if self._db:
+            try:
+                await asyncio.to_thread(self._db_execute, "DELETE FROM link_cache WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logger.error(f"Link cache delete failed: {e}")
+
+    def ttl_for(self, direct_url: str) -> float:
+        """TTL for a direct link, capped by the expiry signed into its URL.
+
+        TeraBox direct links carry ``time`` (signing timestamp) and ``expires``
+        either as a duration such as ``8h`` or as an absolute unix timestamp.
+        """
+        try:
+            query = parse_qs(urlparse(direct_url).query)
+        except ValueError:
+            return self.default_ttl
+
+        expires = (query.get("expires") or query.get("x-expires") or [""])[0]
+        signed_at = (query.get("time") or [""])[0]
+        now = time.time()
+        expires_at = None
+
+        if expires.isdigit() and int(expires) > 1_000_000_000:
+            expires_at = int(expires)
+        elif expires[:-1].isdigit() and expires[-1:] in ("s", "m", "h", "d"):
+            unit = {"s": 1, "m": 60, "h": 3600, "d": 86400}[expires[-1]]
+            base = int(signed_at) if signed_at.isdigit() else now
+            expires_at = base + int(expires[:-1]) * unit
+        elif expires.isdigit():
+            base = int(signed_at) if signed_at.isdigit() else now
+            expires_at = base + int(expires)
+
+        if expires_at is None:
+            return self.default_ttl
+        return max(0, min(self.default_ttl, expires_at - now - self.EXPIRY_MARGIN))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "hit_rate": (self.hits / lookups * 100) if lookups else 0.0
+        }
+
+    def close(self):
+        if self._db:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -0,0 +1,111 @@
+# membership_cache.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from pyrogram import Client
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import ChatAdminRequired, UserNotParticipant
+from pyrogram.types import ChatMemberUpdated
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+
+class MembershipCache:
+    """TTL cache of force-subscribe membership checks for one chat.
+
+    Members are remembered for ``positive_ttl`` and non-members for the
+    shorter ``negative_ttl`` so someone who just joined isn't locked out for
+    long. ``ChatMemberUpdated`` events for the chat overwrite entries as they
+    happen. Concurrent checks for the same user share one API call; failed
+    lookups are not cached.
+    """
+
+    def __init__(self, chat_id: int, positive_ttl: int = 3600, negative_ttl: int = 60,
+                 max_entries: int = 50000):
+        self.chat_id = chat_id
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (is_member, expires)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, user_id: int, is_member: bool):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def is_member(self, client: Client, user_id: int) -> bool:
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+
+        pending = self._pending.get(user_id)
+        if pending:
+            return await asyncio.shield(pending)
+        future = self._pending[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._fetch(client, user_id)
+            future.set_result(result)
+            return result
+        except BaseException:
+            future.set_result(False)
+            raise
+        finally:
+            del self._pending[user_id]
+
+    async def _fetch(self, client: Client, user_id: int) -> bool:
+        try:
+            member = await client.get_chat_member(self.chat_id, user_id)
+        except (UserNotParticipant, ChatAdminRequired):
+            self._store(user_id, False)
+            return False
+        except Exception as e:
+            logger.error(f"Error checking membership for user {user_id}: {e}")
+            return False
+        is_member = member.status in MEMBER_STATUSES
+        self._store(user_id, is_member)
+        return is_member
+
+    def handle_update(self, update: ChatMemberUpdated):
+        """Apply a join/leave/ban in the chat as soon as Telegram reports it"""
+        if update.chat.id != self.chat_id:
+            return
+        member = update.new_chat_member or update.old_chat_member
+        if not member or not member.user:
+            return
+        is_member = bool(update.new_chat_member) and update.new_chat_member.status in MEMBER_STATUSES
+        self._store(member.user.id, is_member)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "hit_rate": (self.hits / total * 100) if total else 0.0
+        }
+
+
+_caches: Dict[int, MembershipCache] = {}
+
+
+def shared_cache(chat_id: int, **options) -> MembershipCache:
+    """The process-wide cache for ``chat_id``; ``options`` apply on first use"""
+    cache = _caches.get(chat_id)
+    if cache is None:
+        cache = _caches[chat_id] = MembershipCache(chat_id, **options)
+    return cache
@@ -0,0 +1,202 @@
+# metrics.py
+import bisect
+import math
+from typing import Callable, Dict, List, Tuple
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for a metric family; children are keyed by their label values.
+
+    Everything runs on the event loop thread, so updates are plain
+    attribute arithmetic with no locks on the hot path.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        key = tuple(kwargs[name] for name in self.labelnames) if kwargs else values
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].value += amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in self._children.items()]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float] = None):
+        self.function = function or (lambda: 0.0)
+        super().__init__(name, documentation)
+
+    def _new_child(self):
+        return None
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def _samples(self) -> List[str]:
+        try:
+            value = float(self.function())
+        except Exception:
+            value = float("nan")
+        return [f"{self.name} {_format_value(value) if not math.isnan(value) else 'NaN'}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        return "\n".join(metric.expose() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Jobs take seconds to hours, so stage buckets span that range
+STAGE_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "terabox_stage_seconds", "Time spent per job stage (extract, download, upload, total)",
+    ("stage",), STAGE_BUCKETS
+))
+ENDPOINT_REQUESTS = REGISTRY.register(Counter(
+    "terabox_endpoint_requests_total", "Extraction API requests by endpoint and result",
+    ("endpoint", "result")
+))
+ENDPOINT_LATENCY = REGISTRY.register(Histogram(
+    "terabox_endpoint_latency_seconds", "Extraction API response time by endpoint",
+    ("endpoint",), (0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30)
+))
+FLOODWAITS = REGISTRY.register(Counter(
+    "terabox_floodwait_total", "FloodWait errors received by Telegram method", ("method",)
+))
+FLOODWAIT_SECONDS = REGISTRY.register(Counter(
+    "terabox_floodwait_seconds_total", "Seconds of FloodWait imposed by Telegram method", ("method",)
+))
+DOWNLOADED_BYTES = REGISTRY.register(Counter(
+    "terabox_downloaded_bytes_total", "Bytes downloaded by aria2 for completed jobs"
+))
+UPLOADED_BYTES = REGISTRY.register(Counter(
+    "terabox_uploaded_bytes_total", "Bytes uploaded to Telegram"
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "terabox_queue_depth", "Jobs waiting for a worker"
+))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    "terabox_jobs_running", "Jobs currently held by a worker"
+))
+ARIA2_RPC_SECONDS = REGISTRY.register(Histogram(
+    "terabox_aria2_rpc_seconds", "aria2 JSON-RPC round-trip time by method", ("method",),
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+))
@@ -0,0 +1,237 @@
+# mp4_meta.py
+import logging
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK = 4 * 1024 * 1024
+# Boxes on the path from moov down to the chunk offset tables
+OFFSET_CONTAINERS = (b"moov", b"trak", b"mdia", b"minf", b"stbl")
+MAX_THUMB_SIZE = 200 * 1024  # Telegram rejects bigger thumbnails
+
+
+class Mp4Info:
+    """What Telegram needs for a proper video preview, read from the box headers"""
+
+    def __init__(self):
+        self.duration = 0.0
+        self.width = 0
+        self.height = 0
+        self.cover: Optional[bytes] = None  # Embedded JPEG cover art
+        self.faststart = True
+        self.fragmented = False
+        self.boxes: List[Tuple[bytes, int, int]] = []  # Top level (type, offset, size)
+
+
+def iter_boxes(data, start: int, end: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    """Yield ``(type, offset, header_size, size)`` for each box in ``data[start:end]``"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return  # Truncated or corrupt; stop rather than guess
+        yield box_type, offset, header, size
+        offset += size
+
+
+def find_box(data, start: int, end: int, path: Tuple[bytes, ...]) -> Optional[Tuple[int, int]]:
+    """Payload ``(start, end)`` of the first box at ``path`` below ``data[start:end]``"""
+    for box_type, offset, header, size in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return offset + header, offset + size
+            found = find_box(data, offset + header, offset + size, path[1:])
+            if found:
+                return found
+    return None
+
+
+def _parse_mvhd(data, start: int) -> float:
+    version = data[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", data, start + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", data, start + 12)
+    return duration / timescale if timescale else 0.0
+
+
+def _parse_tkhd_size(data, start: int) -> Tuple[int, int]:
+    # Width and height are 16.16 fixed point after the 36-byte matrix
+    offset = start + (88 if data[start] == 1 else 76)
+    width, height = struct.unpack_from(">II", data, offset)
+    return width >> 16, height >> 16
+
+
+def _parse_cover(data, moov_start: int, moov_end: int) -> Optional[bytes]:
+    meta = find_box(data, moov_start, moov_end, (b"udta", b"meta"))
+    if not meta:
+        return None
+    start, end = meta
+    # ISO meta is a full box; QuickTime writes it without version and flags
+    if data[start + 4:start + 8] != b"hdlr":
+        start += 4
+    data_box = find_box(data, start, end, (b"ilst", b"covr", b"data"))
+    if not data_box:
+        return None
+    image = bytes(data[data_box[0] + 8:data_box[1]])
+    if image[:3] == b"\xff\xd8\xff" and len(image) <= MAX_THUMB_SIZE:
+        return image
+    return None
+
+
+@contextmanager
+def _malformed(path: str):
+    """Report truncated or corrupt boxes as ``ValueError``, the one failure type callers handle"""
+    try:
+        yield
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Malformed MP4 {os.path.basename(path)}: {e}") from e
+
+
+def parse(path: str) -> Optional[Mp4Info]:
+    """Read duration, video size, cover art and box layout; None if not an MP4.
+
+    Raises ``ValueError`` for an MP4 whose boxes are truncated or corrupt.
+    """
+    if os.path.getsize(path) < 8:
+        return None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, _malformed(path):
+        info = Mp4Info()
+        info.boxes = [(box_type, offset, size) for box_type, offset, _, size in iter_boxes(data, 0, len(data))]
+        types = [box[0] for box in info.boxes]
+        if b"ftyp" not in types or b"moov" not in types:
+            return None
+        info.fragmented = b"moof" in types
+        moov_index = types.index(b"moov")
+        info.faststart = all(box_type != b"mdat" for box_type in types[:moov_index])
+
+        _, moov_offset, moov_size = info.boxes[moov_index]
+        moov_start, moov_end = moov_offset + 8, moov_offset + moov_size
+        mvhd = find_box(data, moov_start, moov_end, (b"mvhd",))
+        if mvhd:
+            info.duration = _parse_mvhd(data, mvhd[0])
+
+        for box_type, offset, header, size in iter_boxes(data, moov_start, moov_end):
+            if box_type != b"trak":
+                continue
+            hdlr = find_box(data, offset + header, offset + size, (b"mdia", b"hdlr"))
+            if not hdlr or data[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+                continue
+            tkhd = find_box(data, offset + header, offset + size, (b"tkhd",))
+            if tkhd:
+                info.width, info.height = _parse_tkhd_size(data, tkhd[0])
+                break
+
+        info.cover = _parse_cover(data, moov_start, moov_end)
+        return info
+
+
+def _rewrite_moov(moov: bytes, shift: int, force_co64: bool) -> bytes:
+    """Copy of a box tree with every chunk offset moved by ``shift``"""
+    out = bytearray()
+    for box_type, offset, header, size in iter_boxes(moov, 0, len(moov)):
+        if box_type in OFFSET_CONTAINERS:
+            body = _rewrite_moov(moov[offset + header:offset + size], shift, force_co64)
+            out += struct.pack(">I4s", 8 + len(body), box_type) + body
+        elif box_type in (b"stco", b"co64"):
+            start = offset + header
+            count = struct.unpack_from(">I", moov, start + 4)[0]
+            wide = box_type == b"co64"
+            offsets = struct.unpack_from(f">{count}{'Q' if wide else 'I'}", moov, start + 8)
+            offsets = [value + shift for value in offsets]
+            if wide or force_co64:
+                body = moov[start:start + 8] + struct.pack(f">{count}Q", *offsets)
+                out += struct.pack(">I4s", 8 + len(body), b"co64") + body
+            else:
+                body = moov[start:start + 8] + struct.pack(f">{count}I", *offsets)
+                out += struct.pack(">I4s", 8 + len(body), b"stco") + body
+        else:
+            out += moov[offset:offset + size]
+    return bytes(out)
+
+
+def faststart(path: str, info: Mp4Info = None) -> bool:
+    """Move the moov box in front of the media data; True if the file was rewritten.
+
+    Only the moov box is held in memory; media data is copied through a
+    small buffer into a temporary file that replaces the original, so the
+    disk needs room for a second copy. Raises ``ValueError`` if the moov
+    box is corrupt and ``OSError`` (with the copy removed) if writing fails.
+    """
+    info = info or parse(path)
+    if not info or info.faststart or info.fragmented:
+        return False
+    types = [box[0] for box in info.boxes]
+    moov_index = types.index(b"moov")
+    if b"mdat" in types[moov_index + 1:]:
+        return False  # Media on both sides of moov; offsets would need per-chunk fixups
+
+    _, moov_offset, moov_size = info.boxes[moov_index]
+    with open(path, "rb") as src:
+        src.seek(moov_offset)
+        moov = src.read(moov_size)
+        if moov_size > 0xFFFFFFFF or struct.unpack_from(">I", moov)[0] == 1:
+            return False
+        moov_body = moov[8:]
+
+        # Every chunk moves by the new moov size; 32-bit offsets that could
+        # overflow are widened to co64 up front, which fixes that size
+        force_co64 = os.path.getsize(path) + 2 * moov_size > 0xFFFFFFFF
+        shift = moov_size
+        for _ in range(3):
+            with _malformed(path):
+                new_body = _rewrite_moov(moov_body, shift, force_co64)
+            if 8 + len(new_body) == shift:
+                break
+            shift = 8 + len(new_body)
+        else:
+            return False
+        new_moov = struct.pack(">I4s", 8 + len(new_body), b"moov") + new_body
+
+        temp = f"{path}.faststart"
+        try:
+            with open(temp, "wb") as dst:
+                for box_type, offset, size in info.boxes:
+                    if box_type == b"moov":
+                        continue
+                    src.seek(offset)
+                    remaining = size
+                    while remaining:
+                        chunk = src.read(min(COPY_CHUNK, remaining))
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+                    if box_type == b"ftyp":
+                        dst.write(new_moov)
+            os.replace(temp, path)
+        except BaseException:
+            # A full disk leaves a partial copy as big as what was written
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+    return True
+
+
+def prepare(path: str) -> Optional[Mp4Info]:
+    """Parse ``path`` and make it streamable; None for files that aren't MP4"""
+    try:
+        info = parse(path)
+        if info and faststart(path, info):
+            logger.info(f"Moved moov atom to the front of {os.path.basename(path)}")
+        return info
+    except (OSError, ValueError) as e:
+        logger.warning(f"MP4 inspection failed for {path}: {e}")
+        return None
@@ -0,0 +1,159 @@
+# progress_updater.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket; ``take()`` spends one token if available"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class PendingEdit:
+    """Latest text waiting to be written to one message"""
+
+    def __init__(self, message, text: str, reply_markup=None):
+        self.message = message
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+class ProgressUpdater:
+    """Central scheduler for progress message edits.
+
+    Callers hand in the latest text whenever they like; only the newest
+    pending text per message is kept, so intermediate states are dropped.
+    A tick loop writes pending edits when the message's chat bucket has a
+    token and the message's own interval has passed. That interval grows
+    with the number of tracked messages so the total edit rate stays
+    within ``global_rate``. Text identical to what the message already
+    shows is never sent. Buckets are kept for the ``MAX_BUCKETS`` most
+    recently active chats.
+    """
+
+    TICK = 0.5
+    PRIVATE_RATE = 1.0  # Edits per second in a private chat
+    GROUP_RATE = 20 / 60  # Telegram allows about 20 messages a minute in groups
+    BURST = 3
+    MAX_BUCKETS = 10000
+
+    def __init__(self, edit: Callable[..., Awaitable], global_rate: float = 20,
+                 min_interval: float = 3, max_interval: float = 30):
+        self.edit = edit
+        self.global_rate = global_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._pending: Dict[Tuple[int, int], PendingEdit] = {}
+        self._shown: Dict[Tuple[int, int], str] = {}
+        self._last_edit: Dict[Tuple[int, int], float] = {}
+        self._inflight: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._task = None
+
+    @staticmethod
+    def _key(message) -> Tuple[int, int]:
+        return message.chat.id, message.id
+
+    @property
+    def interval(self) -> float:
+        """Seconds between edits of one message at the current load"""
+        tracked = len(self._shown) + len(set(self._pending) - set(self._shown))
+        return min(max(self.min_interval, tracked / self.global_rate), self.max_interval)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.GROUP_RATE if chat_id < 0 else self.PRIVATE_RATE
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.BURST)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    def update(self, message, text: str, reply_markup=None):
+        """Queue ``text`` for ``message``, replacing any edit not yet sent"""
+        if message is None:
+            return
+        key = self._key(message)
+        if self._shown.get(key) == text:
+            self._pending.pop(key, None)
+            return
+        self._pending[key] = PendingEdit(message, text, reply_markup)
+
+    async def forget(self, message):
+        """Stop tracking ``message`` before the caller writes its final state.
+
+        Waits for an edit already on the wire so it cannot land after the
+        caller's own edit.
+        """
+        if message is None:
+            return
+        key = self._key(message)
+        self._pending.pop(key, None)
+        self._shown.pop(key, None)
+        self._last_edit.pop(key, None)
+        task = self._inflight.get(key)
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.TICK)
+            try:
+                self._flush_due()
+            except Exception as e:
+                logger.error(f"Progress updater tick failed: {e}")
+
+    def _flush_due(self):
+        now = time.monotonic()
+        interval = self.interval
+        # Oldest edits first so busy chats don't starve anyone
+        for key in sorted(self._pending, key=lambda k: self._last_edit.get(k, 0.0)):
+            if key in self._inflight or now - self._last_edit.get(key, 0.0) < interval:
+                continue
+            if not self._bucket(key[0]).take():
+                continue
+            pending = self._pending.pop(key)
+            self._last_edit[key] = now
+            self._inflight[key] = asyncio.create_task(self._send(key, pending))
+
+    async def _send(self, key: Tuple[int, int], pending: PendingEdit):
+        try:
+            result = await self.edit(pending.message, pending.text, pending.reply_markup)
+            if result is not None and key in self._last_edit:
+                self._shown[key] = pending.text
+        finally:
+            self._inflight.pop(key, None)
@@ -2,7 +2,7 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
 from pyrogram.handlers import CallbackQueryHandler
-from pyrogram.enums import ChatMemberStatus
+from membership_cache import shared_cache
 import os
 import logging
 import time
@@ -37,15 +37,7 @@ async def is_admin(client, user_id):
 
 async def is_user_member(client, user_id, fsub_id):
     """Check if a user is a member of the force subscription channel"""
-    try:
-        member = await client.get_chat_member(fsub_id, user_id)
-        if member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return True
-        else:
-            return False
-    except Exception as e:
-        logging.error(f"Error checking membership status for user {user_id}: {e}")
-        return False
+    return await shared_cache(fsub_id).is_member(client, user_id)
 
 def register_request_handlers(app, FSUB_ID):
     """Register all handlers related to video requests"""
@@ -0,0 +1,108 @@
+# splitter.py
+import asyncio
+import logging
+import math
+import os
+import shutil
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK = 4 * 1024 * 1024
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.ts', '.flv')
+
+
+async def _run(*args) -> tuple:
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode(errors="ignore"), stderr.decode(errors="ignore")
+
+
+async def probe_duration(path: str) -> float:
+    """Container duration in seconds via ffprobe, 0 when unknown"""
+    code, stdout, _ = await _run(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path
+    )
+    try:
+        return float(stdout.strip()) if code == 0 else 0.0
+    except ValueError:
+        return 0.0
+
+
+async def split_video(path: str, part_size: int, out_dir: str) -> Optional[List[str]]:
+    """Cut a video into independently playable parts with ffmpeg stream copy.
+
+    Segments are cut on keyframes by duration, so the target leaves headroom
+    below ``part_size``; None is returned when a part still overshoots or
+    ffmpeg is unavailable, and the caller falls back to a byte split.
+    """
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        return None
+    duration = await probe_duration(path)
+    if not duration:
+        return None
+
+    size = os.path.getsize(path)
+    parts = math.ceil(size / (part_size * 0.9))
+    segment_time = duration / parts
+    ext = os.path.splitext(path)[1] or ".mp4"
+    pattern = os.path.join(out_dir, f"part%03d{ext}")
+
+    code, _, stderr = await _run(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+        "-map", "0", "-c", "copy", "-f", "segment", "-segment_time", f"{segment_time:.3f}",
+        "-reset_timestamps", "1", "-segment_format_options", "movflags=+faststart", pattern
+    )
+    outputs = sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir))
+    if code != 0 or not outputs or any(os.path.getsize(p) > part_size for p in outputs):
+        logger.warning(f"ffmpeg split unusable for {path}: {stderr.strip()[:200]}")
+        for output in outputs:
+            os.remove(output)
+        return None
+    return outputs
+
+
+def split_bytes(path: str, part_size: int, out_dir: str) -> List[str]:
+    """Split into .001, .002, ... byte ranges, streaming through a small buffer"""
+    name = os.path.basename(path)
+    outputs = []
+    with open(path, "rb") as src:
+        index = 1
+        while True:
+            written = 0
+            out_path = os.path.join(out_dir, f"{name}.{index:03d}")
+            with open(out_path, "wb") as dst:
+                while written < part_size:
+                    chunk = src.read(min(COPY_CHUNK, part_size - written))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    written += len(chunk)
+            if not written:
+                os.remove(out_path)
+                break
+            outputs.append(out_path)
+            index += 1
+    return outputs
+
+
+async def split_file(path: str, part_size: int) -> tuple:
+    """Split ``path`` into parts no larger than ``part_size``.
+
+    Returns ``(parts, playable)``; parts live in ``<path>.parts`` which the
+    caller removes with :func:`cleanup_parts`.
+    """
+    out_dir = f"{path}.parts"
+    os.makedirs(out_dir, exist_ok=True)
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        parts = await split_video(path, part_size, out_dir)
+        if parts:
+            return parts, True
+    return await asyncio.to_thread(split_bytes, path, part_size, out_dir), False
+
+
+def cleanup_parts(path: str):
+    shutil.rmtree(f"{path}.parts", ignore_errors=True)
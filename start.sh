@@ -1 +1 @@
-source .venv/bin/activate && xria --enable-rpc --rpc-listen-all=false --rpc-allow-origin-all --daemon --max-tries=50 --retry-wait=3 --continue=true --min-split-size=4M --split=10 --allow-overwrite=true && python3 terabox.py
\ No newline at end of file
+source .venv/bin/activate && touch aria2.session && xria --input-file=aria2.session --save-session=aria2.session --save-session-interval=30 --enable-rpc --rpc-listen-all=false --rpc-allow-origin-all --daemon --max-tries=50 --retry-wait=3 --continue=true --allow-overwrite=true && python3 terabox.py
\ No newline at end of file
@@ -0,0 +1,351 @@
+# stream_proxy.py
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+# Share IDs that are safe in a URL path as they are; others (e.g. a raw share URL) are base64 encoded
+PLAIN_SHARE_ID = re.compile(r"[A-Za-z0-9_-]+$")
+
+
+class UpstreamExpired(Exception):
+    """The direct link was rejected (403/410) and must be resolved again"""
+
+
+class StreamSource:
+    """Current direct link and size for one share"""
+
+    def __init__(self, share_id: str, direct_url: str, size: int, filename: str):
+        self.share_id = share_id
+        self.direct_url = direct_url
+        self.size = size
+        self.filename = filename
+
+
+class ChunkCache:
+    """Bounded on-disk cache of fixed-size file chunks with LRU eviction.
+
+    Chunks live at ``<cache_dir>/<hash of key>/<index>``, so keys may hold
+    any characters, including ``/`` and ``..``; the LRU order is rebuilt
+    from file mtimes on startup so a restart keeps popular videos warm.
+    Reads and writes run in worker threads, so the index is only touched
+    under ``_lock``; chunk data is read and written outside it.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._chunks: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _path(self, name: str, index: int) -> str:
+        return os.path.join(self.cache_dir, name, str(index))
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            directory = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(directory):
+                continue
+            for index in os.listdir(directory):
+                if not index.isdigit():
+                    continue  # Leftover temp file from an interrupted write
+                stat = os.stat(os.path.join(directory, index))
+                found.append((stat.st_mtime, name, int(index), stat.st_size))
+        with self._lock:
+            for _, name, index, size in sorted(found):
+                self._chunks[(name, index)] = size
+                self.total_bytes += size
+            self._evict()
+
+    def __contains__(self, item: Tuple[str, int]) -> bool:
+        key, index = item
+        with self._lock:
+            return (self._name(key), index) in self._chunks
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def read(self, key: str, index: int) -> Optional[bytes]:
+        name = self._name(key)
+        try:
+            with open(self._path(name, index), "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self._forget(name, index)
+            return None
+        with self._lock:
+            if (name, index) in self._chunks:
+                self._chunks.move_to_end((name, index))
+        return data
+
+    def write(self, key: str, index: int, data: bytes):
+        name = self._name(key)
+        path = self._path(name, index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            os.replace(temp, path)
+            self._forget(name, index)
+            self._chunks[(name, index)] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def _forget(self, name: str, index: int):
+        # Callers hold _lock
+        size = self._chunks.pop((name, index), None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        # Callers hold _lock, so a chunk can't be re-added between unlinking and forgetting it
+        while self.total_bytes > self.max_bytes and self._chunks:
+            (name, index), size = self._chunks.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(name, index))
+            except OSError:
+                pass
+
+
+class StreamProxy:
+    """Range-capable ``/stream/<token>`` proxy in front of TeraBox direct links.
+
+    Files are fetched from upstream in ``CHUNK_SIZE`` ranges through a pooled
+    session and kept in a :class:`ChunkCache`, so seeks into cached parts
+    are served from local disk and concurrent viewers share one upstream
+    fetch per chunk. Tokens are the share ID with an HMAC so they survive
+    restarts without any state. When upstream rejects an expired link the
+    share is resolved again through ``resolve`` and the fetch retried.
+    Resolved shares are kept for the ``MAX_SOURCES`` most recently used.
+    """
+
+    CHUNK_SIZE = 2 * 1024 * 1024
+    READAHEAD = 2
+    MAX_SOURCES = 1000
+
+    def __init__(self, secret: str, cache_dir: str, max_cache_bytes: int,
+                 resolve: Callable[[str, bool], Awaitable[Optional[Dict[str, Any]]]],
+                 user_agent: str = "Mozilla/5.0"):
+        self.secret = secret.encode()
+        self.cache = ChunkCache(cache_dir, max_cache_bytes)
+        self.resolve = resolve
+        self.user_agent = user_agent
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._sources: "OrderedDict[str, StreamSource]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._fetches: Dict[Tuple[str, int], asyncio.Task] = {}
+
+    def token_for(self, share_id: str) -> str:
+        signature = hmac.new(self.secret, share_id.encode(), hashlib.sha256).hexdigest()[:16]
+        if not PLAIN_SHARE_ID.match(share_id):
+            share_id = "~" + base64.urlsafe_b64encode(share_id.encode()).decode().rstrip("=")
+        return f"{share_id}.{signature}"
+
+    def share_for(self, token: str) -> Optional[str]:
+        share_id, _, signature = token.rpartition(".")
+        if share_id.startswith("~"):
+            encoded = share_id[1:]
+            try:
+                share_id = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+            except (binascii.Error, ValueError):
+                return None
+        if share_id and hmac.compare_digest(self.token_for(share_id), token):
+            return share_id
+        return None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=60, sock_read=30),
+            headers={"User-Agent": self.user_agent}
+        )
+
+    async def stop(self):
+        for task in self._fetches.values():
+            task.cancel()
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def source(self, share_id: str, stale: StreamSource = None) -> Optional[StreamSource]:
+        """Direct link for a share, resolved on first use or when ``stale`` was rejected"""
+        source = self._sources.get(share_id)
+        if source and source is not stale:
+            self._sources.move_to_end(share_id)
+            return source
+        async with self._locks.setdefault(share_id, asyncio.Lock()):
+            # Another viewer may have resolved it while we waited
+            source = self._sources.get(share_id)
+            if source and source is not stale:
+                return source
+            link_info = await self.resolve(share_id, stale is not None)
+            if not link_info or not link_info.get("direct_url"):
+                return None
+            size = int(link_info.get("size_bytes") or 0) or await self._probe_size(link_info["direct_url"])
+            if not size:
+                return None
+            source = StreamSource(share_id, link_info["direct_url"], size, link_info.get("filename", "video.mp4"))
+            self._sources[share_id] = source
+            self._sources.move_to_end(share_id)
+            self._trim_sources()
+            return source
+
+    def _trim_sources(self):
+        while len(self._sources) > self.MAX_SOURCES:
+            self._sources.popitem(last=False)
+        # Locks of evicted or unresolvable shares; one being held is still in use
+        if len(self._locks) > self.MAX_SOURCES:
+            for share_id in [share_id for share_id, lock in self._locks.items()
+                             if share_id not in self._sources and not lock.locked()]:
+                del self._locks[share_id]
+
+    async def _probe_size(self, url: str) -> int:
+        try:
+            async with self.session.get(url, headers={"Range": "bytes=0-0"}) as response:
+                content_range = response.headers.get("Content-Range", "")
+                return int(content_range.rpartition("/")[2]) if "/" in content_range else 0
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return 0
+
+    async def _fetch(self, source: StreamSource, index: int) -> bytes:
+        start = index * self.CHUNK_SIZE
+        end = min(start + self.CHUNK_SIZE, source.size) - 1
+        async with self.session.get(source.direct_url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            if response.status in (403, 410):
+                raise UpstreamExpired(f"HTTP {response.status}")
+            if response.status != 206:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status,
+                    message="Upstream ignored the range request"
+                )
+            data = await response.read()
+        await asyncio.to_thread(self.cache.write, source.share_id, index, data)
+        return data
+
+    async def _load_chunk(self, source: StreamSource, index: int) -> bytes:
+        for attempt in range(2):
+            try:
+                return await self._fetch(source, index)
+            except UpstreamExpired:
+                if attempt:
+                    raise
+                logger.info(f"Direct link for {source.share_id} expired, resolving again")
+                source = await self.source(source.share_id, stale=source)
+                if source is None:
+                    raise
+
+    def chunk(self, source: StreamSource, index: int) -> Awaitable[bytes]:
+        """Chunk bytes from disk, or a shared upstream fetch"""
+        key = (source.share_id, index)
+        task = self._fetches.get(key)
+        if task is None:
+            if key in self.cache:
+                return asyncio.to_thread(self._read_or_fail, source, index)
+            task = self._fetches[key] = asyncio.create_task(self._load_chunk(source, index))
+            task.add_done_callback(lambda _: self._fetches.pop(key, None))
+        return asyncio.shield(task)
+
+    def _read_or_fail(self, source: StreamSource, index: int) -> bytes:
+        data = self.cache.read(source.share_id, index)
+        if data is None:
+            raise OSError(f"Cached chunk {index} of {source.share_id} vanished")
+        return data
+
+    @staticmethod
+    def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+        """Inclusive (start, end) for a single ``bytes=`` range, None if unsatisfiable"""
+        match = RANGE_PATTERN.match(header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        first, last = match.groups()
+        if not first:
+            length = int(last)
+            if not length:
+                return None
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or end < start:
+            return None
+        return start, end
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        share_id = self.share_for(request.match_info["token"])
+        if not share_id:
+            raise web.HTTPNotFound()
+        source = await self.source(share_id)
+        if source is None:
+            raise web.HTTPBadGateway(text="Could not resolve the video")
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Type": "video/mp4",
+            "Cache-Control": "private, max-age=3600"
+        }
+        range_header = request.headers.get("Range")
+        if range_header:
+            byte_range = self.parse_range(range_header, source.size)
+            if byte_range is None:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{source.size}"})
+            start, end = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{source.size}"
+        else:
+            start, end, status = 0, source.size - 1, 200
+        headers["Content-Length"] = str(end - start + 1)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+
+        first, last = start // self.CHUNK_SIZE, end // self.CHUNK_SIZE
+        pending = {}
+        try:
+            for index in range(first, last + 1):
+                # Keep a few chunks in flight ahead of the one being written
+                for ahead in range(index, min(index + self.READAHEAD, last) + 1):
+                    if ahead not in pending:
+                        pending[ahead] = asyncio.ensure_future(self.chunk(source, ahead))
+                data = await pending.pop(index)
+                chunk_start = index * self.CHUNK_SIZE
+                await response.write(data[max(start - chunk_start, 0):end - chunk_start + 1])
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise  # Viewer went away; shared fetches keep filling the cache
+        except Exception as e:
+            logger.warning(f"Stream of {share_id} aborted: {e}")
+        finally:
+            for future in pending.values():
+                future.cancel()
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_bytes": self.cache.total_bytes,
+            "cached_chunks": len(self.cache),
+            "sources": len(self._sources)
+        }
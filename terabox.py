@@ -1,4 +1,3 @@
-from aria2p import API as Aria2API, Client as Aria2Client
 import asyncio
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
@@ -7,19 +6,40 @@ import logging
 import math
 import json
 import requests
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from pyrogram.enums import ChatMemberStatus
-from pyrogram.errors import FloodWait, UserNotParticipant, ChatAdminRequired
+from pyrogram import Client, filters, idle
+from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, InputMediaVideo, InputMediaDocument
+from pyrogram.file_id import FileId, FileType
+from pyrogram.errors import FloodWait
 import time
 import urllib.parse
 from urllib.parse import urlparse
-from flask import Flask, render_template, request, jsonify
-from threading import Thread
 import aiohttp
 import aiofiles
 from typing import Optional, Dict, Any
 import hashlib
+import html
+import tempfile
+import functools
+from link_cache import LinkCache
+from file_index import FileIndex
+from job_journal import JobJournal
+from disk_manager import DiskManager
+from membership_cache import shared_cache
+from web_server import PlayerServer
+from stream_proxy import StreamProxy
+from endpoint_health import EndpointHealth
+from job_scheduler import JobScheduler, ScheduledJob
+from splitter import VIDEO_EXTENSIONS, split_file, cleanup_parts
+import mp4_meta
+import metrics
+import tracing
+from flood_limiter import FloodLimiter
+from progress_updater import ProgressUpdater
+from uploader import (BIG_FILE_SIZE, ParallelUploadEngine, StreamingUploader, UploadClientPool,
+                      contiguous_bytes, send_uploaded_video)
+from aria2_tuner import Aria2Tuner
+from bandwidth_scheduler import BandwidthScheduler
+from aria2_rpc import Aria2RPC, Aria2RPCError, Aria2Download, Aria2NotificationWatcher, Aria2StatusSampler
 
 # Load environment variables
 load_dotenv('config.env', override=True)
@@ -49,16 +69,28 @@ class Config:
         self.BOT_TOKEN = self._get_env_var('BOT_TOKEN')
         self.DUMP_CHAT_ID = int(self._get_env_var('DUMP_CHAT_ID'))
         self.FSUB_ID = int(self._get_env_var('FSUB_ID'))
+        # Seconds a force-subscribe check is trusted; non-members are rechecked sooner
+        self.MEMBERSHIP_TTL = int(os.environ.get('MEMBERSHIP_TTL', 3600))
+        self.MEMBERSHIP_NEGATIVE_TTL = int(os.environ.get('MEMBERSHIP_NEGATIVE_TTL', 60))
         self.BIGG_BOSS_CHANNEL_ID = -1002922594148
         self.ADMIN_IDS = [int(x) for x in os.environ.get('ADMIN_IDS', '').split(',') if x.strip()]
         self.USER_SESSION_STRING = os.environ.get('USER_SESSION_STRING')
+        # Several sessions may be given comma separated to spread uploads
+        self.USER_SESSION_STRINGS = [s.strip() for s in (self.USER_SESSION_STRING or '').split(',') if s.strip()]
         self.SERVER_URL = os.environ.get('SERVER_URL', 'https://historic-frances-school1660440-b73ae1e5.koyeb.app')
+        # Web player served from the bot process; PaaS hosts pass the port in PORT
+        self.WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+        self.PORT = int(os.environ.get('PORT', 8080))
+        self.STREAM_CACHE_DIR = os.environ.get('STREAM_CACHE_DIR', 'stream_cache')
+        self.STREAM_CACHE_SIZE = int(os.environ.get('STREAM_CACHE_SIZE', 2 * 1024 * 1024 * 1024))
         self.SPLIT_SIZE = 2093796556  # ~2GB
+        self.SPLIT_UPLOAD_CONCURRENCY = int(os.environ.get('SPLIT_UPLOAD_CONCURRENCY', 3))
         
         # Aria2 configuration
         self.ARIA2_HOST = "http://localhost"
         self.ARIA2_PORT = 6800
         self.ARIA2_SECRET = ""
+        self.ARIA2_WS_URL = f"{self.ARIA2_HOST.replace('http', 'ws', 1)}:{self.ARIA2_PORT}/jsonrpc"
         
         # API endpoints for TeraBox extraction
         self.API_ENDPOINTS = [
@@ -67,6 +99,44 @@ class Config:
             "https://tera-api-enhanced.herokuapp.com/api?url={}"
         ]
         
+        # Extracted link cache (set LINK_CACHE_DB empty to keep it in memory only)
+        self.LINK_CACHE_SIZE = int(os.environ.get('LINK_CACHE_SIZE', 1000))
+        self.LINK_CACHE_TTL = int(os.environ.get('LINK_CACHE_TTL', 1800))
+        self.LINK_CACHE_DB = os.environ.get('LINK_CACHE_DB', 'link_cache.db')
+        
+        # Persistent index of uploaded file_ids for instant re-sends
+        self.FILE_INDEX_DB = os.environ.get('FILE_INDEX_DB', 'file_index.db')
+        
+        # Journal of in-progress jobs so they resume after a restart
+        self.JOB_JOURNAL_DB = os.environ.get('JOB_JOURNAL_DB', 'job_journal.db')
+        
+        # Job scheduling and admission control
+        self.DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR', os.path.join(os.getcwd(), 'downloads'))
+        self.MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 5))
+        self.USER_JOB_LIMIT = int(os.environ.get('USER_JOB_LIMIT', 2))
+        self.USER_QUEUE_LIMIT = int(os.environ.get('USER_QUEUE_LIMIT', 5))
+        self.MIN_FREE_DISK = int(os.environ.get('MIN_FREE_DISK', 1024 * 1024 * 1024))
+        # Orphaned files are evicted until this much is free again
+        self.DISK_HIGH_WATERMARK = int(os.environ.get('DISK_HIGH_WATERMARK', 2 * self.MIN_FREE_DISK))
+        self.ORPHAN_MIN_AGE = int(os.environ.get('ORPHAN_MIN_AGE', 1800))
+        self.FALLOC_MIN_SIZE = int(os.environ.get('FALLOC_MIN_SIZE', 64 * 1024 * 1024))
+        self.MAX_TOTAL_BANDWIDTH = int(os.environ.get('MAX_TOTAL_BANDWIDTH', 0))  # bytes/s, split fairly between users; 0 = unlimited
+        
+        # Upload parts to Telegram while aria2 is still downloading
+        self.STREAMING_UPLOAD = os.environ.get('STREAMING_UPLOAD', 'true').lower() == 'true'
+        self.STREAM_UPLOAD_MIN_SIZE = int(os.environ.get('STREAM_UPLOAD_MIN_SIZE', 100 * 1024 * 1024))
+        self.BOT_UPLOAD_LIMIT = 2000 * 1024 * 1024
+        self.PREMIUM_UPLOAD_LIMIT = 4000 * 1024 * 1024
+        
+        # Upper bound on parallel MTProto media connections per upload; tuned per client below it
+        self.UPLOAD_CONNECTIONS = int(os.environ.get('UPLOAD_CONNECTIONS', 6))
+        
+        # Per-job stage traces, one JSON line per job, rotated by size
+        self.TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+        self.TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', 10 * 1024 * 1024))
+        self.TRACE_BACKUPS = int(os.environ.get('TRACE_BACKUPS', 5))
+        self.MAX_PROFILE_SECONDS = 120
+        
     def _get_env_var(self, key: str) -> str:
         value = os.environ.get(key, '')
         if not value:
@@ -78,31 +148,29 @@ class Config:
 config = Config()
 
 class Aria2Manager:
-    """Enhanced Aria2 download manager with better error handling"""
+    """Asyncio aria2 download manager built on the pooled JSON-RPC client"""
     
     def __init__(self):
-        self.api = None
-        self.initialize()
+        self.rpc = Aria2RPC(config.ARIA2_HOST, config.ARIA2_PORT, config.ARIA2_SECRET)
+        self.watcher = Aria2NotificationWatcher(self.rpc, config.ARIA2_WS_URL)
+        self.sampler = Aria2StatusSampler(self.rpc)
+        self.bandwidth = BandwidthScheduler(self.rpc, config.MAX_TOTAL_BANDWIDTH)
+        self.tuner = Aria2Tuner(self.rpc, self.bandwidth.limit_of)
+        self.connected = False
         
-    def initialize(self):
-        """Initialize Aria2 API with enhanced settings"""
+    async def initialize(self) -> bool:
+        """Apply enhanced global options; safe to call again to reconnect"""
         try:
-            client = Aria2Client(
-                host=config.ARIA2_HOST,
-                port=config.ARIA2_PORT,
-                secret=config.ARIA2_SECRET
-            )
-            self.api = Aria2API(client)
-            
             # Enhanced options for better performance
             options = {
                 "max-tries": "50",
                 "retry-wait": "2",
                 "continue": "true",
                 "allow-overwrite": "true",
-                "min-split-size": "1M",
-                "split": "16",
-                "max-connection-per-server": "16",
+                # Defaults for untuned downloads; the tuner sets these per download
+                "min-split-size": f"{Aria2Tuner.SEGMENT_SIZE // 2 // Aria2Tuner.MIN_SPLIT_SIZE}M",
+                "split": str(Aria2Tuner.DEFAULT_CONNECTIONS),
+                "max-connection-per-server": str(Aria2Tuner.DEFAULT_CONNECTIONS),
                 "max-concurrent-downloads": "5",  # Reduced for stability
                 "optimize-concurrent-downloads": "true",
                 "async-dns": "true",
@@ -112,32 +180,92 @@ class Aria2Manager:
                 "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
             }
             
-            self.api.set_global_options(options)
+            await self.rpc.call("aria2.changeGlobalOption", options)
+            self.watcher.start()
+            self.connected = True
             logger.info("Aria2 initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize Aria2: {e}")
-            self.api = None
+            self.connected = False
+        return self.connected
     
-    def add_download(self, url: str, options: Dict[str, Any] = None):
+    async def add_download(self, url: str, options: Dict[str, Any] = None) -> Aria2Download:
         """Add a download with error handling"""
-        if not self.api:
+        if not self.connected and not await self.initialize():
             raise Exception("Aria2 not initialized")
         
         try:
-            return self.api.add_uris([url], options=options)
+            options = {"dir": config.DOWNLOAD_DIR, **(options or {})}
+            gid = await self.rpc.call("aria2.addUri", [url], options, retry=False)
+            return await self.get_download(gid)
         except Exception as e:
             logger.error(f"Failed to add download: {e}")
             raise
     
-    def get_active_downloads(self):
-        """Get number of active downloads"""
-        if not self.api:
-            return 0
+    async def get_download(self, gid: str) -> Aria2Download:
+        """Fetch the full status of a single download"""
+        return Aria2Download(self.rpc, await self.rpc.call("aria2.tellStatus", gid))
+    
+    async def get_downloads(self) -> list:
+        """Get active, waiting and stopped downloads in a single round-trip"""
+        results = await self.rpc.multicall([
+            ("aria2.tellActive", []),
+            ("aria2.tellWaiting", [0, 1000]),
+            ("aria2.tellStopped", [0, 1000])
+        ])
+        return [
+            Aria2Download(self.rpc, status)
+            for result in results if not isinstance(result, Aria2RPCError)
+            for status in result
+        ]
+    
+    async def remove(self, download: Aria2Download, files: bool = False):
+        """Stop a download, forget its result and optionally delete its files"""
         try:
-            return len(self.api.get_downloads())
-        except:
+            await self.rpc.call("aria2.forceRemove", download.gid)
+        except Aria2RPCError:
+            pass  # Already stopped
+        try:
+            await self.rpc.call("aria2.removeDownloadResult", download.gid)
+        except Aria2RPCError:
+            pass
+        if files:
+            await asyncio.to_thread(self._remove_files, download.files)
+    
+    @staticmethod
+    def _remove_files(paths):
+        """Delete downloaded files together with their aria2 control files"""
+        for path in paths:
+            for candidate in (path, f"{path}.aria2"):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+    
+    async def get_active_downloads(self) -> int:
+        """Get number of active and queued downloads"""
+        try:
+            stat = await self.rpc.call("aria2.getGlobalStat")
+            return int(stat["numActive"]) + int(stat["numWaiting"])
+        except Exception:
             return 0
+    
+    async def stream_progress(self, download: Aria2Download) -> tuple:
+        """(contiguous bytes on disk, file path, status) for a streaming upload"""
+        await download.update(["status", "bitfield", "pieceLength", "totalLength", "files"])
+        available = contiguous_bytes(download.bitfield, download.piece_length, download.total_length)
+        return available, download.file_path, download.status
+    
+    def wait_for_completion(self, gid: str) -> asyncio.Future:
+        """Future resolved by the shared notification watcher when aria2 stops the GID"""
+        return self.watcher.wait_for(gid)
+    
+    async def close(self):
+        """Stop background watchers and close the RPC connection pool"""
+        await self.watcher.stop()
+        await self.sampler.stop()
+        await self.tuner.stop()
+        await self.bandwidth.stop()
+        await self.rpc.close()
 
 class TeraBoxExtractor:
     """Enhanced TeraBox link extractor with multiple API fallbacks"""
@@ -151,6 +279,9 @@ class TeraBoxExtractor:
     
     def __init__(self):
         self.session = None
+        self.cache = LinkCache(config.LINK_CACHE_SIZE, config.LINK_CACHE_TTL, config.LINK_CACHE_DB or None)
+        self.endpoint_health = {template: EndpointHealth(template) for template in config.API_ENDPOINTS}
+        self.direct_hosts = set()  # CDN hosts of extracted links, the only ones the web player probes
         
     async def create_session(self):
         """Create aiohttp session if not exists"""
@@ -165,6 +296,7 @@ class TeraBoxExtractor:
         """Close aiohttp session"""
         if self.session:
             await self.session.close()
+        self.cache.close()
     
     def is_valid_url(self, url: str) -> bool:
         """Check if URL is from a valid TeraBox domain"""
@@ -174,30 +306,124 @@ class TeraBoxExtractor:
         except:
             return False
     
+    def get_share_id(self, url: str) -> str:
+        """Canonical share ID so every mirror domain and URL form maps to one key"""
+        try:
+            parsed_url = urlparse(url)
+            surl = urllib.parse.parse_qs(parsed_url.query).get("surl")
+            if surl:
+                return surl[0]
+            parts = [p for p in parsed_url.path.split("/") if p]
+            if len(parts) >= 2 and parts[-2] == "s":
+                # /s/1AbCd and ?surl=AbCd refer to the same share
+                share = parts[-1]
+                return share[1:] if share.startswith("1") else share
+        except Exception:
+            pass
+        return url
+    
     async def extract_direct_link(self, url: str) -> Optional[Dict[str, Any]]:
-        """Extract direct download link with multiple API fallback"""
+        """Extract direct download link, served from cache when still valid"""
+        share_id = self.get_share_id(url)
+        cached = await self.cache.get(share_id)
+        if cached:
+            logger.info(f"Link cache hit for {share_id}")
+            self._remember_host(cached.get("direct_url"))
+            return cached
+        
+        link_info = await self._extract_from_apis(url)
+        if link_info and link_info.get("direct_url"):
+            self._remember_host(link_info["direct_url"])
+            await self.cache.set(share_id, link_info, self.cache.ttl_for(link_info["direct_url"]))
+        return link_info
+    
+    def _remember_host(self, direct_url: Optional[str]):
+        if direct_url:
+            self.direct_hosts.add(urlparse(direct_url).hostname)
+    
+    def is_direct_host(self, url: str) -> bool:
+        """Whether ``url`` points at a host extracted direct links were served from"""
+        return urlparse(url).hostname in self.direct_hosts
+    
+    async def _extract_from_apis(self, url: str) -> Optional[Dict[str, Any]]:
+        """Race the API endpoints with hedged requests, best-ranked first.
+
+        The next endpoint is launched when the current one fails or has not
+        answered within its adaptive hedge delay; the first valid response
+        wins and the remaining requests are cancelled.
+        """
         await self.create_session()
         
-        for api_url_template in config.API_ENDPOINTS:
-            try:
-                api_url = api_url_template.format(urllib.parse.quote(url, safe=''))
-                logger.info(f"Trying API: {api_url}")
+        queue = self.rank_endpoints()
+        pending = set()
+        try:
+            while queue or pending:
+                timeout = None
+                if queue:
+                    api_url_template = queue.pop(0)
+                    pending.add(asyncio.create_task(self._query_endpoint(api_url_template, url)))
+                    if queue:
+                        timeout = self.endpoint_health[api_url_template].hedge_delay()
                 
-                async with self.session.get(api_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        # Handle different API response formats
-                        if self._is_valid_response(data):
-                            return self._extract_file_info(data)
-                        
-            except Exception as e:
-                logger.warning(f"API failed {api_url_template}: {e}")
-                continue
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    link_info = task.result()
+                    if link_info:
+                        return link_info
+        finally:
+            for task in pending:
+                task.cancel()
         
         logger.error("All API endpoints failed")
         return None
     
+    def rank_endpoints(self) -> list:
+        """Endpoints with a closed (or probing) circuit, best score first"""
+        ranked = sorted(config.API_ENDPOINTS, key=lambda t: self.endpoint_health[t].score())
+        available = [t for t in ranked if self.endpoint_health[t].available()]
+        # With every circuit open, still try the best one rather than fail outright
+        return available or ranked[:1]
+    
+    async def _query_endpoint(self, api_url_template: str, url: str) -> Optional[Dict[str, Any]]:
+        """Query one endpoint and feed the outcome into its health score"""
+        health = self.endpoint_health[api_url_template]
+        api_url = api_url_template.format(urllib.parse.quote(url, safe=''))
+        started = time.monotonic()
+        health.begin()
+        try:
+            logger.info(f"Trying API: {api_url}")
+            async with self.session.get(api_url) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    
+                    # Handle different API response formats
+                    if self._is_valid_response(data):
+                        elapsed = time.monotonic() - started
+                        health.record_success(elapsed)
+                        self._record_endpoint(api_url_template, "success", elapsed)
+                        return self._extract_file_info(data)
+                logger.warning(f"API returned no link {api_url_template}: HTTP {response.status}")
+        except asyncio.CancelledError:
+            # Lost the race; neither a success nor a failure
+            health.probing = False
+            raise
+        except Exception as e:
+            logger.warning(f"API failed {api_url_template}: {e}")
+        
+        elapsed = time.monotonic() - started
+        health.record_failure(elapsed)
+        self._record_endpoint(api_url_template, "failure", elapsed)
+        return None
+    
+    @staticmethod
+    def _record_endpoint(api_url_template: str, result: str, elapsed: float):
+        endpoint = urllib.parse.urlsplit(api_url_template).netloc
+        metrics.ENDPOINT_REQUESTS.labels(endpoint, result).inc()
+        metrics.ENDPOINT_LATENCY.labels(endpoint).observe(elapsed)
+        tracing.event("api_query", endpoint=endpoint, result=result, seconds=round(elapsed, 3))
+    
     def _is_valid_response(self, data: Dict[str, Any]) -> bool:
         """Check if API response is valid"""
         return (
@@ -271,25 +497,32 @@ class ProgressTracker:
             return f"{hours:.0f}h {minutes:.0f}m {secs:.0f}s"
 
 class SafeMessaging:
-    """Safe messaging with FloodWait handling and retry logic"""
+    """Safe messaging with FloodWait handling and retry logic.
+    
+    Calls are paced by a limiter shared across tasks, and a FloodWait is
+    recorded there so every task sending to the same scope waits it out.
+    """
     
     MAX_RETRIES = 3
     BASE_DELAY = 1
+    limiter = FloodLimiter()
     
     @classmethod
     async def send_message(cls, client: Client, chat_id: int, text: str, 
                           reply_markup=None, retries: int = 0) -> Optional[Message]:
         """Safely send message with exponential backoff"""
         try:
+            await cls.limiter.wait(client, chat_id, "send_message")
             return await client.send_message(chat_id, text, reply_markup=reply_markup)
         except FloodWait as e:
             if retries < cls.MAX_RETRIES:
                 logger.warning(f"FloodWait: {e.value}s (retry {retries + 1})")
-                await asyncio.sleep(e.value)
+                cls.limiter.record_flood(client, chat_id, e.value, "send_message")
                 return await cls.send_message(client, chat_id, text, reply_markup, retries + 1)
         except Exception as e:
             logger.error(f"Error sending message: {e}")
             if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="send_message", attempt=retries + 1, error=str(e))
                 delay = cls.BASE_DELAY * (2 ** retries)
                 await asyncio.sleep(delay)
                 return await cls.send_message(client, chat_id, text, reply_markup, retries + 1)
@@ -300,15 +533,17 @@ class SafeMessaging:
                           retries: int = 0) -> Optional[Message]:
         """Safely edit message with exponential backoff"""
         try:
+            await cls.limiter.wait(message._client, message.chat.id, "edit_message")
             return await message.edit_text(text, reply_markup=reply_markup)
         except FloodWait as e:
             if retries < cls.MAX_RETRIES:
                 logger.warning(f"FloodWait on edit: {e.value}s (retry {retries + 1})")
-                await asyncio.sleep(e.value)
+                cls.limiter.record_flood(message._client, message.chat.id, e.value, "edit_message")
                 return await cls.edit_message(message, text, reply_markup, retries + 1)
         except Exception as e:
             logger.error(f"Error editing message: {e}")
             if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="edit_message", attempt=retries + 1, error=str(e))
                 delay = cls.BASE_DELAY * (2 ** retries)
                 await asyncio.sleep(delay)
                 return await cls.edit_message(message, text, reply_markup, retries + 1)
@@ -317,29 +552,144 @@ class SafeMessaging:
     @classmethod
     async def send_video(cls, client: Client, chat_id: int, video, 
                         caption=None, reply_markup=None, progress=None, 
-                        retries: int = 0) -> Optional[Message]:
-        """Safely send video with exponential backoff"""
+                        retries: int = 0, **video_meta) -> Optional[Message]:
+        """Safely send video with exponential backoff.
+        
+        ``video_meta`` carries optional ``duration``, ``width``, ``height``
+        and ``thumb`` (JPEG path) for the preview.
+        """
         try:
+            if isinstance(video, str) and os.path.isfile(video) and os.path.getsize(video) > BIG_FILE_SIZE:
+                # Big local files go over several media connections instead of pyrogram's single one
+                file_name = os.path.basename(video)
+                engine = ParallelUploadEngine(client, max_connections=config.UPLOAD_CONNECTIONS, progress=progress)
+                input_file = await engine.upload(video, os.path.getsize(video), file_name)
+                # Retries from here on resend the message, not the parts
+                return await cls.send_uploaded(
+                    client, chat_id, input_file, file_name, caption, reply_markup, **video_meta
+                )
+            await cls.limiter.wait(client, chat_id, "send_video")
             return await client.send_video(
                 chat_id, video, caption=caption, 
-                reply_markup=reply_markup, progress=progress
+                reply_markup=reply_markup, progress=progress,
+                duration=int(video_meta.get("duration", 0)),
+                width=video_meta.get("width", 0), height=video_meta.get("height", 0),
+                thumb=video_meta.get("thumb"), supports_streaming=True
             )
         except FloodWait as e:
             if retries < cls.MAX_RETRIES:
                 logger.warning(f"FloodWait on video: {e.value}s (retry {retries + 1})")
-                await asyncio.sleep(e.value)
+                cls.limiter.record_flood(client, chat_id, e.value, "send_video")
                 return await cls.send_video(
-                    client, chat_id, video, caption, reply_markup, progress, retries + 1
+                    client, chat_id, video, caption, reply_markup, progress, retries + 1, **video_meta
                 )
         except Exception as e:
             logger.error(f"Error sending video: {e}")
             if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="send_video", attempt=retries + 1, error=str(e))
                 delay = cls.BASE_DELAY * (2 ** retries)
                 await asyncio.sleep(delay)
                 return await cls.send_video(
-                    client, chat_id, video, caption, reply_markup, progress, retries + 1
+                    client, chat_id, video, caption, reply_markup, progress, retries + 1, **video_meta
+                )
+        return None
+    
+    @classmethod
+    async def send_uploaded(cls, client: Client, chat_id: int, input_file, file_name: str,
+                            caption=None, reply_markup=None, retries: int = 0, **video_meta) -> Optional[Message]:
+        """Safely send a video whose parts are already uploaded"""
+        try:
+            await cls.limiter.wait(client, chat_id, "send_video")
+            return await send_uploaded_video(
+                client, chat_id, input_file, file_name, caption=caption or "", reply_markup=reply_markup,
+                **video_meta
+            )
+        except FloodWait as e:
+            if retries < cls.MAX_RETRIES:
+                logger.warning(f"FloodWait on uploaded video: {e.value}s (retry {retries + 1})")
+                cls.limiter.record_flood(client, chat_id, e.value, "send_video")
+                return await cls.send_uploaded(
+                    client, chat_id, input_file, file_name, caption, reply_markup, retries + 1, **video_meta
+                )
+        except Exception as e:
+            logger.error(f"Error sending uploaded video: {e}")
+            if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="send_uploaded", attempt=retries + 1, error=str(e))
+                delay = cls.BASE_DELAY * (2 ** retries)
+                await asyncio.sleep(delay)
+                return await cls.send_uploaded(
+                    client, chat_id, input_file, file_name, caption, reply_markup, retries + 1, **video_meta
+                )
+        return None
+    
+    @classmethod
+    async def send_document(cls, client: Client, chat_id: int, document,
+                            caption=None, reply_markup=None, retries: int = 0) -> Optional[Message]:
+        """Safely send document with exponential backoff"""
+        try:
+            await cls.limiter.wait(client, chat_id, "send_document")
+            return await client.send_document(
+                chat_id, document, caption=caption, reply_markup=reply_markup
+            )
+        except FloodWait as e:
+            if retries < cls.MAX_RETRIES:
+                logger.warning(f"FloodWait on document: {e.value}s (retry {retries + 1})")
+                cls.limiter.record_flood(client, chat_id, e.value, "send_document")
+                return await cls.send_document(
+                    client, chat_id, document, caption, reply_markup, retries + 1
+                )
+        except Exception as e:
+            logger.error(f"Error sending document: {e}")
+            if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="send_document", attempt=retries + 1, error=str(e))
+                delay = cls.BASE_DELAY * (2 ** retries)
+                await asyncio.sleep(delay)
+                return await cls.send_document(
+                    client, chat_id, document, caption, reply_markup, retries + 1
                 )
         return None
+    
+    @classmethod
+    async def send_media_group(cls, client: Client, chat_id: int, media: list,
+                               retries: int = 0) -> Optional[list]:
+        """Safely send an album with exponential backoff"""
+        try:
+            await cls.limiter.wait(client, chat_id, "send_media_group")
+            return await client.send_media_group(chat_id, media)
+        except FloodWait as e:
+            if retries < cls.MAX_RETRIES:
+                logger.warning(f"FloodWait on media group: {e.value}s (retry {retries + 1})")
+                cls.limiter.record_flood(client, chat_id, e.value, "send_media_group")
+                return await cls.send_media_group(client, chat_id, media, retries + 1)
+        except Exception as e:
+            logger.error(f"Error sending media group: {e}")
+            if retries < cls.MAX_RETRIES:
+                tracing.event("retry", method="send_media_group", attempt=retries + 1, error=str(e))
+                delay = cls.BASE_DELAY * (2 ** retries)
+                await asyncio.sleep(delay)
+                return await cls.send_media_group(client, chat_id, media, retries + 1)
+        return None
+
+class DiskSpaceDeferred(Exception):
+    """The size learned at extraction doesn't fit on disk yet; the job goes back in the queue"""
+    
+    def __init__(self, size: int):
+        super().__init__(f"{size} bytes don't fit on disk yet")
+        self.size = size
+
+class InflightJob:
+    """A share being leeched right now; later requests for it attach as followers"""
+    
+    def __init__(self, share_id: str):
+        self.share_id = share_id
+        self.followers = []  # Status messages of attached requests
+        self.result = asyncio.get_running_loop().create_future()
+        self.deferred_to = None  # Journal ID of a leader back in the queue for disk space
+    
+    def finish(self, result: Optional[tuple]):
+        """Publish (file_id, name, link_info), or None on failure, to followers"""
+        if not self.result.done():
+            self.result.set_result(result)
 
 class BotManager:
     """Main bot manager class"""
@@ -348,25 +698,258 @@ class BotManager:
         self.app = Client("jetbot", api_id=config.API_ID, api_hash=config.API_HASH, bot_token=config.BOT_TOKEN)
         self.aria2 = Aria2Manager()
         self.extractor = TeraBoxExtractor()
+        self.file_index = FileIndex(config.FILE_INDEX_DB)
+        self.journal = JobJournal(config.JOB_JOURNAL_DB)
+        self.disk = DiskManager(
+            config.DOWNLOAD_DIR, config.MIN_FREE_DISK, config.DISK_HIGH_WATERMARK,
+            falloc_min_size=config.FALLOC_MIN_SIZE, orphan_min_age=config.ORPHAN_MIN_AGE,
+            in_use=self._aria2_paths
+        )
+        # Shared with requests_handler so both modules hit the same cache
+        self.membership = shared_cache(
+            config.FSUB_ID,
+            positive_ttl=config.MEMBERSHIP_TTL,
+            negative_ttl=config.MEMBERSHIP_NEGATIVE_TTL
+        )
         self.video_links = {}  # Store video links for play buttons
+        self.inflight: Dict[str, InflightJob] = {}  # share_id -> job being leeched
+        self.scheduler = JobScheduler(
+            workers=config.MAX_CONCURRENT_JOBS,
+            per_user_limit=config.USER_JOB_LIMIT,
+            per_user_queue_limit=config.USER_QUEUE_LIMIT,
+            admission=self._admit_job
+        )
+        self._background_tasks = set()
+        self.profiler: Optional[tracing.SamplingProfiler] = None
+        tracing.configure(config.TRACE_FILE, config.TRACE_MAX_BYTES, config.TRACE_BACKUPS)
+        # Progress edits are coalesced and paced per chat
+        self.progress = ProgressUpdater(SafeMessaging.edit_message)
         
-    async def is_user_member(self, user_id: int) -> bool:
-        """Check if user is member of required channel"""
-        try:
-            member = await self.app.get_chat_member(config.FSUB_ID, user_id)
-            return member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
-        except (UserNotParticipant, ChatAdminRequired):
+        # Uploads go through the bot or user sessions, whichever is best placed
+        self.uploaders = UploadClientPool(flood_until=SafeMessaging.limiter.flood_until)
+        self.uploaders.add(self.app, "bot", config.BOT_UPLOAD_LIMIT, is_bot=True)
+        self.stream_proxy = StreamProxy(
+            config.BOT_TOKEN, config.STREAM_CACHE_DIR, config.STREAM_CACHE_SIZE, self._resolve_share
+        )
+        self.web = PlayerServer(
+            config.WEB_HOST, config.PORT,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "index.html"),
+            lookup=lambda url: self.extractor.cache.find("direct_url", url),
+            probe_allowed=lambda url: self.extractor.is_direct_host(url),
+            stream_proxy=self.stream_proxy
+        )
+        metrics.QUEUE_DEPTH.set_function(lambda: self.scheduler.queued)
+        metrics.JOBS_RUNNING.set_function(lambda: self.scheduler.active)
+        self.user_clients = [
+            Client(f"uploader{i}", api_id=config.API_ID, api_hash=config.API_HASH,
+                   session_string=session, in_memory=True, no_updates=True)
+            for i, session in enumerate(config.USER_SESSION_STRINGS)
+        ]
+        
+    async def start(self):
+        """Connect background services once the event loop is running"""
+        await self.web.start()
+        await self.aria2.initialize()
+        await self._start_user_clients()
+        self.scheduler.start()
+        self.progress.start()
+        self.disk.start()
+        await self.resume_jobs()
+    
+    async def _start_user_clients(self):
+        """Add every working user session to the upload pool"""
+        for user_client in self.user_clients:
+            try:
+                await user_client.start()
+                me = await user_client.get_me()
+                # Resolve the dump chat once so uploads can address it
+                await user_client.get_chat(config.DUMP_CHAT_ID)
+                limit = config.PREMIUM_UPLOAD_LIMIT if me.is_premium else config.BOT_UPLOAD_LIMIT
+                self.uploaders.add(user_client, f"user:{me.id}", limit)
+                logger.info(f"User session {me.id} ready for uploads "
+                            f"(limit {ProgressTracker.format_size(limit)})")
+            except Exception as e:
+                logger.error(f"Failed to start user session {user_client.name}: {e}")
+    
+    async def stop(self):
+        """Flush pending progress edits, stop the web player and disconnect user sessions"""
+        await self.progress.stop()
+        await self.disk.stop()
+        await self.web.stop()
+        for user_client in self.user_clients:
+            if user_client.is_connected:
+                await user_client.stop()
+    
+    async def _resolve_share(self, share_id: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Direct link for the stream proxy; ``refresh`` skips a cached link upstream rejected"""
+        if refresh:
+            await self.extractor.cache.invalidate(share_id)
+        return await self.extractor.extract_direct_link(f"https://www.terabox.com/sharing/link?surl={share_id}")
+    
+    async def resume_jobs(self):
+        """Pick up jobs the journal says were interrupted by the last shutdown.
+
+        Downloads aria2 still knows about are reattached (or go straight to
+        upload if they finished meanwhile); anything else is queued again
+        from the start, reusing the user's original status message.
+        """
+        for entry in await self.journal.pending():
+            try:
+                message = await self.app.get_messages(entry["chat_id"], entry["message_id"])
+                status_message = None
+                if entry["status_message_id"]:
+                    status_message = await self.app.get_messages(entry["chat_id"], entry["status_message_id"])
+                    if status_message.empty:
+                        status_message = None
+            except Exception as e:
+                logger.warning(f"Dropping journal entry {entry['job_id']}: {e}")
+                await self.journal.finish(entry["job_id"])
+                continue
+            if message.empty or not message.from_user:
+                await self.journal.finish(entry["job_id"])
+                continue
+            
+            resume = None
+            if entry["gid"] and entry["link_info"]:
+                try:
+                    download = await self.aria2.get_download(entry["gid"])
+                    if download.status not in ("error", "removed"):
+                        resume = (download, entry["link_info"])
+                except Exception:
+                    pass  # aria2 restarted too; the partial file is continued on re-add
+            
+            job = ScheduledJob(
+                message.from_user.id,
+                functools.partial(self.handle_download_process, self.app, message, entry["url"],
+                                  status_message, entry["job_id"], resume),
+                priority=0 if self.is_admin(message.from_user.id) else 1
+            )
+            if not await self.scheduler.submit(job):
+                # Left in the journal it would be resumed again on every restart
+                logger.warning(f"Dropping journal entry {entry['job_id']}: user's queue is full")
+                await self.journal.finish(entry["job_id"])
+                if resume:
+                    try:
+                        await self.aria2.remove(resume[0], files=True)
+                    except Exception as e:
+                        logger.error(f"Aria2 cleanup error: {e}")
+                if status_message:
+                    await SafeMessaging.edit_message(
+                        status_message,
+                        "♻️ <b>Bot restarted</b>\n\n❌ Your queue is full, so this job was dropped. "
+                        "Please send the link again later."
+                    )
+                continue
+            if status_message:
+                await SafeMessaging.edit_message(
+                    status_message, "♻️ <b>Bot restarted</b>\n\n⏳ Resuming your job..."
+                )
+            logger.info(f"Resumed journal entry {entry['job_id']} at stage {entry['stage']}"
+                        f"{' (reattached)' if resume else ''}")
+    
+    def _admit_job(self, job: ScheduledJob) -> bool:
+        """Admission control: enough free disk to start a job.
+
+        Bandwidth isn't gated here: the bandwidth scheduler gives every
+        admitted job a fair share of MAX_TOTAL_BANDWIDTH, which it can only
+        do once the job reaches aria2.
+        """
+        return self.disk.can_admit(job.expected_size)
+    
+    async def _aria2_paths(self) -> list:
+        """Files of every download aria2 knows about, which eviction must keep"""
+        return [path for download in await self.aria2.get_downloads() for path in download.files]
+    
+    def _run_in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def enqueue(self, client: Client, message: Message, url: str):
+        """Queue a leech request and return immediately"""
+        user_id = message.from_user.id
+        share_id = self.extractor.get_share_id(url)
+        
+        # Cache hits and followers of an in-flight job need no worker slot
+        if share_id in self.inflight or await self.file_index.find_by_share(share_id):
+            self._run_in_background(self.handle_download_process(client, message, url))
+            return
+        
+        status_message = await SafeMessaging.send_message(client, message.chat.id, "⏳ Adding to queue...")
+        if not status_message:
+            return
+        journal_id = await self.journal.create(
+            url, share_id, user_id, message.chat.id, message.id, status_message.id
+        )
+        cached_link = await self.extractor.cache.get(share_id)
+        await self._schedule(client, message, url, status_message, journal_id,
+                             int(cached_link.get("size_bytes") or 0) if cached_link else 0)
+    
+    async def _schedule(self, client: Client, message: Message, url: str, status_message,
+                        journal_id: int, expected_size: int) -> bool:
+        """Submit a journaled job; False (and the user told) if their queue is full or it can never fit"""
+        user_id = message.from_user.id
+        if self._disk_needed(expected_size) > self.disk.capacity():
+            # It would wait for disk space forever
+            await self.journal.finish(journal_id)
+            await SafeMessaging.edit_message(status_message, self._too_big_text(expected_size))
             return False
-        except Exception as e:
-            logger.error(f"Error checking membership for user {user_id}: {e}")
+        
+        async def on_position(position: int):
+            await SafeMessaging.edit_message(
+                status_message,
+                f"⏳ <b>QUEUED</b>\n\n"
+                f"📋 You are <b>#{position}</b> in queue.\n"
+                f"🔄 Active jobs: {self.scheduler.active}/{config.MAX_CONCURRENT_JOBS}"
+            )
+        
+        job = ScheduledJob(
+            user_id,
+            lambda: self.handle_download_process(client, message, url, status_message, journal_id),
+            priority=0 if self.is_admin(user_id) else 1,
+            expected_size=self._disk_needed(expected_size),
+            on_position=on_position
+        )
+        position = await self.scheduler.submit(job)
+        if position is None:
+            await self.journal.finish(journal_id)
+            await SafeMessaging.edit_message(
+                status_message,
+                f"❌ You already have {config.USER_QUEUE_LIMIT} links waiting in queue.\n\n"
+                "Please wait for them to finish."
+            )
             return False
+        if job.position:
+            # Still waiting for a worker
+            await on_position(job.position)
+        return True
+        
+    def _disk_needed(self, size: int) -> int:
+        """Disk space a job for a ``size``-byte file peaks at; split parts are a second copy"""
+        return 2 * size if size > self.uploaders.max_upload_size else size
+    
+    def _too_big_text(self, size: int) -> str:
+        return (
+            f"❌ This file is too large for the bot's disk.\n\n"
+            f"📏 Size: {ProgressTracker.format_size(size)}\n"
+            f"💾 Needs {ProgressTracker.format_size(self._disk_needed(size))} of disk space, "
+            f"at most {ProgressTracker.format_size(max(0, self.disk.capacity()))} is available."
+        )
+    
+    async def is_user_member(self, user_id: int) -> bool:
+        """Check if user is member of required channel"""
+        return await self.membership.is_member(self.app, user_id)
     
     def is_admin(self, user_id: int) -> bool:
         """Check if user is admin"""
         return user_id in config.ADMIN_IDS
     
-    def create_play_button_markup(self, download_url: str, filename: str, file_id: str = None):
+    def create_play_button_markup(self, download_url: str, filename: str, file_id: str = None,
+                                  share_id: str = None):
         """Create inline keyboard with play video button and web app player"""
+        if share_id:
+            # Cached, seekable and immune to direct-link expiry
+            download_url = f"{config.SERVER_URL}/stream/{self.stream_proxy.token_for(share_id)}"
         encoded_url = urllib.parse.quote(download_url, safe='')
         encoded_filename = urllib.parse.quote(filename, safe='')
         
@@ -387,19 +970,222 @@ class BotManager:
         
         return InlineKeyboardMarkup([[play_button], [webapp_button]])
     
-    async def handle_download_process(self, client: Client, message: Message, url: str):
-        """Handle the complete download process"""
-        user_id = message.from_user.id
+    def build_caption(self, name: str, user_id: int, user_name: str) -> str:
+        """Caption used for leeched videos"""
+        return (
+            f"✨ {name}\n"
+            f"👤 ʟᴇᴇᴄʜᴇᴅ ʙʏ : <a href='tg://user?id={user_id}'>{user_name}</a>\n"
+            f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n\n"
+            "[Telugu stuff ❤️🚀](https://t.me/dailydiskwala)"
+        )
+    
+    async def send_cached_file(self, client: Client, chat_id: int, file_id: str, status_message,
+                               user_id: int, user_name: str, name: str, link_info: dict = None,
+                               share_id: str = None) -> bool:
+        """Re-send an already uploaded file by file_id; False if Telegram rejects it"""
+        play_markup = None
+        if share_id or (link_info and link_info.get("direct_url")):
+            direct_url = link_info.get("direct_url") if link_info else None
+            play_markup = self.create_play_button_markup(direct_url, name, share_id=share_id)
         
-        # Create status message
-        status_message = await SafeMessaging.send_message(
-            client, message.chat.id, "🔍 Extracting file info..."
+        sent = await self.send_file_ids(
+            client, chat_id, file_id, self.build_caption(name, user_id, user_name), play_markup
+        )
+        if not sent:
+            logger.warning(f"Cached file_id rejected, forgetting it: {file_id}")
+            await self.file_index.forget(file_id)
+            return False
+        
+        await SafeMessaging.edit_message(
+            status_message,
+            f"✅ <b>PROCESS COMPLETED</b>\n\n"
+            f"📁 <b>{name}</b>\n"
+            f"⚡ <b>Sent instantly from cache</b>\n\n"
+            f"👤 <b>User:</b> <a href='tg://user?id={user_id}'>{user_name}</a>\n"
         )
+        return True
+    
+    async def send_file_ids(self, client: Client, chat_id: int, file_id: str, caption: str,
+                            reply_markup=None) -> bool:
+        """Send one file_id, or an ordered album for comma-joined split parts"""
+        file_ids = file_id.split(",")
+        if len(file_ids) == 1:
+            return bool(await SafeMessaging.send_video(
+                client, chat_id, file_id, caption=caption, reply_markup=reply_markup
+            ))
+        
+        media = []
+        for index, part_id in enumerate(file_ids, 1):
+            part_caption = f"{caption if index == 1 else ''}\n\n📦 Part {index}/{len(file_ids)}".strip()
+            if FileId.decode(part_id).file_type == FileType.VIDEO:
+                media.append(InputMediaVideo(part_id, caption=part_caption, supports_streaming=True))
+            else:
+                media.append(InputMediaDocument(part_id, caption=part_caption))
+        
+        # Albums hold at most 10 items
+        for start in range(0, len(media), 10):
+            if not await SafeMessaging.send_media_group(client, chat_id, media[start:start + 10]):
+                return False
+        if reply_markup:
+            # Albums can't carry buttons
+            await SafeMessaging.send_message(client, chat_id, "🎬 Watch online:", reply_markup)
+        return True
+    
+    async def handle_download_process(self, client: Client, message: Message, url: str,
+                                      status_message: Message = None, journal_id: int = None,
+                                      resume: tuple = None):
+        """Handle the complete download process.
+
+        ``resume`` is ``(download, link_info)`` for a job reattached to a live
+        aria2 download after a restart.
+        """
+        # Create status message
+        if status_message:
+            if not resume:
+                await SafeMessaging.edit_message(status_message, "🔍 Extracting file info...")
+        else:
+            status_message = await SafeMessaging.send_message(
+                client, message.chat.id, "🔍 Extracting file info..."
+            )
         if not status_message:
+            await self.journal.finish(journal_id)
             return
         
+        if journal_id is None:
+            journal_id = await self.journal.create(
+                url, self.extractor.get_share_id(url), message.from_user.id,
+                message.chat.id, message.id, status_message.id, stage="extracting"
+            )
+        elif not resume:
+            await self.journal.update(journal_id, stage="extracting")
+        
+        cancelled = requeued = False
+        deferred_share = None
+        started = time.monotonic()
+        try:
+            with tracing.trace("job", journal_id=journal_id, url=url, user_id=message.from_user.id,
+                               chat_id=message.chat.id, resumed=bool(resume)):
+                try:
+                    await self._process_request(client, message, url, status_message, journal_id, resume)
+                except DiskSpaceDeferred as deferred:
+                    # Admitted before its size was known; wait in the queue like any job that doesn't fit
+                    deferred_share = self.extractor.get_share_id(url)
+                    tracing.event("requeued", size=deferred.size)
+                    await SafeMessaging.edit_message(
+                        status_message, "⏳ Waiting for disk space, your job is back in the queue..."
+                    )
+                    await self.journal.update(journal_id, stage="queued")
+                    requeued = await self._schedule(client, message, url, status_message, journal_id,
+                                                    deferred.size)
+        except asyncio.CancelledError:
+            # Shutdown: keep the journal entry so the job resumes on next start
+            cancelled = True
+            raise
+        finally:
+            if deferred_share and not requeued:
+                self._abandon_inflight(deferred_share)
+            if not cancelled and not requeued:
+                metrics.STAGE_SECONDS.labels("total").observe(time.monotonic() - started)
+                await self.journal.finish(journal_id)
+    
+    async def _process_request(self, client: Client, message: Message, url: str, status_message,
+                               journal_id: int, resume: tuple = None):
+        """Serve a request from the index, an in-flight job or a fresh leech"""
+        user_id = message.from_user.id
+        user_name = message.from_user.first_name
+        share_id = self.extractor.get_share_id(url)
+        
+        # Already leeched from this share: skip extraction, download and upload
+        file_id = await self.file_index.find_by_share(share_id)
+        tracing.event("index_lookup", share_id=share_id, hit=bool(file_id))
+        if file_id:
+            cached_link = await self.extractor.cache.get(share_id)
+            name = cached_link.get("filename", "Video") if cached_link else "Video"
+            if await self.send_cached_file(client, message.chat.id, file_id, status_message,
+                                           user_id, user_name, name, cached_link, share_id):
+                job = self.inflight.get(share_id)
+                if job and job.deferred_to == journal_id:
+                    del self.inflight[share_id]
+                    job.finish((file_id, name, cached_link))
+                return
+        
+        # Someone else is leeching this share right now: wait for their file
+        job = self.inflight.get(share_id)
+        if job and job.deferred_to == journal_id:
+            job.deferred_to = None  # Our own job, back from the queue with its followers
+        elif job:
+            with tracing.span("follow_inflight", share_id=share_id):
+                await self._follow_inflight(client, job, message.chat.id, status_message, user_id, user_name)
+            return
+        else:
+            job = InflightJob(share_id)
+            self.inflight[share_id] = job
+        result = None
+        try:
+            if resume:
+                download, link_info = resume
+                # Already admitted before the restart, so don't turn it away now
+                if not self.disk.reserve(share_id, self._disk_needed(int(link_info.get("size_bytes") or 0))):
+                    logger.warning(f"Resuming {share_id} below the free disk watermark")
+                self.disk.attach(share_id, download)
+                result = await self._download_and_upload(client, message.chat.id, status_message, user_id,
+                                                         user_name, download, link_info, share_id, job,
+                                                         journal_id)
+            else:
+                result = await self._leech(client, message.chat.id, status_message, user_id, user_name,
+                                           url, share_id, job, journal_id)
+        except DiskSpaceDeferred:
+            # Followers stay attached until the requeued job runs again
+            job.deferred_to = journal_id
+            raise
+        finally:
+            self.disk.release(share_id)
+            if job.deferred_to is None:
+                del self.inflight[share_id]
+                job.finish(result)
+    
+    def _abandon_inflight(self, share_id: str):
+        """Fail a deferred job whose leader won't run again, releasing its followers"""
+        job = self.inflight.pop(share_id, None)
+        if job:
+            job.finish(None)
+    
+    async def _follow_inflight(self, client: Client, job: "InflightJob", chat_id: int, status_message,
+                               user_id: int, user_name: str):
+        """Attach to the leader's job and send its file_id once uploaded"""
+        job.followers.append(status_message)
+        await SafeMessaging.edit_message(
+            status_message,
+            "🔗 <b>This link is already being processed</b>\n\n"
+            "⏳ You'll receive the file as soon as it's ready..."
+        )
+        
+        # Shielded so one follower giving up doesn't cancel the shared result
+        result = await asyncio.shield(job.result)
+        if not result:
+            await SafeMessaging.edit_message(
+                status_message,
+                "❌ Failed to process this link.\n\n"
+                "Please try again later."
+            )
+            return
+        
+        file_id, name, link_info = result
+        if not await self.send_cached_file(client, chat_id, file_id, status_message,
+                                           user_id, user_name, name, link_info, job.share_id):
+            await SafeMessaging.edit_message(
+                status_message, "❌ Failed to send the file. Please try again later."
+            )
+    
+    async def _leech(self, client: Client, chat_id: int, status_message, user_id: int, user_name: str,
+                     url: str, share_id: str, job: "InflightJob", journal_id: int = None) -> Optional[tuple]:
+        """Extract, download and upload a share; returns (file_id, name, link_info) on success"""
         # Extract direct download link
-        link_info = await self.extractor.extract_direct_link(url)
+        started = time.monotonic()
+        with tracing.span("extract") as attrs:
+            link_info = await self.extractor.extract_direct_link(url)
+            attrs["found"] = bool(link_info and link_info.get("direct_url"))
+        metrics.STAGE_SECONDS.labels("extract").observe(time.monotonic() - started)
         if not link_info or not link_info.get("direct_url"):
             await SafeMessaging.edit_message(
                 status_message,
@@ -407,12 +1193,19 @@ class BotManager:
                 "The link might be invalid, expired, or temporarily unavailable. "
                 "Please try again later or check if the link is correct."
             )
-            return
+            return None
         
         direct_url = link_info["direct_url"]
         filename = link_info.get("filename", "Unknown")
         size_text = link_info.get("size", "Unknown")
         
+        # Same file already uploaded from another share link
+        file_id = await self.file_index.find_by_name(filename, link_info.get("size_bytes"))
+        if file_id and await self.send_cached_file(client, chat_id, file_id, status_message,
+                                                   user_id, user_name, filename, link_info, share_id):
+            await self.file_index.record(file_id, share_id=share_id)
+            return file_id, filename, link_info
+        
         await SafeMessaging.edit_message(
             status_message,
             f"✅ File info extracted!\n\n"
@@ -421,38 +1214,115 @@ class BotManager:
             f"⏳ Starting download..."
         )
         
+        # Hold disk space for the whole file, and any copy made of it, before aria2 starts writing
+        size_bytes = int(link_info.get("size_bytes") or 0)
+        if self._disk_needed(size_bytes) > self.disk.capacity():
+            await SafeMessaging.edit_message(status_message, self._too_big_text(size_bytes))
+            return None
+        if not self.disk.reserve(share_id, self._disk_needed(size_bytes)):
+            raise DiskSpaceDeferred(size_bytes)
+        
+        # Overlap upload with download for big videos that fit one upload
+        streaming = (config.STREAMING_UPLOAD and filename.lower().endswith(VIDEO_EXTENSIONS) and
+                     config.STREAM_UPLOAD_MIN_SIZE <= size_bytes <= self.uploaders.max_upload_size)
+        
         # Start download
         try:
-            download = self.aria2.add_download(direct_url)
-            download.update()
+            options = {"file-allocation": self.disk.file_allocation(size_bytes),
+                       **self.aria2.tuner.options_for(direct_url, size_bytes)}
+            if streaming:
+                options["stream-piece-selector"] = "inorder"
+            with tracing.span("aria2_add", streaming=streaming, connections=options["split"]):
+                download = await self.aria2.add_download(direct_url, options)
         except Exception as e:
             logger.error(f"Download start error: {e}")
             await SafeMessaging.edit_message(
                 status_message, f"❌ Failed to start download: {str(e)}"
             )
-            return
+            return None
+        
+        self.disk.attach(share_id, download)
+        self.aria2.tuner.watch(download, direct_url, int(options["split"]))
+        await self.journal.update(journal_id, stage="downloading", gid=download.gid, link_info=link_info)
         
-        # Monitor download progress
-        await self._monitor_download_progress(download, status_message, user_id, message.from_user.first_name)
+        stream_task = None
+        if streaming:
+            stream_task = asyncio.create_task(
+                self._stream_upload(download, filename, self.build_caption(filename, user_id, user_name))
+            )
+        return await self._download_and_upload(client, chat_id, status_message, user_id, user_name,
+                                               download, link_info, share_id, job, journal_id, stream_task)
+    
+    async def _download_and_upload(self, client: Client, chat_id: int, status_message, user_id: int,
+                                   user_name: str, download: Aria2Download, link_info: Dict[str, Any],
+                                   share_id: str, job: "InflightJob", journal_id: int = None,
+                                   stream_task: asyncio.Task = None) -> Optional[tuple]:
+        """Wait for an added aria2 download, then upload it"""
+        # A reattached download may have finished while the bot was down
+        started = time.monotonic()
+        if download.status not in ("complete", "error", "removed"):
+            self.aria2.bandwidth.add(download, user_id, int(link_info.get("size_bytes") or 0),
+                                     admin=self.is_admin(user_id))
+            try:
+                with tracing.span("download", gid=download.gid) as attrs:
+                    await self._monitor_download_progress(download, status_message, user_id, user_name, job)
+                    attrs.update(status=download.status, bytes=download.total_length)
+            finally:
+                # Hand the bandwidth to the remaining downloads now rather than at the next rebalance
+                self.aria2.bandwidth.remove(download.gid)
+        self.aria2.tuner.finish(download)
         
         # Handle upload after download completion
         if download.is_complete:
-            await self._handle_upload(client, download, status_message, user_id, 
-                                    message.from_user.first_name, direct_url, filename, message.chat.id)
+            metrics.STAGE_SECONDS.labels("download").observe(time.monotonic() - started)
+            metrics.DOWNLOADED_BYTES.inc(download.total_length)
+            file_id = await self._handle_upload(client, download, status_message, user_id,
+                                                user_name, link_info, chat_id, share_id, stream_task,
+                                                journal_id)
+            return (file_id, download.name, link_info) if file_id else None
+        
+        if stream_task:
+            stream_task.cancel()
+        await SafeMessaging.edit_message(
+            status_message,
+            f"❌ Download failed: {download.error_message or download.status}\n\n"
+            "Please try again later."
+        )
+        try:
+            await self.aria2.remove(download, files=True)
+        except Exception as e:
+            logger.error(f"Aria2 cleanup error: {e}")
+        return None
     
-    async def _monitor_download_progress(self, download, status_message, user_id, user_name):
-        """Monitor download progress with enhanced updates"""
+    async def _monitor_download_progress(self, download, status_message, user_id, user_name, job=None):
+        """Monitor download progress until aria2 reports the download finished.
+
+        Completion is signalled by the shared notification watcher, so the
+        upload can start the moment aria2 is done; progress fields are kept
+        fresh by the central status sampler. Followers of a coalesced job
+        get the same progress on their own status messages; the progress
+        updater decides when each edit actually goes out.
+        """
         start_time = datetime.now()
-        previous_speed = 0
-        update_interval = 10
-        last_update = time.time()
+        update_interval = 2
+        completion = self.aria2.wait_for_completion(download.gid)
+        self.aria2.sampler.watch(download)
+        # Time spent in aria2's waiting queue shows up as the gap before this event
+        started = download.status == "active"
         
-        while not download.is_complete:
-            await asyncio.sleep(2)
-            current_time = time.time()
-            
-            if current_time - last_update >= update_interval:
-                download.update()
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(completion), timeout=update_interval)
+                break
+            except asyncio.TimeoutError:
+                # Fallback for when the notification socket is down
+                if not self.aria2.watcher.connected:
+                    await download.update(Aria2StatusSampler.KEYS)
+                    if download.status in ("complete", "error", "removed"):
+                        break
+                if not started and download.status == "active":
+                    started = True
+                    tracing.event("aria2_active", gid=download.gid)
                 progress = download.progress
                 progress_bar = ProgressTracker.get_progress_bar(progress)
                 
@@ -474,19 +1344,167 @@ class BotManager:
                     f"📦 <b>Downloaded:</b> {ProgressTracker.format_size(download.completed_length)} of {ProgressTracker.format_size(download.total_length)}\n"
                     f"⏱️ <b>ETA:</b> {eta_display}\n"
                     f"⏰ <b>Elapsed:</b> {ProgressTracker.format_time(elapsed_seconds)}\n\n"
-                    f"👤 <b>User:</b> <a href='tg://user?id={user_id}'>{user_name}</a>\n"
                 )
                 
-                await SafeMessaging.edit_message(status_message, status_text)
-                last_update = current_time
+                self.progress.update(
+                    status_message,
+                    status_text + f"👤 <b>User:</b> <a href='tg://user?id={user_id}'>{user_name}</a>\n"
+                )
+                if job:
+                    for follower_message in job.followers:
+                        self.progress.update(follower_message, status_text)
+        
+        # Later edits are final states and must not be overwritten by a queued update
+        await self.progress.forget(status_message)
+        if job:
+            for follower_message in job.followers:
+                await self.progress.forget(follower_message)
+        self.aria2.sampler.unwatch(download.gid)
+        await download.update()
+    
+    async def _video_meta(self, file_path: str, rewrite: bool = True) -> Dict[str, Any]:
+        """Preview fields for ``send_video`` read from the MP4 headers.
+        
+        With ``rewrite`` a file whose moov atom sits at the end is rewritten
+        for faststart first, if the disk has room for the copy. Embedded cover art is written next to the file
+        as the thumbnail; the caller removes it with the file.
+        """
+        if rewrite:
+            # faststart writes a second copy of the file; without room for it, send the file as it is
+            copy_key = f"{file_path}.faststart"
+            rewrite = self.disk.reserve(copy_key, os.path.getsize(file_path))
+        if rewrite:
+            try:
+                info = await asyncio.to_thread(mp4_meta.prepare, file_path)
+            finally:
+                self.disk.release(copy_key)
+        else:
+            try:
+                info = await asyncio.to_thread(mp4_meta.parse, file_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"MP4 inspection failed for {file_path}: {e}")
+                info = None
+        if not info:
+            return {}
+        meta = {"duration": info.duration, "width": info.width, "height": info.height}
+        if info.cover:
+            thumb_path = f"{file_path}.jpg"
+            async with aiofiles.open(thumb_path, "wb") as f:
+                await f.write(info.cover)
+            meta["thumb"] = thumb_path
+        return meta
+    
+    @staticmethod
+    def _remove_thumb(video_meta: Dict[str, Any]):
+        thumb = video_meta.get("thumb")
+        if thumb and os.path.exists(thumb):
+            os.remove(thumb)
+    
+    async def _upload_to_dump(self, file_path: str, size: int, caption: str,
+                              reply_markup=None, as_document: bool = False,
+                              video_meta: Dict[str, Any] = None) -> Optional[Message]:
+        """Upload through the best pooled client; returns the dump message as the bot sees it"""
+        async with self.uploaders.acquire(size) as uploader:
+            # User accounts can't attach inline keyboards
+            markup = reply_markup if uploader.is_bot else None
+            if as_document:
+                sent = await SafeMessaging.send_document(
+                    uploader.client, config.DUMP_CHAT_ID, file_path, caption=caption, reply_markup=markup
+                )
+            else:
+                sent = await SafeMessaging.send_video(
+                    uploader.client, config.DUMP_CHAT_ID, file_path, caption=caption, reply_markup=markup,
+                    **(video_meta or {})
+                )
+            if sent and not uploader.is_bot:
+                # file_ids are per account; re-read the message so the bot can send it on
+                sent = await self.app.get_messages(config.DUMP_CHAT_ID, sent.id)
+            return sent
+    
+    async def _stream_upload(self, download: Aria2Download, filename: str, caption: str) -> Optional[Message]:
+        """Upload parts while aria2 downloads, then post to the dump channel"""
+        # The part count depends on the real size, so wait for aria2 to learn it
+        while not download.total_length:
+            await download.update(["status", "totalLength"])
+            if download.status in ("error", "removed"):
+                raise Exception(f"Download {download.status}")
+            await asyncio.sleep(1)
+        
+        # Uploaded parts belong to one account, so the same client sends the message
+        async with self.uploaders.acquire(download.total_length) as uploader:
+            streamer = StreamingUploader(
+                uploader.client, download.total_length, max_connections=config.UPLOAD_CONNECTIONS
+            )
+            with tracing.span("stream_upload", bytes=download.total_length):
+                input_file = await streamer.upload(filename, lambda: self.aria2.stream_progress(download))
+            # Parts are already on Telegram, so the layout can't change; only read the preview fields
+            video_meta = await self._video_meta(download.file_path, rewrite=False)
+            try:
+                sent = await SafeMessaging.send_uploaded(
+                    uploader.client, config.DUMP_CHAT_ID, input_file, filename, caption=caption, **video_meta
+                )
+            finally:
+                self._remove_thumb(video_meta)
+            if sent and not uploader.is_bot:
+                sent = await self.app.get_messages(config.DUMP_CHAT_ID, sent.id)
+            return sent
+    
+    async def _upload_split(self, file_path: str, name: str, caption: str,
+                            status_message) -> Optional[str]:
+        """Split an oversized file, upload the parts concurrently and return their joined file_ids"""
+        # The job reserved room for the parts, but a resumed job may have gone ahead without it
+        if self.disk.free() < os.path.getsize(file_path):
+            raise Exception("Not enough free disk space to split the file")
+        await SafeMessaging.edit_message(
+            status_message,
+            f"✂️ <b>SPLITTING</b>\n\n"
+            f"📁 <b>{name}</b>\n"
+            f"⏳ File is larger than {ProgressTracker.format_size(self.uploaders.max_upload_size)}, splitting into parts..."
+        )
+        parts, playable = await split_file(file_path, config.SPLIT_SIZE)
+        try:
+            await SafeMessaging.edit_message(
+                status_message,
+                f"📤 <b>UPLOADING TO TELEGRAM</b>\n\n"
+                f"📁 <b>{name}</b>\n"
+                f"📦 <b>Parts:</b> {len(parts)}\n"
+                f"⏳ <b>Uploading parts in parallel...</b>"
+            )
+            semaphore = asyncio.Semaphore(config.SPLIT_UPLOAD_CONCURRENCY)
+            
+            async def upload_part(index: int, part_path: str) -> Optional[str]:
+                async with semaphore:
+                    part_caption = f"{caption}\n\n📦 Part {index}/{len(parts)}"
+                    video_meta = await self._video_meta(part_path) if playable else {}
+                    sent = await self._upload_to_dump(
+                        part_path, os.path.getsize(part_path), part_caption, as_document=not playable,
+                        video_meta=video_meta
+                    )
+                    if not sent:
+                        return None
+                    return sent.video.file_id if playable else sent.document.file_id
+            
+            file_ids = await asyncio.gather(*(upload_part(i, p) for i, p in enumerate(parts, 1)))
+            if not all(file_ids):
+                return None
+            return ",".join(file_ids)
+        finally:
+            await asyncio.to_thread(cleanup_parts, file_path)
     
     async def _handle_upload(self, client, download, status_message, user_id, user_name, 
-                           direct_url, filename, chat_id):
-        """Handle file upload to Telegram"""
+                           link_info, chat_id, share_id, stream_task=None, journal_id=None) -> Optional[str]:
+        """Handle file upload to Telegram; returns the dump-channel file_id.
+
+        With ``stream_task`` the parts were uploaded while downloading and only
+        the remaining parts and the final message send are awaited here.
+        """
         start_time = datetime.now()
-        file_path = download.files[0].path
+        file_path = download.file_path
+        direct_url = link_info["direct_url"]
+        filename = link_info.get("filename", "Unknown")
         download_time = (datetime.now() - start_time).total_seconds()
         avg_speed = download.total_length / download_time if download_time > 0 else 0
+        await self.journal.update(journal_id, stage="uploading", file_path=file_path)
         
         await SafeMessaging.edit_message(
             status_message,
@@ -498,15 +1516,21 @@ class BotManager:
             f"📤 <b>Starting upload to Telegram...</b>"
         )
         
+        # Identical content already uploaded under a different share/name
+        with tracing.span("content_hash"):
+            content_hash = await asyncio.to_thread(FileIndex.content_hash, file_path)
+        file_id = None if stream_task else await self.file_index.find_by_hash(content_hash)
+        if file_id and await self.send_cached_file(client, chat_id, file_id, status_message,
+                                                   user_id, user_name, download.name, link_info, share_id):
+            await self.file_index.record(file_id, share_id, filename, link_info.get("size_bytes"), content_hash)
+            await self.aria2.remove(download, files=True)
+            return file_id
+        file_id = None
+        
         # Prepare caption and markup
-        caption = (
-            f"✨ {download.name}\n"
-            f"👤 ʟᴇᴇᴄʜᴇᴅ ʙʏ : <a href='tg://user?id={user_id}'>{user_name}</a>\n"
-            f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n\n"
-            "[Telugu stuff ❤️🚀](https://t.me/dailydiskwala)"
-        )
+        caption = self.build_caption(download.name, user_id, user_name)
         
-        play_markup = self.create_play_button_markup(direct_url, filename)
+        play_markup = self.create_play_button_markup(direct_url, filename, share_id=share_id)
         
         # Upload file
         try:
@@ -518,17 +1542,44 @@ class BotManager:
             )
             
             # Upload to dump channel first
-            sent = await SafeMessaging.send_video(
-                client, config.DUMP_CHAT_ID, file_path,
-                caption=caption, reply_markup=play_markup
-            )
+            upload_started = time.monotonic()
+            streamed = None
+            if stream_task:
+                try:
+                    with tracing.span("upload", mode="streaming"):
+                        streamed = await stream_task
+                except Exception as e:
+                    # The file is complete on disk, so it can still be uploaded the usual way
+                    logger.warning(f"Streaming upload of {download.name} failed, uploading the file: {e}")
+            if streamed:
+                file_id = streamed.video.file_id if streamed.video else None
+            elif download.total_length > self.uploaders.max_upload_size:
+                with tracing.span("upload", mode="split"):
+                    file_id = await self._upload_split(file_path, download.name, caption, status_message)
+            else:
+                with tracing.span("video_meta"):
+                    video_meta = await self._video_meta(file_path)
+                try:
+                    with tracing.span("upload", mode="single", bytes=download.total_length):
+                        sent = await self._upload_to_dump(
+                            file_path, download.total_length, caption, reply_markup=play_markup,
+                            video_meta=video_meta
+                        )
+                finally:
+                    self._remove_thumb(video_meta)
+                file_id = sent.video.file_id if sent and sent.video else None
+            
+            if not file_id:
+                raise Exception("Telegram did not accept the upload")
+            metrics.STAGE_SECONDS.labels("upload").observe(time.monotonic() - upload_started)
+            metrics.UPLOADED_BYTES.inc(download.total_length)
             
             # Send to user
-            if sent:
-                await SafeMessaging.send_video(
-                    client, chat_id, sent.video.file_id,
-                    caption=caption, reply_markup=play_markup
-                )
+            with tracing.span("deliver"):
+                await self.send_file_ids(client, chat_id, file_id, caption, play_markup)
+            await self.file_index.record(
+                file_id, share_id, filename, link_info.get("size_bytes"), content_hash
+            )
             
             # Clean up file
             if os.path.exists(file_path):
@@ -555,9 +1606,11 @@ class BotManager:
         
         # Cleanup aria2 download
         try:
-            self.aria2.api.remove([download], force=True, files=True)
+            await self.aria2.remove(download, files=True)
         except Exception as e:
             logger.error(f"Aria2 cleanup error: {e}")
+        
+        return file_id
 
 # Initialize bot manager
 bot_manager = BotManager()
@@ -643,10 +1696,15 @@ async def handle_text_message(client: Client, message: Message):
         )
         return
     
-    # Handle download process
-    await bot_manager.handle_download_process(client, message, url)
+    # Queue the download process; workers pick it up in priority order
+    await bot_manager.enqueue(client, message, url)
 
 # Admin callback handlers
+@app.on_chat_member_updated(filters.chat(config.FSUB_ID))
+async def fsub_member_updated(client: Client, update):
+    """Keep cached force-subscribe checks in sync with joins and leaves"""
+    bot_manager.membership.handle_update(update)
+
 @app.on_callback_query(filters.regex("admin_panel"))
 async def admin_panel_callback(client: Client, callback_query):
     if not bot_manager.is_admin(callback_query.from_user.id):
@@ -689,8 +1747,16 @@ async def bot_stats_callback(client: Client, callback_query):
         return
     
     # Get bot statistics
-    active_downloads = bot_manager.aria2.get_active_downloads()
+    active_downloads = await bot_manager.aria2.get_active_downloads()
     stored_video_links = len(bot_manager.video_links)
+    link_cache = bot_manager.extractor.cache.stats()
+    membership = bot_manager.membership.stats()
+    disk = bot_manager.disk.stats()
+    tuner = bot_manager.aria2.tuner.stats()
+    bandwidth = bot_manager.aria2.bandwidth.stats()
+    healthy_endpoints = sum(
+        1 for health in bot_manager.extractor.endpoint_health.values() if health.state == "closed"
+    )
     
     # Clean old video links (older than 24 hours)
     current_time = datetime.now()
@@ -704,12 +1770,21 @@ async def bot_stats_callback(client: Client, callback_query):
     stats_text = (
         "📊 **BOT STATISTICS**\n\n"
         f"🔄 Active Downloads: {active_downloads}\n"
+        f"📋 Jobs: {bot_manager.scheduler.active} running, {bot_manager.scheduler.queued} queued\n"
         f"📁 Stored Video Links: {stored_video_links}\n"
-        f"📱 User Client: {'❌ Disabled' if not config.USER_SESSION_STRING else '✅ Active'}\n"
+        f"📱 User Clients: {len(bot_manager.uploaders.clients) - 1} active\n"
         f"🤖 Bot Status: ✅ Online\n"
         f"⚠️ FloodWait Protection: ✅ Active\n"
-        f"🔗 API Endpoints: {len(config.API_ENDPOINTS)} configured\n"
-        f"📋 Aria2 Status: {'✅ Connected' if bot_manager.aria2.api else '❌ Disconnected'}\n"
+        f"🔗 API Endpoints: {healthy_endpoints}/{len(config.API_ENDPOINTS)} healthy\n"
+        f"🗂 Link Cache: {link_cache['hits']} hits / {link_cache['misses']} misses "
+        f"({link_cache['hit_rate']:.0f}%), {link_cache['entries']} entries\n"
+        f"👥 Membership Cache: {membership['hit_rate']:.0f}% hits, {membership['entries']} users\n"
+        f"💾 Disk: {ProgressTracker.format_size(disk['free'])} free, "
+        f"{ProgressTracker.format_size(disk['outstanding'])} reserved by {disk['reservations']} jobs\n"
+        f"📋 Aria2 Status: {'✅ Connected' if bot_manager.aria2.connected else '❌ Disconnected'}\n"
+        f"⚙️ Aria2 Tuning: {tuner['hosts']} hosts learned, {tuner['retunes']} stall retunes\n"
+        f"📶 Bandwidth: {ProgressTracker.format_size(bandwidth['capacity'])}/s shared by {bandwidth['users']} users, "
+        f"{bandwidth['limited']}/{bandwidth['downloads']} downloads limited\n"
         f"🧹 Cleaned expired links: {len(expired_links)}"
     )
     
@@ -727,20 +1802,26 @@ async def clean_downloads_callback(client: Client, callback_query):
         return
     
     try:
-        if bot_manager.aria2.api:
+        if bot_manager.aria2.connected:
             # Remove completed and failed downloads
-            downloads = bot_manager.aria2.api.get_downloads()
+            downloads = await bot_manager.aria2.get_downloads()
             removed_count = 0
             
             for download in downloads:
                 if download.is_complete or download.has_failed:
                     try:
-                        bot_manager.aria2.api.remove([download], force=True, files=True)
+                        await bot_manager.aria2.remove(download, files=True)
                         removed_count += 1
                     except Exception as e:
                         logger.error(f"Failed to remove download {download.gid}: {e}")
             
-            await callback_query.answer(f"✅ Cleaned {removed_count} downloads.", show_alert=True)
+            # Leftovers of crashed or abandoned jobs that aria2 no longer tracks
+            evicted, freed = await bot_manager.disk.evict()
+            await callback_query.answer(
+                f"✅ Cleaned {removed_count} downloads and {evicted} orphaned files "
+                f"({ProgressTracker.format_size(freed)}).",
+                show_alert=True
+            )
         else:
             await callback_query.answer("❌ Aria2 not connected.", show_alert=True)
             
@@ -944,6 +2025,11 @@ async def cleanup():
     try:
         if bot_manager.extractor.session:
             await bot_manager.extractor.close_session()
+        await bot_manager.scheduler.stop()
+        await bot_manager.stop()
+        await bot_manager.aria2.close()
+        bot_manager.file_index.close()
+        bot_manager.journal.close()
         logger.info("Cleanup completed successfully")
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
@@ -986,7 +2072,7 @@ async def speedtest_command(client: Client, message: Message):
     # Start speed test download
     try:
         start_time = datetime.now()
-        download = bot_manager.aria2.add_download(
+        download = await bot_manager.aria2.add_download(
             link_info["direct_url"], 
             options={"dry-run": "true"}  # Don't actually save the file
         )
@@ -994,15 +2080,16 @@ async def speedtest_command(client: Client, message: Message):
         # Monitor for 30 seconds max
         test_duration = 30
         elapsed = 0
+        completion = bot_manager.aria2.wait_for_completion(download.gid)
+        bot_manager.aria2.sampler.watch(download)
         
-        while elapsed < test_duration and not download.is_complete:
+        while elapsed < test_duration and not completion.done():
             await asyncio.sleep(2)
             elapsed = (datetime.now() - start_time).total_seconds()
-            download.update()
             
             speed_mbps = (download.download_speed * 8) / (1024 * 1024)  # Convert to Mbps
             
-            await SafeMessaging.edit_message(
+            bot_manager.progress.update(
                 status_msg,
                 f"🧪 **Speed Test Running**\n\n"
                 f"📁 **File:** {link_info['filename']}\n"
@@ -1013,6 +2100,10 @@ async def speedtest_command(client: Client, message: Message):
                 f"⏳ **Progress:** {download.progress:.1f}%"
             )
         
+        bot_manager.aria2.sampler.unwatch(download.gid)
+        await bot_manager.progress.forget(status_msg)
+        await download.update(Aria2StatusSampler.KEYS)
+        
         # Calculate average speed
         final_elapsed = (datetime.now() - start_time).total_seconds()
         avg_speed = download.completed_length / final_elapsed if final_elapsed > 0 else 0
@@ -1031,29 +2122,80 @@ async def speedtest_command(client: Client, message: Message):
         
         # Cleanup test download
         try:
-            bot_manager.aria2.api.remove([download], force=True, files=True)
+            await bot_manager.aria2.remove(download, files=True)
         except:
             pass
             
     except Exception as e:
         logger.error(f"Speed test error: {e}")
+        await bot_manager.progress.forget(status_msg)
         await SafeMessaging.edit_message(
             status_msg,
             f"❌ **Speed Test Failed**\n\nError: {str(e)}"
         )
 
+# Own handler group: the catch-all text handler would otherwise take the update first
+@app.on_message(filters.command("profile") & filters.user(config.ADMIN_IDS), group=-1)
+async def profile_command(client: Client, message: Message):
+    """Admin command to sample the running bot's stacks for a few seconds"""
+    try:
+        seconds = int(message.command[1]) if len(message.command) > 1 else 10
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= config.MAX_PROFILE_SECONDS:
+        await SafeMessaging.send_message(
+            client, message.chat.id,
+            f"Usage: `/profile <seconds>` (1-{config.MAX_PROFILE_SECONDS})"
+        )
+        return
+    if bot_manager.profiler and bot_manager.profiler.running:
+        await SafeMessaging.send_message(client, message.chat.id, "⏳ A profile is already running.")
+        return
+    
+    status_msg = await SafeMessaging.send_message(
+        client, message.chat.id, f"🔬 **Profiling for {seconds}s...**"
+    )
+    profiler = bot_manager.profiler = tracing.SamplingProfiler()
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+    
+    report = profiler.report()
+    text = f"🔬 <b>Profile ({seconds}s)</b>\n\n<pre>{html.escape(report[:3500])}</pre>"
+    if status_msg:
+        await SafeMessaging.edit_message(status_msg, text)
+    else:
+        await SafeMessaging.send_message(client, message.chat.id, text)
+    
+    # Full folded stacks for flamegraph tools
+    collapsed = profiler.collapsed()
+    if collapsed:
+        with tempfile.NamedTemporaryFile("w", suffix=".folded", prefix="profile-", delete=False) as f:
+            f.write(collapsed)
+        try:
+            await SafeMessaging.send_document(client, message.chat.id, f.name, caption="Folded stacks")
+        finally:
+            os.remove(f.name)
+
+async def main():
+    """Run the bot and its background services on a single event loop"""
+    await app.start()
+    await bot_manager.start()
+    try:
+        await idle()
+    finally:
+        # Cleanup runs on the same loop that owns the connection pools
+        await cleanup()
+        await app.stop()
+
 if __name__ == "__main__":
     logger.info("Starting Enhanced TeraBox Bot...")
     
-    # Register cleanup handler
-    import atexit
-    atexit.register(lambda: asyncio.run(cleanup()))
-    
     try:
-        app.run()
+        app.run(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Critical error: {e}")
-    finally:
-        asyncio.run(cleanup())
@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bandwidth_scheduler import BandwidthScheduler, ScheduledDownload
+
+MB = 1024 * 1024
+BIG = 1024 * MB
+
+
+def _scheduled(gid, user_id, admin=False, size=BIG, speed=0, limit=0, seq=0, status="active"):
+    download = SimpleNamespace(gid=gid, download_speed=speed, total_length=size,
+                               completed_length=0, status=status)
+    scheduled = ScheduledDownload(download, user_id, size, admin, seq)
+    scheduled.limit = limit
+    return scheduled
+
+
+class FakeRPC:
+    def __init__(self, waiting=()):
+        self.waiting = list(waiting)
+        self.calls = []
+
+    async def call(self, method, *params):
+        assert method == "aria2.tellWaiting"
+        return [{"gid": gid} for gid in self.waiting]
+
+    async def multicall(self, calls):
+        self.calls.extend(calls)
+        return [None] * len(calls)
+
+
+def _scheduler(downloads=(), total_bandwidth=0, waiting=()):
+    scheduler = BandwidthScheduler(FakeRPC(waiting), total_bandwidth)
+    for scheduled in downloads:
+        scheduler._downloads[scheduled.download.gid] = scheduled
+    return scheduler
+
+
+def test_users_split_capacity_evenly():
+    active = [_scheduled("a", 1), _scheduled("b", 2), _scheduled("c", 3)]
+    assert _scheduler().fair_shares(9 * MB, active) == {"a": 3 * MB, "b": 3 * MB, "c": 3 * MB}
+
+
+def test_share_is_per_user_not_per_download():
+    active = [_scheduled("a1", 1), _scheduled("a2", 1), _scheduled("b", 2)]
+    assert _scheduler().fair_shares(8 * MB, active) == {"a1": 2 * MB, "a2": 2 * MB, "b": 4 * MB}
+
+
+def test_admin_weighs_more():
+    active = [_scheduled("admin", 1, admin=True), _scheduled("user", 2)]
+    assert _scheduler().fair_shares(8 * MB, active) == {"admin": 6 * MB, "user": 2 * MB}
+
+
+def test_small_files_get_more_of_their_owners_share():
+    active = [_scheduled("small", 1, size=50 * MB), _scheduled("big", 1), _scheduled("other", 2)]
+    shares = _scheduler().fair_shares(12 * MB, active)
+    assert shares == {"small": 4 * MB, "big": 2 * MB, "other": 6 * MB}
+
+
+def test_unused_share_goes_to_the_rest():
+    # Running at 1MB/s under a 4MB/s limit: the host holds it back, not the limit
+    slow = _scheduled("slow", 1, speed=1 * MB, limit=4 * MB)
+    shares = _scheduler().fair_shares(10 * MB, [slow, _scheduled("fast", 2), _scheduled("other", 3)])
+    assert shares["slow"] == int(1 * MB / BandwidthScheduler.SATURATED)
+    assert shares["fast"] == shares["other"] == int((10 * MB - shares["slow"]) / 2)
+
+
+def test_saturated_download_keeps_its_full_share():
+    busy = _scheduled("busy", 1, speed=3.9 * MB, limit=4 * MB)
+    assert _scheduler().fair_shares(8 * MB, [busy, _scheduled("other", 2)]) == {"busy": 4 * MB, "other": 4 * MB}
+
+
+def test_limits_never_drop_below_the_floor():
+    active = [_scheduled(str(user), user) for user in range(4)]
+    shares = _scheduler().fair_shares(100 * 1024, active)
+    assert set(shares.values()) == {BandwidthScheduler.MIN_LIMIT}
+
+
+def test_single_user_is_unlimited_without_a_configured_total():
+    earlier = _scheduled("a", 1, speed=5 * MB, limit=2 * MB)
+    scheduler = _scheduler([earlier])
+    assert scheduler._limit_changes([earlier]) == [("aria2.changeOption", ["a", {"max-download-limit": "0"}])]
+    assert scheduler._limit_changes([earlier]) == []
+
+
+def test_small_limit_changes_are_skipped():
+    downloads = [_scheduled(gid, user, speed=4 * MB, limit=4 * MB) for gid, user in (("a", 1), ("b", 2))]
+    scheduler = _scheduler(downloads, total_bandwidth=int(8.4 * MB))
+    assert scheduler._limit_changes(list(scheduler._downloads.values())) == []
+
+
+def test_waiting_queue_puts_admins_then_small_files_then_round_robin():
+    running = _scheduled("a1", 1)
+    waiting = [_scheduled("a2", 1, seq=1), _scheduled("a3", 1, seq=2), _scheduled("b1", 2, seq=3),
+               _scheduled("small", 3, size=10 * MB, seq=4), _scheduled("admin", 4, admin=True, seq=5)]
+    scheduler = _scheduler([running] + waiting)
+    moves = scheduler._queue_moves([s.download.gid for s in waiting], [running])
+    assert [params[0] for _, params in moves] == ["admin", "small", "b1", "a2", "a3"]
+    assert [params[1] for _, params in moves] == [0, 1, 2, 3, 4]
+    assert scheduler._queue_moves(["admin", "small", "b1", "a2", "a3"], [running]) == []
+
+
+@pytest.mark.parametrize("total_bandwidth", [0, 10 * MB])
+def test_rebalance_limits_only_running_downloads(total_bandwidth):
+    downloads = [_scheduled("a", 1, speed=4 * MB), _scheduled("b", 2, speed=4 * MB),
+                 _scheduled("queued", 3, seq=1), _scheduled("done", 4, status="complete")]
+    scheduler = _scheduler(downloads, total_bandwidth, waiting=["queued"])
+    asyncio.run(scheduler.rebalance())
+    limited = {params[0]: int(params[1]["max-download-limit"])
+               for method, params in scheduler.rpc.calls if method == "aria2.changeOption"}
+    capacity = total_bandwidth or 8 * MB * BandwidthScheduler.HEADROOM
+    assert limited == {"a": int(capacity / 2), "b": int(capacity / 2)}
+    assert scheduler.rebalances == 1
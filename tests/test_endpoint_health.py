@@ -0,0 +1,81 @@
+import pytest
+
+import endpoint_health
+from endpoint_health import EndpointHealth
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(endpoint_health.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ewma_latency_and_success_rate():
+    health = EndpointHealth("a")
+    health.record_success(1.0)
+    assert health.latency == 1.0
+    health.record_success(2.0)
+    assert health.latency == pytest.approx(1.3)
+    assert health.latency_dev == pytest.approx(0.3)
+    health.record_failure(2.0)
+    assert health.success_rate == pytest.approx(0.7)
+
+
+def test_untried_endpoint_ranks_by_default_latency():
+    assert EndpointHealth("new").score() == EndpointHealth.DEFAULT_LATENCY
+    assert EndpointHealth("new").hedge_delay() == 2.0
+
+
+def test_fast_reliable_endpoints_rank_first():
+    fast, slow, flaky = EndpointHealth("fast"), EndpointHealth("slow"), EndpointHealth("flaky")
+    for _ in range(5):
+        fast.record_success(0.5)
+        slow.record_success(2.0)
+        flaky.record_failure(1.0)
+    ranked = sorted([flaky, slow, fast], key=EndpointHealth.score)
+    assert [h.name for h in ranked] == ["fast", "slow", "flaky"]
+
+
+def test_hedge_delay_is_clamped():
+    quick, sluggish = EndpointHealth("quick"), EndpointHealth("sluggish")
+    quick.record_success(0.01)
+    sluggish.record_success(30)
+    assert quick.hedge_delay() == EndpointHealth.MIN_HEDGE_DELAY
+    assert sluggish.hedge_delay() == EndpointHealth.MAX_HEDGE_DELAY
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    health = EndpointHealth("a")
+    for _ in range(EndpointHealth.FAILURE_THRESHOLD - 1):
+        health.record_failure(1.0)
+    assert health.state == "closed" and health.available()
+    health.record_failure(1.0)
+    assert health.state == "open" and not health.available()
+
+
+def test_half_open_allows_a_single_probe(clock):
+    health = EndpointHealth("a")
+    for _ in range(EndpointHealth.FAILURE_THRESHOLD):
+        health.record_failure(1.0)
+    clock[0] += EndpointHealth.BASE_COOLDOWN
+    assert health.state == "half-open" and health.available()
+    health.begin()
+    assert not health.available()
+    health.record_success(1.0)
+    assert health.state == "closed" and health.available()
+    assert health.cooldown == EndpointHealth.BASE_COOLDOWN
+
+
+def test_failed_probe_doubles_cooldown_up_to_the_cap(clock):
+    health = EndpointHealth("a")
+    for _ in range(EndpointHealth.FAILURE_THRESHOLD):
+        health.record_failure(1.0)
+    cooldowns = []
+    for _ in range(6):
+        clock[0] = health.open_until
+        health.begin()
+        health.record_failure(1.0)
+        cooldowns.append(health.cooldown)
+        assert health.state == "open"
+    assert cooldowns == [60, 120, 240, 480, 600, 600]
@@ -0,0 +1,106 @@
+import asyncio
+
+from job_scheduler import JobScheduler, ScheduledJob
+
+
+def _recording_job(log, user_id, label, priority=1, gate=None, expected_size=0):
+    async def run():
+        log.append(label)
+        if gate:
+            await gate.wait()
+    return ScheduledJob(user_id, run, priority=priority, expected_size=expected_size)
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_jobs_run_by_priority_then_arrival():
+    async def scenario():
+        log = []
+        scheduler = JobScheduler(workers=1, per_user_limit=5)
+        positions = [await scheduler.submit(_recording_job(log, 1, "normal-1"))]
+        positions.append(await scheduler.submit(_recording_job(log, 2, "normal-2")))
+        positions.append(await scheduler.submit(_recording_job(log, 3, "admin", priority=0)))
+        scheduler.start()
+        await _settle()
+        await scheduler.stop()
+        return positions, log
+
+    positions, log = asyncio.run(scenario())
+    assert positions == [1, 2, 1]
+    assert log == ["admin", "normal-1", "normal-2"]
+
+
+def test_per_user_cap_lets_other_users_through():
+    async def scenario():
+        log = []
+        gate = asyncio.Event()
+        scheduler = JobScheduler(workers=3, per_user_limit=1)
+        await scheduler.submit(_recording_job(log, 1, "a1", gate=gate))
+        await scheduler.submit(_recording_job(log, 1, "a2", gate=gate))
+        await scheduler.submit(_recording_job(log, 2, "b1", gate=gate))
+        scheduler.start()
+        await _settle()
+        blocked = (list(log), scheduler.queued, dict(scheduler.running))
+        gate.set()
+        await _settle()
+        await scheduler.stop()
+        return blocked, log
+
+    (started, queued, running), log = asyncio.run(scenario())
+    assert started == ["a1", "b1"]
+    assert queued == 1
+    assert running == {1: 1, 2: 1}
+    assert log == ["a1", "b1", "a2"]
+
+
+def test_uncapped_priority_ignores_the_per_user_cap():
+    async def scenario():
+        log = []
+        gate = asyncio.Event()
+        scheduler = JobScheduler(workers=3, per_user_limit=1)
+        for label in ("x1", "x2", "x3"):
+            await scheduler.submit(_recording_job(log, 1, label, priority=0, gate=gate))
+        scheduler.start()
+        await _settle()
+        active = scheduler.active
+        gate.set()
+        await _settle()
+        await scheduler.stop()
+        return active
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_full_user_queue_is_rejected():
+    async def scenario():
+        scheduler = JobScheduler(per_user_queue_limit=2)
+        results = [await scheduler.submit(_recording_job([], 1, str(i))) for i in range(3)]
+        results.append(await scheduler.submit(_recording_job([], 2, "other")))
+        return results
+
+    assert asyncio.run(scenario()) == [1, 2, None, 3]
+
+
+def test_refused_job_waits_for_admission_without_blocking_others():
+    async def scenario():
+        log = []
+        room = {"free": 100}
+        scheduler = JobScheduler(workers=1, admission=lambda job: job.expected_size <= room["free"])
+        scheduler.ADMISSION_RETRY = 0.01
+        await scheduler.submit(_recording_job(log, 1, "big", expected_size=500))
+        await scheduler.submit(_recording_job(log, 2, "small", expected_size=50))
+        scheduler.start()
+        await _settle()
+        before = (list(log), scheduler.queued)
+        room["free"] = 1000
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        return before, log
+
+    (started, queued), log = asyncio.run(scenario())
+    assert started == ["small"]
+    assert queued == 1
+    assert log == ["small", "big"]
@@ -0,0 +1,72 @@
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_with_labels():
+    requests = Counter("requests_total", "Requests by endpoint", ("endpoint", "result"))
+    requests.labels("api", "ok").inc()
+    requests.labels(endpoint="api", result="ok").inc(2)
+    requests.labels("api", "error").inc(0.5)
+    assert requests.expose().split("\n") == [
+        "# HELP requests_total Requests by endpoint",
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="api",result="ok"} 3',
+        'requests_total{endpoint="api",result="error"} 0.5',
+    ]
+
+
+def test_label_values_are_escaped():
+    errors = Counter("errors_total", "Errors", ("message",))
+    errors.labels('bad "path" C:\\tmp\nnext').inc()
+    assert errors.expose().split("\n")[-1] == 'errors_total{message="bad \\"path\\" C:\\\\tmp\\nnext"} 1'
+
+
+def test_unlabelled_counter_starts_at_zero():
+    assert Counter("bytes_total", "Bytes").expose().split("\n")[-1] == "bytes_total 0"
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("latency_seconds", "Latency", buckets=(1, 0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2):
+        latency.observe(value)
+    assert latency.expose().split("\n")[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="0.5"} 3',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 2.45",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_labelled_histogram_puts_le_last():
+    stage = Histogram("stage_seconds", "Stage time", ("stage",), buckets=(10,))
+    stage.labels("upload").observe(12)
+    assert stage.expose().split("\n")[2:] == [
+        'stage_seconds_bucket{stage="upload",le="10"} 0',
+        'stage_seconds_bucket{stage="upload",le="+Inf"} 1',
+        'stage_seconds_sum{stage="upload"} 12',
+        'stage_seconds_count{stage="upload"} 1',
+    ]
+
+
+def test_gauge_reads_its_callback_at_scrape_time():
+    depth = [3]
+    queue = Gauge("queue_depth", "Queued jobs", lambda: depth[0])
+    assert queue.expose().split("\n")[-1] == "queue_depth 3"
+    depth[0] = 7
+    assert queue.expose().split("\n")[-1] == "queue_depth 7"
+
+
+def test_failing_gauge_reports_nan():
+    broken = Gauge("broken", "Broken", lambda: 1 / 0)
+    assert broken.expose().split("\n")[-1] == "broken NaN"
+
+
+def test_registry_joins_families_and_ends_with_newline():
+    registry = Registry()
+    registry.register(Counter("a_total", "A")).inc()
+    registry.register(Gauge("b", "B", lambda: 1.5))
+    assert registry.expose() == (
+        "# HELP a_total A\n# TYPE a_total counter\na_total 1\n"
+        "# HELP b B\n# TYPE b gauge\nb 1.5\n"
+    )
@@ -0,0 +1,144 @@
+import os
+import shutil
+import struct
+
+import pytest
+
+import mp4_meta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TERA = os.path.join(REPO_DIR, "tera.mp4")
+JET_MIRROR = os.path.join(REPO_DIR, "Jet-Mirror.mp4")
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def top_level(data: bytes) -> dict:
+    return {box_type: data[offset:offset + size] for box_type, offset, _, size in mp4_meta.iter_boxes(data, 0, len(data))}
+
+
+def chunk_offsets(moov: bytes) -> list:
+    """(box type, offsets) of every stco/co64 table below a moov box"""
+    tables = []
+
+    def walk(start, end):
+        for box_type, offset, header, size in mp4_meta.iter_boxes(moov, start, end):
+            if box_type in mp4_meta.OFFSET_CONTAINERS:
+                walk(offset + header, offset + size)
+            elif box_type in (b"stco", b"co64"):
+                count = struct.unpack_from(">I", moov, offset + header + 4)[0]
+                fmt = f">{count}{'Q' if box_type == b'co64' else 'I'}"
+                tables.append((box_type, list(struct.unpack_from(fmt, moov, offset + header + 8))))
+
+    walk(8, len(moov))
+    return tables
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_parse_faststart_file():
+    info = mp4_meta.parse(TERA)
+    assert info.faststart and not info.fragmented
+    assert info.duration == pytest.approx(4.16)
+    assert (info.width, info.height) == (1080, 1080)
+    assert [box_type for box_type, _, _ in info.boxes] == [b"ftyp", b"moov", b"mdat", b"free"]
+
+
+def test_parse_moov_at_end():
+    info = mp4_meta.parse(JET_MIRROR)
+    assert not info.faststart
+    assert info.duration == pytest.approx(6.4, abs=0.01)
+    assert (info.width, info.height) == (1440, 1440)
+
+
+def test_parse_rejects_non_mp4(tmp_path):
+    path = tmp_path / "not.mp4"
+    path.write_bytes(b"definitely not a video file")
+    assert mp4_meta.parse(str(path)) is None
+
+
+def test_faststart_leaves_faststart_files_alone(tmp_path):
+    path = str(tmp_path / "tera.mp4")
+    shutil.copyfile(TERA, path)
+    assert not mp4_meta.faststart(path)
+    assert read(path) == read(TERA)
+
+
+def assert_faststart_round_trip(path: str, original: bytes):
+    assert mp4_meta.faststart(path)
+    rewritten = read(path)
+    info = mp4_meta.parse(path)
+    assert info.faststart
+    assert [box_type for box_type, _, _ in info.boxes][:2] == [b"ftyp", b"moov"]
+
+    before, after = top_level(original), top_level(rewritten)
+    assert after[b"mdat"] == before[b"mdat"]
+    mdat_shift = rewritten.index(after[b"mdat"]) - original.index(before[b"mdat"])
+    old_tables, new_tables = chunk_offsets(before[b"moov"]), chunk_offsets(after[b"moov"])
+    assert [box_type for box_type, _ in new_tables] == [box_type for box_type, _ in old_tables]
+    for (_, old), (_, new) in zip(old_tables, new_tables):
+        assert new == [offset + mdat_shift for offset in old]
+        # Every chunk offset still points at the same media bytes
+        for old_offset, new_offset in zip(old, new):
+            assert rewritten[new_offset:new_offset + 64] == original[old_offset:old_offset + 64]
+
+
+def test_faststart_round_trip_co64(tmp_path):
+    path = str(tmp_path / "jet.mp4")
+    shutil.copyfile(JET_MIRROR, path)
+    assert all(box_type == b"co64" for box_type, _ in chunk_offsets(top_level(read(path))[b"moov"]))
+    assert_faststart_round_trip(path, read(JET_MIRROR))
+
+
+def test_faststart_round_trip_stco(tmp_path):
+    # tera.mp4 with its moov moved behind the media, offsets pulled back by the moov size
+    original = read(TERA)
+    boxes = top_level(original)
+    moov = boxes.pop(b"moov")
+    late_moov = box(b"moov", mp4_meta._rewrite_moov(moov[8:], -len(moov), force_co64=False))
+    data = b"".join(boxes.values()) + late_moov
+    path = tmp_path / "tera-late.mp4"
+    path.write_bytes(data)
+    assert all(box_type == b"stco" for box_type, _ in chunk_offsets(late_moov))
+    assert not mp4_meta.parse(str(path)).faststart
+    assert_faststart_round_trip(str(path), data)
+    # Moving it back to the front restores the original exactly
+    assert read(path) == original
+
+
+def test_failed_faststart_removes_its_copy(tmp_path, monkeypatch):
+    path = str(tmp_path / "jet.mp4")
+    shutil.copyfile(JET_MIRROR, path)
+
+    def disk_full(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(mp4_meta.os, "replace", disk_full)
+    assert mp4_meta.prepare(path) is None
+    assert os.listdir(tmp_path) == ["jet.mp4"]
+    assert read(path) == read(JET_MIRROR)
+
+
+def test_truncated_file_is_not_an_mp4(tmp_path):
+    path = tmp_path / "cut.mp4"
+    path.write_bytes(read(JET_MIRROR)[:len(read(JET_MIRROR)) // 2])
+    assert mp4_meta.parse(str(path)) is None
+    assert mp4_meta.prepare(str(path)) is None
+
+
+@pytest.mark.parametrize("moov_payload", [
+    box(b"mvhd", b"\0\0\0\0"),
+    box(b"trak", box(b"mdia", box(b"hdlr", b"\0" * 8 + b"vide")) + box(b"tkhd", b"\0" * 20)),
+], ids=["mvhd", "tkhd"])
+def test_truncated_header_box_raises_value_error(tmp_path, moov_payload):
+    # The header box is cut short at the end of the file, so its fields can't be read
+    path = tmp_path / "short.mp4"
+    path.write_bytes(box(b"ftyp", b"isom\0\0\0\0") + box(b"moov", moov_payload))
+    with pytest.raises(ValueError):
+        mp4_meta.parse(str(path))
+    assert mp4_meta.prepare(str(path)) is None
@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+import pytest
+
+import splitter
+from splitter import cleanup_parts, split_bytes, split_file
+
+PART_SIZE = 1000
+
+
+@pytest.fixture(autouse=True)
+def small_copy_chunk(monkeypatch):
+    # Parts then span several buffer reads, as they do for real 2GB parts
+    monkeypatch.setattr(splitter, "COPY_CHUNK", 300)
+
+
+def _write(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return data
+
+
+def _split(tmp_path, size):
+    source = tmp_path / "file.bin"
+    data = _write(source, size)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    return data, split_bytes(str(source), PART_SIZE, str(out_dir))
+
+
+def test_file_of_exactly_part_size_is_one_part(tmp_path):
+    data, parts = _split(tmp_path, PART_SIZE)
+    assert [os.path.basename(p) for p in parts] == ["file.bin.001"]
+    assert os.listdir(tmp_path / "out") == ["file.bin.001"]
+    assert open(parts[0], "rb").read() == data
+
+
+def test_one_byte_over_part_size_makes_a_second_part(tmp_path):
+    data, parts = _split(tmp_path, PART_SIZE + 1)
+    assert [os.path.basename(p) for p in parts] == ["file.bin.001", "file.bin.002"]
+    assert [os.path.getsize(p) for p in parts] == [PART_SIZE, 1]
+    assert b"".join(open(p, "rb").read() for p in parts) == data
+
+
+def test_parts_join_back_to_the_original(tmp_path):
+    data, parts = _split(tmp_path, 3 * PART_SIZE + 123)
+    assert [os.path.getsize(p) for p in parts] == [PART_SIZE] * 3 + [123]
+    assert b"".join(open(p, "rb").read() for p in parts) == data
+
+
+def test_empty_file_has_no_parts(tmp_path):
+    _, parts = _split(tmp_path, 0)
+    assert parts == []
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_split_file_byte_splits_other_files_and_cleans_up(tmp_path):
+    source = tmp_path / "archive.zip"
+    data = _write(source, 2 * PART_SIZE + 1)
+    parts, playable = asyncio.run(split_file(str(source), PART_SIZE))
+    assert not playable
+    assert all(os.path.dirname(p) == f"{source}.parts" for p in parts)
+    assert b"".join(open(p, "rb").read() for p in parts) == data
+    cleanup_parts(str(source))
+    assert not os.path.exists(f"{source}.parts")
+    assert source.exists()
+
+
+def test_split_file_falls_back_to_bytes_without_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(splitter.shutil, "which", lambda name: None)
+    source = tmp_path / "movie.mp4"
+    _write(source, PART_SIZE + 1)
+    parts, playable = asyncio.run(split_file(str(source), PART_SIZE))
+    assert not playable
+    assert [os.path.basename(p) for p in parts] == ["movie.mp4.001", "movie.mp4.002"]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from stream_proxy import ChunkCache, StreamProxy
+
+RAW_URL_SHARE = "https://example.com/../../etc/s?x=1"
+
+
+async def _resolve(share_id, refresh):
+    return None
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    return StreamProxy("secret", str(tmp_path / "cache"), 1024, _resolve)
+
+
+@pytest.mark.parametrize("share_id", ["AbC_d-9", RAW_URL_SHARE, "~tilde", "a.b"])
+def test_tokens_round_trip(proxy, share_id):
+    token = proxy.token_for(share_id)
+    assert "/" not in token
+    assert proxy.share_for(token) == share_id
+
+
+def test_plain_share_ids_keep_their_token_format(proxy):
+    assert proxy.token_for("AbCd").startswith("AbCd.")
+
+
+@pytest.mark.parametrize("token", ["AbCd.0000000000000000", "~!!!.0000000000000000", "nodot", ""])
+def test_forged_tokens_are_rejected(proxy, token):
+    assert proxy.share_for(token) is None
+
+
+def test_tampered_encoded_token_is_rejected(proxy):
+    token = proxy.token_for(RAW_URL_SHARE)
+    other = proxy.token_for("https://example.com/other")
+    assert proxy.share_for(other.split(".")[0] + "." + token.rpartition(".")[2]) is None
+
+
+def test_cache_keeps_any_key_inside_its_directory(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = ChunkCache(str(cache_dir), 1024)
+    cache.write(RAW_URL_SHARE, 0, b"data")
+    assert (RAW_URL_SHARE, 0) in cache
+    assert cache.read(RAW_URL_SHARE, 0) == b"data"
+    assert sorted(os.listdir(tmp_path)) == ["cache"]
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_cache_index_survives_restart_and_evicts_oldest(tmp_path):
+    cache = ChunkCache(str(tmp_path), 10)
+    cache.write("a", 0, b"12345")
+    cache.write("b", 0, b"12345")
+    os.utime(cache._path(cache._name("a"), 0), (0, 0))
+    reloaded = ChunkCache(str(tmp_path), 10)
+    assert ("a", 0) in reloaded and reloaded.total_bytes == 10
+    reloaded.write("c", 0, b"1")
+    assert ("a", 0) not in reloaded
+    assert reloaded.read("b", 0) == b"12345"
@@ -0,0 +1,219 @@
+# tracing.py
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_trace_log = logging.getLogger("terabox.traces")
+_trace_log.propagate = False
+_ids = itertools.count(1)
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("span", default=None)
+
+
+def configure(path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+    """Write finished traces as JSON lines to ``path``, rotated by size"""
+    for handler in list(_trace_log.handlers):
+        _trace_log.removeHandler(handler)
+        handler.close()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                   encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _trace_log.addHandler(handler)
+    _trace_log.setLevel(logging.INFO)
+
+
+class Trace:
+    """Spans recorded for one job; written as a single JSON line when it ends"""
+
+    MAX_SPANS = 2000
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = f"{int(time.time())}-{next(_ids)}"
+        self.name = name
+        self.attrs = attrs
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+
+    def add(self, span: Dict[str, Any]):
+        if len(self.spans) < self.MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def to_json(self, status: str) -> str:
+        return json.dumps({
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.wall_start,
+            "duration": round(time.monotonic() - self.start, 4),
+            "status": status,
+            "attrs": self.attrs,
+            "spans": self.spans,
+            "dropped_spans": self.dropped
+        }, default=str, ensure_ascii=False)
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """Root of a job's trace; spans opened inside (and in tasks it starts) attach to it"""
+    current = Trace(name, attrs)
+    trace_token = _current_trace.set(current)
+    span_token = _current_span.set(None)
+    status = "ok"
+    try:
+        yield current
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, asyncio.CancelledError) else f"error: {e!r}"
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if _trace_log.handlers:
+            try:
+                _trace_log.info(current.to_json(status))
+            except Exception as e:
+                logger.warning(f"Failed to write trace {current.trace_id}: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a stage of the current job; a no-op outside of a trace.
+
+    The yielded dict may be filled with more attributes before the span ends.
+    """
+    current = _current_trace.get()
+    if current is None:
+        yield attrs
+        return
+    span_id = next(_ids)
+    parent = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.monotonic()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, asyncio.CancelledError) else f"error: {e!r}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.add({
+            "id": span_id,
+            "parent": parent,
+            "name": name,
+            "offset": round(start - current.start, 4),
+            "duration": round(time.monotonic() - start, 4),
+            "status": status,
+            **({"attrs": attrs} if attrs else {})
+        })
+
+
+def event(name: str, **attrs):
+    """Record an instant (a retry, a FloodWait) in the current job's trace"""
+    current = _current_trace.get()
+    if current is None:
+        return
+    current.add({
+        "id": next(_ids),
+        "parent": _current_span.get(),
+        "name": name,
+        "offset": round(time.monotonic() - current.start, 4),
+        "duration": 0,
+        "status": "event",
+        **({"attrs": attrs} if attrs else {})
+    })
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack from a helper thread.
+
+    Nothing is hooked into the interpreter, so it can be switched on in
+    production for a short window. Samples whose innermost frame is the
+    event loop waiting in ``select`` (or a worker waiting for work) are
+    counted as idle.
+    """
+
+    IDLE_FUNCTIONS = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker")}
+    MAX_DEPTH = 40
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append((os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                self.samples += 1
+                if stack and stack[0][:2] in self.IDLE_FUNCTIONS:
+                    self.idle += 1
+                    continue
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Busy stacks in the folded format flamegraph tools read, outermost first"""
+        return "\n".join(
+            ";".join(f"{name} ({filename}:{line})" for filename, name, line in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        )
+
+    def report(self, top: int = 10, depth: int = 6) -> str:
+        """Hottest functions by self time and the hottest stacks, innermost frames only"""
+        if not self.samples:
+            return "No samples collected"
+        busy = self.samples - self.idle
+        own = Counter()
+        for stack, count in self.stacks.items():
+            filename, name, _ = stack[-1]
+            own[f"{name} ({filename})"] += count
+        lines = [f"Samples: {self.samples}, busy: {busy / self.samples * 100:.1f}%", "", "Top functions (self):"]
+        lines += [f"{count / self.samples * 100:5.1f}%  {name}" for name, count in own.most_common(top)]
+        lines += ["", "Top stacks:"]
+        for stack, count in self.stacks.most_common(top):
+            frames = " > ".join(f"{name}:{line}" for _, name, line in stack[-depth:])
+            lines.append(f"{count / self.samples * 100:5.1f}%  {frames}")
+        return "\n".join(lines)
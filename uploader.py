@@ -0,0 +1,409 @@
+# uploader.py
+import asyncio
+import logging
+import math
+import mimetypes
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # MTProto big-file part size
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Smaller files must use saveFilePart
+
+
+def contiguous_bytes(bitfield: str, piece_length: int, total_length: int) -> int:
+    """Bytes available from the start of the file according to an aria2 bitfield"""
+    if not bitfield or not piece_length:
+        return 0
+    pieces = 0
+    for char in bitfield:
+        nibble = int(char, 16)
+        if nibble == 0xF:
+            pieces += 4
+            continue
+        # Count leading set bits of the partial nibble, then stop
+        for bit in (8, 4, 2, 1):
+            if not nibble & bit:
+                break
+            pieces += 1
+        break
+    return min(pieces * piece_length, total_length)
+
+
+async def send_uploaded_video(client: Client, chat_id, input_file, file_name: str,
+                              caption: str = "", reply_markup=None, duration: int = 0,
+                              width: int = 0, height: int = 0, thumb: str = None) -> Optional[types.Message]:
+    """Send a file whose parts were already uploaded with saveBigFilePart; ``thumb`` is a JPEG path.
+
+    The mime type is guessed from ``file_name`` like pyrogram does, and only
+    ``video/*`` files are sent as streamable videos.
+    """
+    mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if mime_type.startswith("video/"):
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=True, duration=int(duration), w=width, h=height
+        ))
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mime_type,
+        file=input_file,
+        thumb=await client.save_file(thumb) if thumb else None,
+        attributes=attributes
+    )
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            random_id=client.rnd_id(),
+            reply_markup=await reply_markup.write(client) if reply_markup else None,
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {u.id: u for u in r.users}, {c.id: c for c in r.chats}
+            )
+    return None
+
+
+class ParallelUploadEngine:
+    """Uploads a big file with ``saveBigFilePart`` over several media connections.
+
+    Each connection is a separate MTProto media session on the client's home
+    DC running a few in-flight parts. The connection count starts from the
+    best value learned for the client and, while uploading, another
+    connection is added as long as the previous one raised total
+    throughput noticeably; the largest count that did is what gets
+    learned. A count the first added connection couldn't improve on is
+    learned one lower, so the next upload probes it again from below,
+    and a FloodWait on any part backs the count off by one. Progress
+    callbacks are rate limited so they stay cheap.
+    """
+
+    MAX_PART_RETRIES = 5
+    PROBE_INTERVAL = 3.0
+    MIN_GAIN = 1.1  # Keep scaling while a new connection adds >10% throughput
+    learned_connections: Dict[Client, int] = {}
+
+    def __init__(self, client: Client, max_connections: int = 6, min_connections: int = 2,
+                 workers_per_connection: int = 2, autotune: bool = True,
+                 progress: Callable[[int, int], Awaitable] = None, progress_interval: float = 1.0):
+        self.client = client
+        self.max_connections = max(1, max_connections)
+        self.min_connections = max(1, min(min_connections, self.max_connections))
+        self.workers_per_connection = workers_per_connection
+        self.autotune = autotune
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.file_id = client.rnd_id()
+        self.uploaded_bytes = 0
+        self._sessions = []
+        self._best_connections = 0
+        self._gained: Optional[bool] = None  # Whether an added connection paid off; None if never measured
+        self._flood_waited = False
+        self._workers = []
+        self._next_part = 0
+        self._last_progress = 0.0
+
+    async def _open_session(self):
+        # Imported lazily: only needed when an upload actually starts
+        from pyrogram.session import Session
+        session = Session(
+            self.client,
+            await self.client.storage.dc_id(),
+            await self.client.storage.auth_key(),
+            await self.client.storage.test_mode(),
+            is_media=True
+        )
+        # Tracked before it starts, so an upload cancelled meanwhile still stops it
+        self._sessions.append(session)
+        await session.start()
+        return session
+
+    async def upload(self, path: str, total_size: int, file_name: str,
+                     wait_for: Callable[[int], Awaitable] = None):
+        """Upload ``path`` and return the ``InputFileBig`` to attach to a message.
+
+        ``wait_for(end)`` may be given to block until the first ``end`` bytes
+        of a file that is still being written are on disk.
+        """
+        self.total_size = total_size
+        self.total_parts = math.ceil(total_size / PART_SIZE)
+        self._wait_for = wait_for
+        self._path = path
+        start_connections = self.learned_connections.get(self.client, self.min_connections)
+        start_connections = min(max(start_connections, self.min_connections), self.max_connections)
+        self._best_connections = start_connections
+
+        tuner = None
+        try:
+            for _ in range(start_connections):
+                await self._add_connection()
+            if self.autotune and not wait_for and len(self._sessions) < self.max_connections:
+                tuner = asyncio.create_task(self._tune())
+            # Workers can be added by the tuner while we wait, so loop until all are done
+            while any(not worker.done() for worker in self._workers):
+                await asyncio.gather(*self._workers)
+        finally:
+            if tuner:
+                tuner.cancel()
+                # The tuner may be opening a session; let that land in _sessions first
+                await asyncio.gather(tuner, return_exceptions=True)
+            for worker in self._workers:
+                worker.cancel()
+            for session in self._sessions:
+                try:
+                    await session.stop()
+                except Exception:
+                    pass
+
+        if self._flood_waited:
+            # Telegram is pushing back, so the next upload starts with fewer connections
+            self.learned_connections[self.client] = max(self.min_connections, start_connections - 1)
+        elif self.autotune and not wait_for:
+            learned = self._best_connections - 1 if self._gained is False else self._best_connections
+            self.learned_connections[self.client] = max(self.min_connections, learned)
+        return raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=file_name)
+
+    async def _add_connection(self):
+        session = await self._open_session()
+        for _ in range(self.workers_per_connection):
+            self._workers.append(asyncio.create_task(self._worker(session)))
+
+    async def _tune(self):
+        """Add connections while each one still raises measured throughput"""
+        previous = None
+        while True:
+            start_bytes = self.uploaded_bytes
+            await asyncio.sleep(self.PROBE_INTERVAL)
+            throughput = (self.uploaded_bytes - start_bytes) / self.PROBE_INTERVAL
+            per_connection = throughput / len(self._sessions)
+            logger.debug(f"Upload throughput {throughput / 1024 / 1024:.2f} MB/s over "
+                         f"{len(self._sessions)} connections ({per_connection / 1024 / 1024:.2f} each)")
+            if previous is not None and throughput < previous * self.MIN_GAIN:
+                if self._gained is None:
+                    self._gained = False
+                return
+            if previous is not None:
+                self._gained = True
+                self._best_connections = len(self._sessions)
+            if len(self._sessions) >= self.max_connections:
+                return
+            previous = throughput
+            await self._add_connection()
+
+    async def _worker(self, session):
+        with open(self._path, "rb") as f:
+            while self._next_part < self.total_parts:
+                part = self._next_part
+                self._next_part += 1
+                start = part * PART_SIZE
+                end = min(start + PART_SIZE, self.total_size)
+                if self._wait_for:
+                    await self._wait_for(end)
+
+                chunk = await asyncio.to_thread(self._read_part, f, start, end - start)
+                await self._save_part(session, part, chunk)
+
+                self.uploaded_bytes += len(chunk)
+                await self._report_progress()
+
+    @staticmethod
+    def _read_part(f, start: int, length: int) -> bytes:
+        # Each worker has its own handle, so seek and read can't interleave
+        f.seek(start)
+        return f.read(length)
+
+    async def _report_progress(self):
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if now - self._last_progress >= self.progress_interval or self.uploaded_bytes >= self.total_size:
+            self._last_progress = now
+            await self.progress(self.uploaded_bytes, self.total_size)
+
+    async def _save_part(self, session, part: int, chunk: bytes):
+        for attempt in range(self.MAX_PART_RETRIES):
+            try:
+                await session.invoke(raw.functions.upload.SaveBigFilePart(
+                    file_id=self.file_id,
+                    file_part=part,
+                    file_total_parts=self.total_parts,
+                    bytes=chunk
+                ))
+                return
+            except FloodWait as e:
+                logger.warning(f"FloodWait on part {part}: {e.value}s")
+                self._flood_waited = True
+                metrics.FLOODWAITS.labels("save_big_file_part").inc()
+                metrics.FLOODWAIT_SECONDS.labels("save_big_file_part").inc(e.value)
+                with tracing.span("floodwait_sleep", method="save_big_file_part", part=part, seconds=e.value):
+                    await asyncio.sleep(e.value)
+            except Exception as e:
+                if attempt == self.MAX_PART_RETRIES - 1:
+                    raise
+                logger.warning(f"Part {part} upload failed, retrying: {e}")
+                tracing.event("retry", method="save_big_file_part", part=part, attempt=attempt + 1, error=str(e))
+                await asyncio.sleep(2 ** attempt)
+
+
+class StreamingUploader:
+    """Uploads a file to Telegram while aria2 is still downloading it.
+
+    MTProto big-file parts are independent 512KB chunks, so each part is sent
+    as soon as the contiguous prefix reported by aria2's bitfield covers it.
+    Downloads should use ``stream-piece-selector=inorder`` so that prefix
+    grows steadily. aria2 flushes a piece's write cache before marking it
+    complete in the bitfield, so reading a completed range from disk is safe.
+    The upload fails when aria2 can't be asked for progress
+    ``MAX_REFRESH_FAILURES`` times in a row, or when the part it waits for
+    gets no closer for ``stall_timeout`` seconds.
+    """
+
+    MAX_REFRESH_FAILURES = 5
+
+    def __init__(self, client: Client, total_size: int, max_connections: int = 6,
+                 poll_interval: float = 1.0, stall_timeout: float = 600,
+                 progress: Callable[[int, int], Awaitable] = None):
+        self.total_size = total_size
+        self.poll_interval = poll_interval
+        self.stall_timeout = stall_timeout
+        self.engine = ParallelUploadEngine(client, max_connections=max_connections, progress=progress)
+        self._available = 0
+        self._progressed = time.monotonic()
+        self._download_done = False
+        self._changed = asyncio.Event()
+
+    async def upload(self, file_name: str,
+                     refresh: Callable[[], Awaitable[Tuple[int, Optional[str], str]]]):
+        """Upload every part and return the ``InputFileBig`` to attach to a message.
+
+        ``refresh`` returns ``(contiguous_bytes, file_path, status)`` for the
+        download and is polled every ``poll_interval`` seconds.
+        """
+        path = None
+        poller = None
+        try:
+            # Wait until aria2 knows the output path and has created the file
+            while not path or not os.path.exists(path):
+                available, path, status = await refresh()
+                if status in ("error", "removed"):
+                    raise Exception(f"Download {status} before upload could start")
+                if not path or not os.path.exists(path):
+                    await asyncio.sleep(self.poll_interval)
+            self._available = available
+            self._progressed = time.monotonic()
+
+            poller = asyncio.create_task(self._poll(refresh))
+            return await self.engine.upload(path, self.total_size, file_name, wait_for=self._wait_for)
+        finally:
+            if poller:
+                poller.cancel()
+
+    async def _poll(self, refresh):
+        failures = 0
+        while not self._download_done:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                available, _, status = await refresh()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Streaming upload progress check failed ({failures}): {e}")
+                if failures < self.MAX_REFRESH_FAILURES:
+                    continue
+                status = "error"
+            if status in ("error", "removed"):
+                self._download_done = True
+                self._available = -1
+            else:
+                available = self.total_size if status == "complete" else available
+                if available > self._available:
+                    self._progressed = time.monotonic()
+                self._available = available
+                self._download_done = status == "complete"
+            self._changed.set()
+
+    async def _wait_for(self, end: int):
+        while self._available < end:
+            if self._available < 0:
+                raise Exception("Download failed during streaming upload")
+            stalled = time.monotonic() - self._progressed
+            if stalled >= self.stall_timeout:
+                raise Exception(f"Download made no progress for {stalled:.0f}s during streaming upload")
+            self._changed.clear()
+            try:
+                # Bounded so a poller that died can't leave the upload waiting forever
+                await asyncio.wait_for(self._changed.wait(), timeout=self.stall_timeout - stalled)
+            except asyncio.TimeoutError:
+                pass
+
+
+class UploadClient:
+    """A pyrogram client that can upload, with its size limit and current load"""
+
+    def __init__(self, client: Client, name: str, max_upload_size: int, is_bot: bool = False):
+        self.client = client
+        self.name = name
+        self.max_upload_size = max_upload_size
+        self.is_bot = is_bot
+        self.active = 0
+
+
+class UploadClientPool:
+    """Routes uploads to the bot or user-session clients.
+
+    A client is eligible when the file fits its upload limit; among those the
+    one not in FloodWait with the fewest running uploads wins, preferring user
+    sessions (faster, and they keep the bot's own limits free) on ties.
+    """
+
+    def __init__(self, flood_until: Callable[[Client], float] = None):
+        self.clients: List[UploadClient] = []
+        self.flood_until = flood_until or (lambda client: 0.0)
+
+    def add(self, client: Client, name: str, max_upload_size: int, is_bot: bool = False) -> UploadClient:
+        entry = UploadClient(client, name, max_upload_size, is_bot)
+        self.clients.append(entry)
+        return entry
+
+    @property
+    def max_upload_size(self) -> int:
+        return max((entry.max_upload_size for entry in self.clients), default=0)
+
+    def pick(self, size: int) -> Optional[UploadClient]:
+        eligible = [entry for entry in self.clients if size <= entry.max_upload_size]
+        if not eligible:
+            return None
+        now = time.monotonic()
+        return min(eligible, key=lambda entry: (
+            max(0.0, self.flood_until(entry.client) - now),
+            entry.active,
+            entry.is_bot
+        ))
+
+    @asynccontextmanager
+    async def acquire(self, size: int):
+        """Hold the best client for the duration of one upload"""
+        entry = self.pick(size)
+        if entry is None:
+            raise Exception(f"No upload client can send {size} bytes")
+        entry.active += 1
+        try:
+            yield entry
+        finally:
+            entry.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {entry.name: entry.active for entry in self.clients}
@@ -0,0 +1,215 @@
+# web_server.py
+import asyncio
+import html
+import ipaddress
+import logging
+import re
+import socket
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+from aiohttp import web
+from aiohttp.resolver import ThreadedResolver
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r"{{\s*(\w+)\s*}}")
+
+
+def is_http_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+
+
+def is_public_address(host: str) -> bool:
+    """False for private, loopback, link-local and other non-routable addresses"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    if getattr(address, "ipv4_mapped", None):
+        address = address.ipv4_mapped
+    return not (address.is_private or address.is_loopback or address.is_link_local or
+                address.is_reserved or address.is_multicast or address.is_unspecified)
+
+
+class PublicResolver(ThreadedResolver):
+    """Resolves names to public addresses only, so probes can't reach the bot's own network"""
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        addresses = [entry for entry in await super().resolve(host, port, family)
+                     if is_public_address(entry["host"])]
+        if not addresses:
+            raise OSError(f"{host} has no public address")
+        return addresses
+
+
+class PlayerServer:
+    """aiohttp server for the web player, run on the bot's own event loop.
+
+    ``/player`` renders ``templates/index.html``; ``/api/video-info`` answers
+    size and content type from the stream proxy or the extraction cache when
+    the URL is known there, otherwise from a HEAD probe whose result is
+    cached. Only hosts ``probe_allowed`` accepts are probed, and only at
+    public addresses (redirects included). ``/stream/<token>`` is served
+    by the optional stream proxy and ``/metrics`` exposes Prometheus
+    metrics. Upstream probes share one pooled client session and
+    concurrent probes of the same URL share one request.
+    """
+
+    PROBE_TTL = 600
+    MAX_PROBES = 5000
+    MAX_REDIRECTS = 5
+
+    def __init__(self, host: str, port: int, template_path: str,
+                 lookup: Callable[[str], Optional[Dict[str, Any]]] = None,
+                 probe_allowed: Callable[[str], bool] = None,
+                 stream_proxy=None, user_agent: str = "Mozilla/5.0"):
+        self.host = host
+        self.port = port
+        self.lookup = lookup or (lambda url: None)
+        self.probe_allowed = probe_allowed or (lambda url: False)
+        self.stream_proxy = stream_proxy
+        self.user_agent = user_agent
+        with open(template_path, encoding="utf-8") as f:
+            self.template = f.read()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._probes: "OrderedDict[str, tuple]" = OrderedDict()  # url -> (info, expires)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/", self.health)
+        self.app.router.add_get("/player", self.player)
+        self.app.router.add_get("/api/video-info", self.video_info)
+        self.app.router.add_get("/metrics", self.export_metrics)
+        if stream_proxy:
+            self.app.router.add_get("/stream/{token}", stream_proxy.handle)
+
+    def render(self, **values) -> str:
+        """Fill ``{{ name }}`` placeholders with HTML-escaped values"""
+        return PLACEHOLDER.sub(lambda m: html.escape(str(values.get(m.group(1), ""))), self.template)
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, resolver=PublicResolver()),
+            timeout=aiohttp.ClientTimeout(total=15),
+            headers={"User-Agent": self.user_agent}
+        )
+        self._runner = web.AppRunner(self.app, access_log=None)
+        if self.stream_proxy:
+            await self.stream_proxy.start()
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Web player listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.stream_proxy:
+            await self.stream_proxy.stop()
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def export_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.REGISTRY.expose(), content_type="text/plain",
+                            headers={"Cache-Control": "no-store"}, charset="utf-8")
+
+    async def player(self, request: web.Request) -> web.Response:
+        video_url = request.query.get("video", "")
+        if not video_url:
+            raise web.HTTPBadRequest(text="Missing video parameter")
+        if not is_http_url(video_url):
+            # javascript: or data: in the player's src/href would run on this origin
+            raise web.HTTPBadRequest(text="Invalid video parameter")
+        title = request.query.get("title", "Video")
+        return web.Response(
+            text=self.render(video_url=video_url, title=title),
+            content_type="text/html",
+            headers={"Cache-Control": "private, max-age=300"}
+        )
+
+    async def video_info(self, request: web.Request) -> web.Response:
+        url = request.query.get("url", "")
+        if not is_http_url(url):
+            return web.json_response({"error": "Invalid url"}, status=400)
+
+        path = urlparse(url).path
+        if self.stream_proxy and path.startswith("/stream/"):
+            share_id = self.stream_proxy.share_for(path[len("/stream/"):])
+            source = await self.stream_proxy.source(share_id) if share_id else None
+            if source is None:
+                return web.json_response({"error": "Video unavailable"}, status=502)
+            return web.json_response({"size": source.size, "type": "video/mp4", "filename": source.filename})
+
+        known = self.lookup(url)
+        if known and known.get("size_bytes"):
+            return web.json_response({"size": int(known["size_bytes"]), "type": "video/mp4",
+                                      "filename": known.get("filename")})
+        if not self.probe_allowed(url):
+            return web.json_response({"error": "Unknown host"}, status=403)
+        info = await self.probe(url)
+        if info is None:
+            return web.json_response({"error": "Video unavailable"}, status=502)
+        return web.json_response(info)
+
+    async def probe(self, url: str) -> Optional[Dict[str, Any]]:
+        """Size and type of ``url`` from a cached HEAD request"""
+        entry = self._probes.get(url)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        task = self._inflight.get(url)
+        if task is None:
+            task = self._inflight[url] = asyncio.create_task(self._head(url))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _reachable(url: str) -> bool:
+        # Names are checked by PublicResolver; IP literals never reach a resolver
+        host = urlparse(url).hostname or ""
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return bool(host)
+        return is_public_address(host)
+
+    async def _head(self, url: str) -> Optional[Dict[str, Any]]:
+        target = url
+        try:
+            # Redirects are followed by hand so every hop is checked
+            for _ in range(self.MAX_REDIRECTS + 1):
+                if not is_http_url(target) or not self._reachable(target):
+                    logger.warning(f"HEAD probe refused for {target[:80]}")
+                    return None
+                async with self.session.head(target, allow_redirects=False) as response:
+                    location = response.headers.get("Location")
+                    if response.status in (301, 302, 303, 307, 308) and location:
+                        target = urljoin(target, location)
+                        continue
+                    if response.status >= 400:
+                        return None
+                    info = {
+                        "size": int(response.headers.get("Content-Length", 0)),
+                        "type": response.headers.get("Content-Type", "video/mp4")
+                    }
+                    break
+            else:
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+            logger.warning(f"HEAD probe failed for {url[:80]}: {e}")
+            return None
+        self._probes[url] = (info, time.monotonic() + self.PROBE_TTL)
+        while len(self._probes) > self.MAX_PROBES:
+            self._probes.popitem(last=False)
+        return info